@@ -0,0 +1,124 @@
+"""
+item_benchmark
+====================================================
+Measure how many items per second can be created from a shairport-sync metadata pipe stream. The xml based
+`Item.item_from_xml_string` path is compared against the `ItemTokenizer` which uses `Item.from_pipe_fields`.
+Additionally the memory required to keep all items of the stream alive is reported.
+
+Usage: python -m benchmarks.item_benchmark [path to a recorded pipe stream]
+If no recording is given, a synthetic stream with typical track changes and progress updates is used.
+"""
+import sys
+import tracemalloc
+from base64 import b64encode
+from binascii import hexlify
+from timeit import default_timer
+
+from shairportmetadatareader.item import Item
+from shairportmetadatareader.tokenizer import ItemTokenizer
+
+# pylint: disable=C0103
+
+
+def make_item(item_type, code, data=None):
+    """
+    :return: pipe representation of a single item as bytes
+    """
+    header = b"<item><type>" + hexlify(item_type) + b"</type><code>" + hexlify(code) + b"</code>"
+    if data is None:
+        return header + b"<length>0</length></item>\n"
+    return header + b"<length>" + str(len(data)).encode() + b"</length>\n<data encoding=\"base64\">\n" + \
+        b64encode(data) + b"</data></item>\n"
+
+
+def synthetic_stream(tracks=200):
+    """
+    Create a stream which looks like a recording of a real airplay session.
+    :param tracks: number of track changes
+    :return: stream as bytes
+    """
+    parts = [make_item(b"ssnc", b"snua", b"AirPlay/371.4.7"), make_item(b"ssnc", b"daid", b"8AAA12C66D4A790A")]
+    for i in range(tracks):
+        parts.append(make_item(b"ssnc", b"mdst", b"2722018600"))
+        parts.append(make_item(b"core", b"minm", "Track {0}".format(i).encode()))
+        parts.append(make_item(b"core", b"asar", b"Artist"))
+        parts.append(make_item(b"core", b"asal", b"Album"))
+        parts.append(make_item(b"core", b"astm", b"\x00\x03\x4b\xc0"))
+        parts.append(make_item(b"core", b"mper", b"\x77\x1d\x3c\x84\x6e\x58\x7f\xc8"))
+        parts.append(make_item(b"ssnc", b"mden", b"2722018600"))
+        for _ in range(10):
+            parts.append(make_item(b"ssnc", b"prgr", b"1056687241/1056692825/1072016845"))
+            parts.append(make_item(b"ssnc", b"pvol", b"-24.56,-30.00,-96.30,0.00"))
+    return b"".join(parts)
+
+
+def bench_xml(stream):
+    """
+    Create all items with the xml parser by splitting the stream line by line like the old pipe listener.
+    :return: number of items
+    """
+    count = 0
+    tmp = ""
+    for line in stream.decode("utf-8").splitlines():
+        strip_line = line.strip()
+        if strip_line.endswith("</item>"):
+            count += Item.item_from_xml_string(tmp + strip_line) is not None
+            tmp = ""
+        elif strip_line.startswith("<item>"):
+            tmp = strip_line
+        else:
+            tmp += strip_line
+    return count
+
+
+def bench_tokenizer(stream, chunk_size=65536):
+    """
+    Create all items with the tokenizer by feeding the stream in chunks like the pipe listener.
+    :return: number of items
+    """
+    tokenizer = ItemTokenizer()
+    count = 0
+    for i in range(0, len(stream), chunk_size):
+        count += len(tokenizer.feed(stream[i:i+chunk_size]))
+    return count
+
+
+def run(name, func, stream, repeat=5):
+    """
+    Run a benchmark function and print the best result.
+    """
+    best = None
+    count = 0
+    for _ in range(repeat):
+        start = default_timer()
+        count = func(stream)
+        duration = default_timer() - start
+        best = duration if best is None else min(best, duration)
+    print("{0:<12} {1:>8} items {2:>12.0f} items/sec".format(name, count, count / best))
+
+
+def bench_memory(stream, copies=20):
+    """
+    Print the average memory required per item if all items are kept in memory e.g. for a history.
+    """
+    tokenizer = ItemTokenizer()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    items = []
+    for _ in range(copies):
+        items += tokenizer.feed(stream)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{0:<12} {1:>8} items {2:>12.1f} bytes/item".format("memory", len(items), (size - start) / len(items)))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as f:
+            stream_data = f.read()
+    else:
+        stream_data = synthetic_stream()
+
+    run("xml", bench_xml, stream_data)
+    run("tokenizer", bench_tokenizer, stream_data)
+    bench_memory(stream_data)
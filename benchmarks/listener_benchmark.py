@@ -0,0 +1,353 @@
+"""
+listener_benchmark
+====================================================
+Drive a metadata stream end to end through the pipe, udp and mqtt listeners using local stand-ins for shairport-sync:
+a fifo writer, a loopback udp sender and a fake mqtt client which delivers the messages without a broker.
+
+The stream is either synthetic (track changes, progress and volume updates) or replayed from a capture file recorded
+with `CaptureWriter`. Every 50th message is a probe containing the time it was written. The latency is measured from
+writing a probe until the listener published the new property value.
+
+Each backend runs in its own process, so that the peak RSS and CPU time of the backends do not influence each other.
+For each backend the processed items per second, the p50/p99 latency, the CPU time and the peak RSS are reported as
+JSON, which allows tracking regressions between releases. A run in which not all items were processed (e.g. udp
+datagrams dropped by the kernel, see `drop_counts` of the udp result) is marked with `"valid": false` and its
+throughput is not comparable with other runs.
+
+Usage: python -m benchmarks.listener_benchmark [--messages N] [--capture FILE] [--udp-rate N] [--output FILE]
+       [backend ...]
+"""
+import os
+import sys
+import json
+import socket
+import shutil
+import argparse
+import platform
+import tempfile
+import resource
+from time import sleep, monotonic, process_time, time
+from threading import Thread, Event
+from multiprocessing import Process, Pipe
+
+# kivy parses the command line arguments on import unless this is set
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+
+# pylint: disable=C0413
+from shairportmetadatareader.capture import read_capture
+from shairportmetadatareader.listener.airplaypipelistener import AirplayPipeListener
+from shairportmetadatareader.listener.airplayudplistener import AirplayUDPListener
+
+from .item_benchmark import make_item
+
+try:
+    from shairportmetadatareader.listener.airplaymqttlistener import AirplayMQTTListener
+except ImportError:
+    AirplayMQTTListener = None
+
+# pylint: disable=C0103
+
+LOCALHOST = "127.0.0.1"
+BACKENDS = ("pipe", "udp", "mqtt")
+
+# every PROBE_INTERVAL messages a probe with the current time is send
+PROBE_INTERVAL = 50
+PROBE = (b"ssnc", b"snua")
+
+# default number of datagrams per second send to the udp listener
+UDP_RATE = 20000
+
+# time in seconds to wait for outstanding items after the sender finished
+IDLE_TIMEOUT = 2.0
+
+
+def synthetic_messages(count):
+    """
+    Create messages which look like a recording of a real airplay session.
+    :param count: number of messages
+    :return: list of (type, code, data) tuples
+    """
+    messages = []
+    track = 0
+    while len(messages) < count:
+        track += 1
+        messages += [(b"ssnc", b"mdst", b""), (b"core", b"minm", "Track {0}".format(track).encode()),
+                     (b"core", b"asar", b"Artist"), (b"core", b"asal", b"Album"),
+                     (b"core", b"astm", b"\x00\x03\x4b\xc0"), (b"ssnc", b"mden", b"")]
+        messages += [(b"ssnc", b"prgr", "{0}/{1}/{2}".format(1000, 1000 + i * 44100, 10000000).encode())
+                     for i in range(20)]
+        messages += [(b"ssnc", b"pvol", b"-24.56,-30.00,-96.30,0.00")]
+    return messages[:count]
+
+
+def capture_messages(path):
+    """
+    Load the messages of a capture file.
+    :param path: path to the capture file
+    :return: list of (type, code, data) tuples
+    """
+    return [(item.type.encode("latin-1"), item.code.encode("latin-1"), item.data_bytes or b"")
+            for _, item in read_capture(path)]
+
+
+def stream(messages):
+    """
+    Insert the probes into the messages. The probe data is created when the probe is send.
+    :return: generator of (type, code, data) tuples
+    """
+    for i, message in enumerate(messages):
+        if i % PROBE_INTERVAL == 0:
+            yield PROBE + (str(monotonic()).encode(),)
+        yield message
+
+
+def stream_length(messages):
+    """
+    :return: number of messages including the probes
+    """
+    return len(messages) + (len(messages) + PROBE_INTERVAL - 1) // PROBE_INTERVAL
+
+
+# ------------------------------------------------------ senders -------------------------------------------------------
+
+def send_pipe(path, messages):
+    """
+    Write the messages to the fifo in the shairport-sync pipe format.
+    """
+    with open(path, "wb", buffering=0) as pipe:
+        for item_type, code, data in stream(messages):
+            pipe.write(make_item(item_type, code, data or None))
+
+
+def send_udp(address, messages, rate, burst_size=64):
+    """
+    Send the messages as datagrams. The datagrams are send in small bursts paced to the given rate to avoid
+    overflowing the receive buffer.
+    :param rate: datagrams per second
+    """
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = monotonic()
+    for i, (item_type, code, data) in enumerate(stream(messages)):
+        sender.sendto(item_type + code + data, address)
+        if i % burst_size == burst_size - 1:
+            delay = start + (i + 1) / rate - monotonic()
+            if delay > 0:
+                sleep(delay)
+    sender.close()
+
+
+class FakeMessage(object): # pylint: disable=R0205, R0903
+    """
+    Stand-in for paho.mqtt.client.MQTTMessage.
+    """
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def send_mqtt(listener, messages):
+    """
+    Deliver the messages to the listener like the network thread of the paho client does.
+    """
+    for item_type, code, data in stream(messages):
+        topic = "/benchmark/{0}/{1}".format(item_type.decode(), code.decode())
+        listener.receive_message(None, None, FakeMessage(topic, data))
+
+
+# ------------------------------------------------------ measuring -----------------------------------------------------
+
+class Measurement(object): # pylint: disable=R0205
+    """
+    Count the processed items and the probe latencies of a listener.
+    """
+    def __init__(self, listener, expected):
+        super(Measurement, self).__init__()
+        self.expected = expected
+        self.items = 0
+        self.latencies = []
+        self.first = None
+        self.last = None
+        self.done = Event()
+        listener.bind(user_agent=self.on_probe)
+
+        # the item property is not dispatched for an item which equals the previous one => count in _process_item
+        process_item = listener._process_item # pylint: disable=W0212
+
+        def counting_process_item(item):
+            process_item(item)
+            self.on_item()
+        listener._process_item = counting_process_item # pylint: disable=W0212
+
+    def on_item(self):
+        """
+        Count each processed item.
+        """
+        self.last = monotonic()
+        if self.first is None:
+            self.first = self.last
+        self.items += 1
+        if self.items >= self.expected:
+            self.done.set()
+
+    def on_probe(self, _, value):
+        """
+        The user agent changed => a probe was processed.
+        """
+        try:
+            self.latencies.append(monotonic() - float(value))
+        except ValueError:
+            pass  # user agent of a replayed capture
+
+    def wait(self):
+        """
+        Wait until all items were processed or no item was processed for IDLE_TIMEOUT seconds.
+        """
+        seen = -1
+        while not self.done.wait(IDLE_TIMEOUT) and seen != self.items:
+            seen = self.items
+
+    def result(self):
+        """
+        :return: dictionary with the throughput and latency
+        """
+        latencies = sorted(self.latencies)
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))] * 1000 \
+            if latencies else None
+        duration = (self.last - self.first) if self.items > 1 else None
+        return {"items": self.items, "expected": self.expected, "valid": self.items >= self.expected,
+                "items_per_second": self.items / duration if duration else None,
+                "latency_p50_ms": percentile(50), "latency_p99_ms": percentile(99)}
+
+
+def run_pipe(messages):
+    """
+    Benchmark the pipe listener with a fifo writer process.
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "shairport-sync-metadata")
+    os.mkfifo(path)
+    try:
+        listener = AirplayPipeListener(pipe_name=path)
+        measurement = Measurement(listener, stream_length(messages))
+        thread = Thread(target=listener.parse_pipe)
+        thread.daemon = True
+        thread.start()
+
+        sender = Process(target=send_pipe, args=(path, messages))
+        sender.start()
+        measurement.wait()
+        sender.join()
+        listener._is_listening = False # pylint: disable=W0212
+        return measurement.result()
+    finally:
+        shutil.rmtree(directory)
+
+
+def run_udp(messages, udp_rate=UDP_RATE):
+    """
+    Benchmark the udp listener with a loopback sender process.
+    :param udp_rate: datagrams per second send by the sender
+    """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind((LOCALHOST, 0))
+    address = probe.getsockname()
+    probe.close()
+
+    listener = AirplayUDPListener(socket_address=address[0], socket_port=address[1], receive_buffers=64)
+    measurement = Measurement(listener, stream_length(messages))
+    thread = Thread(target=listener.parse_socket)
+    thread.daemon = True
+    thread.start()
+    sleep(0.1)  # wait till the socket is bound
+
+    sender = Process(target=send_udp, args=(address, messages, udp_rate))
+    sender.start()
+    measurement.wait()
+    sender.join()
+    # read the counters while the socket is still open
+    drop_counts = listener.drop_counts
+    listener._is_listening = False # pylint: disable=W0212
+    result = measurement.result()
+    result["drop_counts"] = drop_counts
+    return result
+
+
+def run_mqtt(messages):
+    """
+    Benchmark the mqtt listener with a fake client thread.
+    """
+    listener = AirplayMQTTListener(topic="benchmark")
+    measurement = Measurement(listener, stream_length(messages))
+    sender = Thread(target=send_mqtt, args=(listener, messages))
+    sender.start()
+    measurement.wait()
+    sender.join()
+    return measurement.result()
+
+
+RUNNERS = {"pipe": run_pipe, "udp": run_udp, "mqtt": run_mqtt}
+
+
+def run_backend(backend, messages, options, connection):
+    """
+    Run a single backend inside the current process and send the result to the parent process.
+    """
+    start = process_time()
+    result = RUNNERS[backend](messages, **options)
+    result["cpu_seconds"] = process_time() - start
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_bytes"] = max_rss if sys.platform == "darwin" else max_rss * 1024
+    connection.send(result)
+    connection.close()
+
+
+def benchmark(backend, messages, **options):
+    """
+    Run a backend in a new process.
+    :param options: keyword arguments of the runner of the backend
+    :return: dictionary with the results
+    """
+    if backend == "mqtt" and AirplayMQTTListener is None:
+        return {"skipped": "paho-mqtt is not installed"}
+
+    receiver, sender = Pipe(duplex=False)
+    process = Process(target=run_backend, args=(backend, messages, options, sender))
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+
+def main():
+    """
+    Run the benchmarks and print the results as json.
+    """
+    parser = argparse.ArgumentParser(description="End to end benchmark of the listener backends.")
+    parser.add_argument("backends", nargs="*", help="backends to benchmark: pipe, udp or mqtt (default: all)")
+    parser.add_argument("--messages", type=int, default=20000, help="number of synthetic messages")
+    parser.add_argument("--capture", help="replay the messages of a capture file instead of synthetic messages")
+    parser.add_argument("--udp-rate", type=int, default=UDP_RATE, help="datagrams per second send to the udp listener")
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    args = parser.parse_args()
+    for backend in args.backends:
+        if backend not in BACKENDS:
+            parser.error("unknown backend: {0}".format(backend))
+
+    messages = capture_messages(args.capture) if args.capture else synthetic_messages(args.messages)
+    options = {"udp": {"udp_rate": args.udp_rate}}
+    results = {"timestamp": time(), "python": platform.python_version(), "platform": platform.platform(),
+               "source": args.capture or "synthetic", "messages": stream_length(messages),
+               "backends": {backend: benchmark(backend, messages, **options.get(backend, {}))
+                            for backend in args.backends or BACKENDS}}
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+udp_benchmark
+====================================================
+Replay a burst of shairport-sync udp datagrams over the loopback interface and measure how fast AirplayUDPListener
+receives and processes them. The default receive mode (a new buffer for every datagram) is compared against the
+ring of preallocated receive buffers.
+
+For each mode the number of datagrams per second and the peak memory allocated while receiving and processing a
+single datagram are reported. The datagrams are send by a separate process so that the sender does not compete with
+the listener for the GIL. The share of the received datagrams and the kernel drops are reported as well, a run which
+lost more than MAX_LOSS of the datagrams is marked as invalid because its rate is limited by the drops and not by the
+listener.
+
+Usage: python -m benchmarks.udp_benchmark [number of datagrams]
+"""
+import sys
+import socket
+import tracemalloc
+from time import sleep
+from threading import Thread, Event
+from timeit import default_timer
+from multiprocessing import Process
+
+from shairportmetadatareader.listener.airplayudplistener import AirplayUDPListener
+
+# pylint: disable=C0103
+
+LOCALHOST = "127.0.0.1"
+
+# maximum share of lost datagrams of a valid run
+MAX_LOSS = 0.01
+
+# typical datagrams send by shairport-sync during playback
+BURST = [b"ssncprgr1056687241/1056692825/1072016845", b"ssncpvol-24.56,-30.00,-96.30,0.00",
+         b"coreminmTrack name", b"coreasarArtist", b"coreasalAlbum", b"coreastm\x00\x03\x4b\xc0",
+         b"ssncmdst", b"ssncmden"]
+
+
+class CountingListener(AirplayUDPListener):
+    """
+    Listener which stops after it received the given number of items.
+    """
+    def __init__(self, count, trace_memory=False, **kwargs):
+        super(CountingListener, self).__init__(socket_address=LOCALHOST, socket_port=free_port(), **kwargs)
+        self.remaining = count
+        self.trace_memory = trace_memory
+        self.peaks = []   # peak memory allocated for each datagram
+        self.first = None  # time when the first item was received
+        self.last = None   # time when the last item was received
+        self.done = Event()
+
+    def _process_item(self, item):
+        super(CountingListener, self)._process_item(item)
+        self.last = default_timer()
+        if self.first is None:
+            self.first = self.last
+
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peaks.append(peak - current)
+            tracemalloc.reset_peak()
+
+        self.remaining -= 1
+        if self.remaining == 0:
+            self._is_listening = False
+            self.done.set()
+
+
+def free_port():
+    """
+    :return: free udp port on the loopback interface
+    """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind((LOCALHOST, 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def send(port, count, burst_size=64):
+    """
+    Send count datagrams to the given port. The datagrams are send in small bursts to avoid overflowing the receive
+    buffer of the listener.
+    """
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for i in range(count):
+        sender.sendto(BURST[i % len(BURST)], (LOCALHOST, port))
+        if i % burst_size == burst_size - 1:
+            sleep(0.0005)
+    sender.close()
+
+
+def receive(count, trace_memory=False, **kwargs):
+    """
+    Send count datagrams to a new listener.
+    :return: listener after all datagrams were received or the timeout was reached
+    """
+    listener = CountingListener(count, trace_memory=trace_memory, **kwargs)
+    thread = Thread(target=listener.parse_socket)
+    thread.daemon = True
+    thread.start()
+    sleep(0.1)  # wait till the socket is bound
+
+    sender = Process(target=send, args=(listener.socket_addr[1], count))
+    sender.start()
+    sender.join()
+    listener.done.wait(5)
+    listener._is_listening = False # pylint: disable=W0212
+    return listener
+
+
+def run(name, count, **kwargs):
+    """
+    Measure the throughput and the memory per datagram of a receive mode and print the results.
+    """
+    listener = receive(count, **kwargs)
+    received = count - listener.remaining
+    drops = listener.drop_counts["kernel"]
+
+    tracemalloc.start()
+    traced = receive(min(count, 2000), trace_memory=True, **kwargs)
+    tracemalloc.stop()
+    peaks = sorted(traced.peaks)
+
+    print("{0:<10} {1:>8} datagrams {2:>10.0f} datagrams/sec {3:>10.0f} bytes/datagram (median peak) "
+          "{4:>6.1%} received {5:>6} kernel drops{6}".format(
+              name, received, received / max(listener.last - listener.first, 1e-9), peaks[len(peaks)//2],
+              received / float(count), "?" if drops is None else drops,
+              "" if received >= count * (1 - MAX_LOSS) else " INVALID"))
+
+
+if __name__ == "__main__":
+    datagrams = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    run("recvfrom", datagrams)
+    run("ring", datagrams, receive_buffers=64)
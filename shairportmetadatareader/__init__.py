@@ -5,17 +5,38 @@ import os
 import logging
 
 from .shairport import start_shairport_daemon, stop_shairport_daemon
-from .listener import AirplayPipeListener, AirplayUDPListener, DEFAULT_PIPE_FILE, DEFAULT_ADDRESS, DEFAULT_PORT
+from .listener import AirplayPipeListener, AirplayUDPListener, AirplayReplayListener, DEFAULT_PIPE_FILE, \
+    DEFAULT_ADDRESS, DEFAULT_PORT
+from .capture import CaptureWriter, read_capture
+from .metrics import ListenerMetrics, MetricsServer
+from .profiling import StageProfiler
 from .remote import AirplayRemote, AirplayCommand
 
 
-__all__ = ["AirplayPipeListener", "AirplayUDPListener", "DEFAULT_PIPE_FILE", "DEFAULT_ADDRESS", "DEFAULT_PORT",
-           "start_shairport_daemon", "stop_shairport_daemon", "AirplayRemote", "AirplayCommand"]
+__all__ = ["AirplayPipeListener", "AirplayUDPListener", "AirplayReplayListener", "DEFAULT_PIPE_FILE", "DEFAULT_ADDRESS",
+           "DEFAULT_PORT", "start_shairport_daemon", "stop_shairport_daemon", "AirplayRemote", "AirplayCommand",
+           "CaptureWriter", "read_capture", "ListenerMetrics", "MetricsServer",
+           "StageProfiler"]
+
+# Import asyncio backends and the listener hub if they are supported by this python version.
+try:
+    from .listener import AsyncAirplayUDPListener, AsyncAirplayPipeListener, ListenerHub
+    from .stateserver import StateServer
+    __all__ += ["AsyncAirplayUDPListener", "AsyncAirplayPipeListener", "ListenerHub", "StateServer"]
+except ImportError:
+    pass
+
+# Import the callback dispatcher if concurrent.futures is available.
+try:
+    from .dispatcher import CallbackDispatcher
+    __all__ += ["CallbackDispatcher"]
+except ImportError:
+    pass
 
 # Import mqtt backend if the necessary frameworks are available.
 try:
-    from .listener import AirplayMQTTListener, DEFAULT_BROKER, DEFAULT_MQTT_PORT
-    __all__ += ["AirplayMQTTListener", "DEFAULT_BROKER", "DEFAULT_MQTT_PORT"]
+    from .listener import AirplayMQTTListener, MQTTHub, MQTTStatePublisher, DEFAULT_BROKER, DEFAULT_MQTT_PORT
+    __all__ += ["AirplayMQTTListener", "MQTTHub", "MQTTStatePublisher", "DEFAULT_BROKER", "DEFAULT_MQTT_PORT"]
 except ImportError:
     pass
 
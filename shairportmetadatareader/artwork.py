@@ -0,0 +1,365 @@
+"""
+Content addressed storage for the artwork send by shairport-sync. Each image is identified by the hash of its data,
+therefore a repeated cover is only stored once and always published with the same key and path.
+
+The store consists of a small LRU memory tier holding the image data and an optional disk tier. The disk tier
+deletes the least recently used files if its size limit is exceeded.
+
+The ArtworkIndex additionally maps album identifiers to the stored images and keeps prebuilt thumbnails.
+"""
+import os
+import re
+import logging
+import sqlite3
+import tempfile
+from io import BytesIO
+from time import time
+from hashlib import sha1
+from threading import Lock
+from collections import OrderedDict
+
+from .util import image_extension
+
+# Thumbnails are only created if pillow is available.
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+logger = logging.getLogger("AirplayListenerLogger") # pylint: disable=C0103
+
+# default directory of the disk tier
+DEFAULT_ARTWORK_DIR = os.path.join(tempfile.gettempdir(), "shairport-artwork")
+
+# keys of the stored images (sha1 hex digest)
+HASH_PATTERN = re.compile(r"^[0-9a-f]{40}$")
+
+
+class ArtworkStore(object): # pylint: disable=R0205, R0902
+    """
+    Store artwork by the hash of its data with an in memory LRU cache and an optional size limited disk cache.
+    """
+    def __init__(self, directory=DEFAULT_ARTWORK_DIR, max_memory_items=8, max_disk_bytes=64 * 1024 * 1024):
+        """
+        :param directory: directory of the disk tier or None to keep the artwork only in memory
+        :param max_memory_items: maximum number of images kept in memory
+        :param max_disk_bytes: maximum total size of all images inside the directory
+        """
+        super(ArtworkStore, self).__init__()
+        self.directory = directory
+        self._max_memory_items = max_memory_items
+        self._max_disk_bytes = max_disk_bytes
+        self._lock = Lock()
+        self._memory = OrderedDict()  # key => image data, least recently used first
+        self._files = OrderedDict()   # key => (path, size), least recently used first
+        self._derived = {}            # key => list of (path, size) of files created from the image e.g. thumbnails
+        self._disk_bytes = 0
+
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._scan_directory()
+
+    @staticmethod
+    def key_for(data):
+        """
+        :param data: image data as binary
+        :return: content hash used as key for the image
+        """
+        return sha1(data).hexdigest()
+
+    def put(self, data):
+        """
+        Add an image. Storing the same image again only marks it as recently used.
+        :param data: image data as binary
+        :return: key of the image
+        """
+        key = self.key_for(data)
+        data = bytes(data)
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self._max_memory_items:
+                self._memory.popitem(last=False)
+
+            if self.directory is not None:
+                if key in self._files:
+                    self._files.move_to_end(key)
+                else:
+                    self._write(key, data)
+        return key
+
+    def get(self, key):
+        """
+        :param key: key of the image
+        :return: image data or None if the image is not stored anymore
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+            entry = self._files.get(key)
+
+        if entry is None:
+            return None
+        try:
+            with open(entry[0], "rb") as file:
+                return file.read()
+        except IOError:
+            return None
+
+    def path(self, key):
+        """
+        :param key: key of the image
+        :return: path of the image file or None if the image is not stored on disk
+        """
+        entry = self._files.get(key)
+        return entry[0] if entry else None
+
+    def attach(self, key, path):
+        """
+        Register a file which was created from an image e.g. a thumbnail. The file counts towards the disk limit and is
+        deleted together with the image.
+        :param key: key of the image
+        :param path: path of the derived file
+        :return: False if the image is not stored on disk anymore, the file is deleted in this case
+        """
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+                derived = self._derived.setdefault(key, [])
+                # a file which is registered again (e.g. a recreated thumbnail) is only counted once
+                for entry in [entry for entry in derived if entry[0] == path]:
+                    derived.remove(entry)
+                    self._disk_bytes -= entry[1]
+                derived.append((path, size))
+                self._disk_bytes += size
+                self._evict()
+                return True
+        self._remove_file(path)
+        return False
+
+    def __contains__(self, key):
+        return key in self._memory or key in self._files
+
+    @property
+    def disk_usage(self):
+        """
+        :return: total size of all stored image files in bytes
+        """
+        return self._disk_bytes
+
+    def _write(self, key, data):
+        """
+        Write an image to the disk tier and delete the least recently used images if the size limit is exceeded.
+        """
+        path = os.path.join(self.directory, key + image_extension(data))
+        if not os.path.exists(path):
+            # write to a temporary file first, a reader should never see a partially written image
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.rename(tmp_path, path)
+
+        self._files[key] = (path, len(data))
+        self._disk_bytes += len(data)
+        self._evict()
+
+    def _evict(self):
+        """
+        Delete the least recently used images and their derived files until the size limit is met.
+        """
+        while self._disk_bytes > self._max_disk_bytes and len(self._files) > 1:
+            key, entry = self._files.popitem(last=False)
+            for path, size in [entry] + self._derived.pop(key, []):
+                self._disk_bytes -= size
+                self._remove_file(path)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _scan_directory(self):
+        """
+        Register the images stored by a previous run, the oldest files are evicted first.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            key, extension = os.path.splitext(name)
+            path = os.path.join(self.directory, name)
+            # skip partially written images and files which are not images e.g. the artwork index
+            if extension == ".tmp" or not HASH_PATTERN.match(key) or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, key, path, stat.st_size))
+
+        for _, key, path, size in sorted(entries):
+            self._files[key] = (path, size)
+            self._disk_bytes += size
+
+
+# store shared by all listeners without an own store, created on first use
+_default_store = None # pylint: disable=C0103
+_default_store_lock = Lock()
+
+
+def default_store():
+    """
+    Several stores on the same directory would not respect a common size limit and delete the files of each other,
+    therefore all listeners of the process share the store inside DEFAULT_ARTWORK_DIR.
+    :return: the ArtworkStore shared by all listeners without an own store
+    """
+    global _default_store # pylint: disable=W0603,C0103
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ArtworkStore()
+        return _default_store
+
+
+class ArtworkIndex(object): # pylint: disable=R0205
+    """
+    Persistent SQLite index which maps album identifiers (asai or asal + asar) to the key of the album artwork inside
+    an ArtworkStore and keeps thumbnails of each image in predefined sizes.
+    """
+    def __init__(self, store, database=None, thumbnail_sizes=(), thumbnail_format="JPEG"):
+        """
+        :param store: ArtworkStore with a disk tier which stores the images
+        :param database: path to the SQLite database (index.sqlite inside the store directory if None)
+        :param thumbnail_sizes: maximum width and height of the thumbnails which are created for each new image. The
+        thumbnails are only created if pillow is installed.
+        :param thumbnail_format: pillow image format of the thumbnails
+        """
+        super(ArtworkIndex, self).__init__()
+        if store.directory is None:
+            raise ValueError("The artwork index requires an artwork store with a directory.")
+
+        self.store = store
+        self.thumbnail_sizes = tuple(thumbnail_sizes)
+        self._thumbnail_format = thumbnail_format
+        self._thumbnail_dir = os.path.join(store.directory, "thumbnails")
+        self._lock = Lock()
+        self._db = sqlite3.connect(database or os.path.join(store.directory, "index.sqlite"), check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS albums (album TEXT PRIMARY KEY, key TEXT NOT NULL, "
+                             "updated REAL NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS thumbnails (key TEXT NOT NULL, size INTEGER NOT NULL, "
+                             "path TEXT NOT NULL, PRIMARY KEY (key, size))")
+        self._attach_thumbnails()
+
+    def _attach_thumbnails(self):
+        """
+        Register the thumbnails of a previous run with the store, so that they count towards its disk limit. The
+        thumbnails of images which were evicted in the meantime are deleted.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT key, size, path FROM thumbnails").fetchall()
+        stale = [(key, size) for key, size, path in rows
+                 if not (os.path.exists(path) and self.store.attach(key, path))]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM thumbnails WHERE key = ? AND size = ?", stale)
+
+    @staticmethod
+    def album_ids(track_info):
+        """
+        :param track_info: track information as published by the AirplayListener
+        :return: list of identifiers for the album of the track
+        """
+        ids = []
+        if track_info.get("songalbumid"):
+            ids.append("id:{0}".format(track_info["songalbumid"]))
+        if track_info.get("songalbum"):
+            ids.append(u"name:{0}\x1f{1}".format(track_info.get("songartist", ""), track_info["songalbum"]))
+        return ids
+
+    def add(self, data, track_info=None):
+        """
+        Store an image, map the album of the track to it and create the missing thumbnails.
+        :param data: image data as binary
+        :param track_info: track information of the track the image belongs to
+        :return: key of the image
+        """
+        key = self.store.put(data)
+        now = time()
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO albums (album, key, updated) VALUES (?, ?, ?)",
+                                 [(album, key, now) for album in self.album_ids(track_info or {})])
+
+        for size in self.thumbnail_sizes:
+            self.thumbnail(key, size, data=data)
+        return key
+
+    def lookup(self, track_info):
+        """
+        :param track_info: track information
+        :return: key of the album artwork or None if the album is unknown or its artwork was evicted
+        """
+        for album in self.album_ids(track_info):
+            with self._lock:
+                row = self._db.execute("SELECT key FROM albums WHERE album = ?", (album,)).fetchone()
+            if row and row[0] in self.store:
+                return row[0]
+        return None
+
+    def thumbnail(self, key, size, data=None):
+        """
+        Get the path to a thumbnail. The thumbnail is created if it does not exist yet.
+        :param key: key of the image
+        :param size: maximum width and height of the thumbnail
+        :param data: image data if it is already loaded
+        :return: path to the thumbnail or None if the image is unknown or pillow is not installed
+        """
+        with self._lock:
+            row = self._db.execute("SELECT path FROM thumbnails WHERE key = ? AND size = ?", (key, size)).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+
+        if PILImage is None:
+            return None
+        data = data if data is not None else self.store.get(key)
+        if data is None:
+            return None
+
+        if not os.path.isdir(self._thumbnail_dir):
+            os.makedirs(self._thumbnail_dir)
+        path = os.path.join(self._thumbnail_dir, "{0}_{1}.{2}".format(key, size, self._thumbnail_format.lower()))
+        try:
+            image = PILImage.open(BytesIO(data))
+            image.thumbnail((size, size))
+            if self._thumbnail_format == "JPEG" and image.mode != "RGB":
+                image = image.convert("RGB")
+            image.save(path, self._thumbnail_format)
+        except Exception: # pylint: disable=W0703
+            # truncated or unsupported images must not stop the listener thread
+            logger.warning("Could not create a thumbnail of size %s for artwork %s.", size, key, exc_info=True)
+            if os.path.exists(path):
+                os.remove(path)
+            return None
+
+        # the thumbnail is deleted by the store when the image is evicted
+        if not self.store.attach(key, path):
+            return None
+
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO thumbnails (key, size, path) VALUES (?, ?, ?)", (key, size, path))
+        return path
+
+    def thumbnail_for(self, track_info, size):
+        """
+        :param track_info: track information
+        :param size: maximum width and height of the thumbnail
+        :return: path to the thumbnail of the album artwork or None if it is not available
+        """
+        key = self.lookup(track_info)
+        return self.thumbnail(key, size) if key else None
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,114 @@
+"""
+Compact binary capture format to record the received items and replay them later.
+
+A capture file starts with a file header (magic bytes and version) followed by any number of records:
+
+    payload length (uint32) | timestamp in seconds (float64) | type (4 bytes) | code (4 bytes) | payload
+
+All numbers are big endian. New records can be appended to an existing file and the records can be read from a
+memory mapped file without parsing the whole file first. A record which was only partially written (e.g. the program
+was killed while writing) is ignored.
+"""
+import os
+import mmap
+import struct
+from time import time
+from threading import Lock
+
+from .item import Item
+
+CAPTURE_MAGIC = b"SSMC"
+CAPTURE_VERSION = 1
+
+FILE_HEADER = struct.Struct(">4sH")
+RECORD_HEADER = struct.Struct(">Id4s4s")
+
+
+class CaptureWriter(object): # pylint: disable=R0205
+    """
+    Append items to a capture file. Assign an instance to `AirplayListener.recorder` to record all received items.
+    """
+    def __init__(self, path, flush=False):
+        """
+        :param path: path to the capture file, records are appended if the file already exists
+        :param flush: flush the file after each record
+        """
+        super(CaptureWriter, self).__init__()
+        self.path = path
+        self._flush = flush
+        self._lock = Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+        else:
+            check_header(path)
+
+    def write(self, item, timestamp=None):
+        """
+        Append an item.
+        :param item: item to record
+        :param timestamp: time when the item was received (now if None)
+        """
+        payload = item.data_bytes or b""
+        header = RECORD_HEADER.pack(len(payload), time() if timestamp is None else timestamp,
+                                    item.type.encode("latin-1"), item.code.encode("latin-1"))
+        with self._lock:
+            self._file.write(header)
+            self._file.write(payload)
+            if self._flush:
+                self._file.flush()
+
+    def close(self):
+        """
+        Close the capture file.
+        """
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def check_header(path):
+    """
+    Check that a file is a capture file with a supported version.
+    :param path: path to the capture file
+    """
+    with open(path, "rb") as file:
+        header = file.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size:
+        raise ValueError("{0} is not a capture file.".format(path))
+    magic, version = FILE_HEADER.unpack(header)
+    if magic != CAPTURE_MAGIC:
+        raise ValueError("{0} is not a capture file.".format(path))
+    if version != CAPTURE_VERSION:
+        raise ValueError("Unsupported capture version: {0}".format(version))
+
+
+def read_capture(path):
+    """
+    Iterate over all records of a capture file.
+    :param path: path to the capture file
+    :return: generator of (timestamp, item) tuples
+    """
+    check_header(path)
+    if os.path.getsize(path) == FILE_HEADER.size:
+        return
+
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        offset = FILE_HEADER.size
+        while offset + RECORD_HEADER.size <= len(data):
+            length, timestamp, item_type, code = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            if start + length > len(data):
+                break  # partially written record
+            offset = start + length
+            yield timestamp, Item(item_type.decode("latin-1"), code.decode("latin-1"), length=length,
+                                  text=data[start:offset], encoding="bytes")
+    finally:
+        data.close()
@@ -0,0 +1,115 @@
+"""
+Run the callbacks bound to the properties of an AirplayListener outside of the listener thread.
+
+Example:
+    listener = AirplayUDPListener(callback_dispatcher=CallbackDispatcher(max_workers=4))
+    listener.bind(artwork=on_artwork)  # on_artwork is called on a worker thread
+"""
+import logging
+from collections import deque
+from threading import Lock
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import LatencyHistogram
+
+logger = logging.getLogger("AirplayListenerLogger")
+
+
+class CallbackDispatcher(object): # pylint: disable=R0205
+    """
+    Execute callbacks on an executor. All callbacks of the same property are executed one after another in the order
+    in which the property changed, callbacks of different properties might run in parallel.
+    """
+    def __init__(self, executor=None, max_workers=4):
+        """
+        :param executor: concurrent.futures.Executor to use (a ThreadPoolExecutor is created if None)
+        :param max_workers: number of worker threads if no executor is given
+        """
+        super(CallbackDispatcher, self).__init__()
+        self._owns_executor = executor is None
+        self._executor = executor if executor is not None else \
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="AirplayCallback")
+        self._lock = Lock()
+        self._lanes = {}       # property name => deque of pending (callback, args)
+        self._running = set()  # property names whose lane is currently processed by the executor
+        self._latencies = {}   # callback name => LatencyHistogram
+
+    def wrap(self, name, callback):
+        """
+        :param name: name of the property the callback is bound to
+        :param callback: callback to execute on the executor
+        :return: function which schedules the callback instead of calling it
+        """
+        def dispatch(*args):
+            self.dispatch(name, callback, args)
+        return dispatch
+
+    def dispatch(self, name, callback, args):
+        """
+        Schedule a callback after all previously scheduled callbacks of the same property.
+        :param name: name of the property
+        :param callback: callable
+        :param args: arguments to call the callback with
+        """
+        with self._lock:
+            self._lanes.setdefault(name, deque()).append((callback, args))
+            if name in self._running:
+                return
+            self._running.add(name)
+        self._executor.submit(self._drain, name)
+
+    def _drain(self, name):
+        """
+        Execute all pending callbacks of a property.
+        """
+        lane = self._lanes[name]
+        while True:
+            with self._lock:
+                if not lane:
+                    self._running.discard(name)
+                    return
+                callback, args = lane.popleft()
+
+            start = perf_counter()
+            try:
+                callback(*args)
+            except Exception: # pylint: disable=W0703
+                logger.exception("Exception in callback for %s.", name)
+            self._histogram(name, callback).record(perf_counter() - start)
+
+    def _histogram(self, name, callback):
+        # same named callbacks (e.g. lambdas) of different properties are measured separately
+        key = "{0}:{1}".format(name, getattr(callback, "__qualname__", None) or repr(callback))
+        histogram = self._latencies.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._latencies.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def latencies(self):
+        """
+        :return: dictionary mapping each "property:callback name" to a snapshot of its latency histogram
+        """
+        return {key: histogram.snapshot() for key, histogram in self.histograms().items()}
+
+    def histograms(self):
+        """
+        :return: dictionary mapping each "property:callback name" to its LatencyHistogram
+        """
+        return dict(self._latencies)
+
+    def pending(self):
+        """
+        :return: number of callbacks which are scheduled but not yet finished
+        """
+        with self._lock:
+            return sum(len(lane) for lane in self._lanes.values()) + len(self._running)
+
+    def shutdown(self, wait=True):
+        """
+        Shutdown the executor if it was created by this dispatcher.
+        :param wait: wait until all scheduled callbacks were executed
+        """
+        if self._owns_executor:
+            self._executor.shutdown(wait=wait)
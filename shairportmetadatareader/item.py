@@ -1,26 +1,104 @@
 """
 Single shaiport-sync information item.
 """
+import sys
 import logging
+from array import array
+from binascii import hexlify, unhexlify, Error as BinasciiError
+from itertools import chain
 from xml.etree.ElementTree import fromstring as xml_from_string, ParseError
+from collections import defaultdict
 from datetime import datetime
+try:
+    from sys import intern
+except ImportError:
+    pass  # python 2 => use the builtin intern function
 
 from .codetable import CORE_CODE_DICT, SSNC_CODE_DICT, CORE, SSNC
 # pylint: disable=W1505
-from .util import ascii_integers_to_string, encoded_to_str, encodebytes, xml_to_dict, to_hex, to_unicode, to_binary
+from .util import ascii_integers_to_string, encoded_to_str, encodebytes, xml_to_dict, hex_bytes_to_int, to_unicode, \
+    to_binary
 
 logger = logging.getLogger("AirplayListenerLogger") # pylint: disable=C0103
 
+# all known types and codes, every item shares these str instances instead of keeping its own copy
+CODE_TABLE = {intern(code): code for code in chain((CORE, SSNC), CORE_CODE_DICT, SSNC_CODE_DICT)}
+
+# hex representation (as send by the pipe) of all known types and codes mapped to their names
+HEX_CODE_TABLE = {hexlify(to_binary(code)): code for code in CODE_TABLE}
+
+
+def hex_to_code(hex_str):
+    """
+    Convert the hex representation of a type or code to its name.
+    :param hex_str: hex string as str or bytes e.g. 73736e63
+    :return: name e.g. ssnc
+    """
+    hex_str = to_binary(hex_str)
+    code = HEX_CODE_TABLE.get(hex_str)
+    if code is None:
+        # unknown code => decode it manually
+        code = to_unicode(unhexlify(hex_str).decode("latin-1"))
+    return code
+
+
+# array typecodes for unsigned integers by their size in bytes
+ARRAY_TYPECODES = {array(typecode).itemsize: typecode for typecode in "BHILQ"}
+
+
+def decode_int_items(items, as_numpy=False):
+    """
+    Decode the data of many integer items at once. Items with the same data length are converted together, which is
+    much faster than accessing `data_int` on every single item.
+    :param items: list of items with integer data e.g. astm, astn, asyr or mper
+    :param as_numpy: True to return a numpy array instead of an array.array (requires numpy)
+    :return: array of unsigned 64-bit integers with one entry per item (0 for items without data)
+    """
+    result = array("Q", bytes(8 * len(items)))
+
+    # group the big-endian data of all items by its length
+    groups = defaultdict(lambda: ([], []))
+    for i, item in enumerate(items):
+        data = item.data_bytes
+        if data:
+            indices, chunks = groups[len(data)]
+            indices.append(i)
+            chunks.append(data)
+
+    for size, (indices, chunks) in groups.items():
+        typecode = ARRAY_TYPECODES.get(size)
+        if typecode is None:
+            # unusual integer size => convert each value on its own
+            for i, data in zip(indices, chunks):
+                result[i] = hex_bytes_to_int(data)
+            continue
+
+        values = array(typecode, b"".join(chunks))
+        if sys.byteorder == "little":
+            values.byteswap()
+        if len(indices) == len(items):
+            result = values if typecode == "Q" else array("Q", values)
+        else:
+            for i, value in zip(indices, values):
+                result[i] = value
+
+    if as_numpy:
+        import numpy # pylint: disable=C0415
+        return numpy.frombuffer(result, dtype=numpy.uint64)
+    return result
+
 
 class Item(object): # pylint: disable=R0205
     """
     Class to represent a single item from the pipe or the udp server.
     """
+    __slots__ = ("type", "code", "length", "_raw", "_encoding", "_data", "_data_base64", "__weakref__")
+
     def __init__(self, item_type, code, length=0, text=None, encoding=None): # pylint: disable=R0913
         """
         :param item_type: ssnc or core
         :param code: ssnc or core codes. See codetable.py for details.
-        :param text: encoded data
+        :param text: encoded data as str, bytes or memoryview (it is only decoded when it is accessed)
         :param encoding: base64 or bytes encoding of the text
         :param length: length of the data
         """
@@ -32,33 +110,45 @@ class Item(object): # pylint: disable=R0205
         if not code:
             raise ValueError("code must not be None.")
 
-        self.type = item_type
-        self.code = code
+        self.type = CODE_TABLE.get(item_type) or intern(item_type)
+        self.code = CODE_TABLE.get(code) or intern(code)
         self.length = length
 
+        # the data is stored encoded and only decoded when it is accessed for the first time
+        self._raw = None         # encoded data as bytes or memoryview
+        self._encoding = None    # encoding of _raw
+        self._data = None        # cached decoded data
+        self._data_base64 = None # cached base64 representation
+
         if text:
             if self.length <= 0:
                 raise ValueError("Malformed data.")
-            if encoding == "base64":
-                self._data = encoded_to_str(text, encoding, as_bytes=True)
-                self._data_base64 = to_unicode(text)
-            elif encoding == "bytes":
-                self._data = text
-                self._data_base64 = encodebytes(to_binary(self._data))
+            if encoding not in ("base64", "bytes"):
+                raise ValueError("Unknown encoding format: {0}".format(encoding))
+            self._raw = text if isinstance(text, memoryview) else to_binary(text)
+            self._encoding = encoding
         else:
             if self.length != 0:
                 raise ValueError("Malformed data.")
-            self._data = None
-            self._data_base64 = None
 
     def __eq__(self, other):
         if not other:
             return False
-        return self.__dict__ == other.__dict__
+        return self.type == other.type and self.code == other.code and self.length == other.length and \
+            self.data_bytes == other.data_bytes
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def detach(self):
+        """
+        Make sure that the item owns its data. Call this method if the item was created from a view of a buffer which
+        is going to be reused.
+        """
+        if isinstance(self._raw, memoryview):
+            # decoded raw bytes can be reused as raw data, otherwise copy the view
+            self._raw = self._data if self._encoding == "bytes" and self._data is not None else self._raw.tobytes()
+
     # --------------------------------------------- xml parsing --------------------------------------------------------
 
     @classmethod
@@ -91,6 +181,26 @@ class Item(object): # pylint: disable=R0205
             logger.warning("Can not parse item: %s", item_str)
             return None
 
+    @classmethod
+    def from_pipe_fields(cls, type_hex, code_hex, length, b64_payload=None):
+        """
+        Create an item from the raw fields of a pipe item without creating an xml tree.
+        :param type_hex: hex representation of the type as str or bytes
+        :param code_hex: hex representation of the code as str or bytes
+        :param length: length of the decoded data
+        :param b64_payload: base64 encoded data as str or bytes or None
+        :return: item on success or None
+        """
+        try:
+            item_type = hex_to_code(type_hex)
+            code = hex_to_code(code_hex)
+            if b64_payload is None:
+                return cls(item_type, code, length)
+            return cls(item_type, code, length, b64_payload, "base64")
+        except (ValueError, TypeError, BinasciiError):
+            logger.warning("Can not parse item with type %s and code %s.", type_hex, code_hex)
+            return None
+
     # --------------------------------------------- convert data -------------------------------------------------------
 
     def data(self, dtype=None):
@@ -100,7 +210,8 @@ class Item(object): # pylint: disable=R0205
         :return: _data converted as dtype
         """
         # pylint: disable=R0911, R0912
-        if not self._data:
+        data = self.data_bytes
+        if not data:
             return None
 
         if dtype is None:
@@ -112,14 +223,14 @@ class Item(object): # pylint: disable=R0205
 
             # could not guess the dtype, just return the raw data
             if dtype is None:
-                return self._data
+                return data
 
         # sanity check
         if (dtype not in ["bytes", "str", "int", "date", "bool", "base64"]) and not callable(dtype):
             raise ValueError("Illegal dtype: {0}".format(dtype))
 
         if dtype == "bytes":
-            return self._data
+            return data
         if dtype == "str":
             return self.data_str
         if dtype == "int":
@@ -132,24 +243,33 @@ class Item(object): # pylint: disable=R0205
             return self.data_base64
         if callable(dtype):
             return dtype(self)  # custom handler for data
-        return self._data
+        return data
 
     @property
     def data_bytes(self):
         """
         :return: data as bytes
         """
-        if self._data:
-            return self._data
-        return None
+        if self._data is None and self._raw:
+            if self._encoding == "base64":
+                try:
+                    self._data = encoded_to_str(self._raw, self._encoding, as_bytes=True)
+                except BinasciiError:
+                    logger.warning("Can not decode data of item %s.", self.code)
+                    self._raw = None
+                    return None
+            else:
+                self._data = bytes(self._raw)
+        return self._data or None
 
     @property
     def data_str(self):
         """
         :return: data as str
         """
-        if self._data:
-            return to_unicode(self._data)
+        data = self.data_bytes
+        if data:
+            return to_unicode(data)
         return None
 
     @property
@@ -157,8 +277,9 @@ class Item(object): # pylint: disable=R0205
         """
         :return: data as int
         """
-        if self._data:
-            return int("0x" + ''.join([to_hex(x)[2:] for x in self._data]), base=16)
+        data = self.data_bytes
+        if data:
+            return hex_bytes_to_int(data)
         return None
 
     @property
@@ -166,7 +287,7 @@ class Item(object): # pylint: disable=R0205
         """
         :return: data as date instance
         """
-        if self._data:
+        if self.data_bytes:
             return datetime.fromtimestamp(self.data_int)
         return None
 
@@ -175,7 +296,7 @@ class Item(object): # pylint: disable=R0205
         """
         :return: data as bool
         """
-        if self._data:
+        if self.data_bytes:
             return bool(self.data_int)
         return None
 
@@ -184,6 +305,9 @@ class Item(object): # pylint: disable=R0205
         """
         :return: data as bytes base64 encoded
         """
-        if self._data:
-            return self._data_base64 if self._data_base64 else encodebytes(to_binary(self._data))
-        return None
+        if self._data_base64 is None and self._raw:
+            if self._encoding == "base64":
+                self._data_base64 = to_unicode(bytes(self._raw))
+            else:
+                self._data_base64 = encodebytes(self._raw)
+        return self._data_base64 or None
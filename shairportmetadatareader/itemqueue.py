@@ -0,0 +1,123 @@
+"""
+Bounded queue which decouples receiving items from processing them.
+"""
+from collections import deque
+from threading import Condition
+
+# wait until the consumer made room for the new item
+BLOCK = "block"
+# drop the oldest progress or volume item, if there is none drop the oldest item
+DROP_OLDEST_PROGRESS = "drop_oldest_progress"
+# replace a queued progress or volume item with the same type and code, otherwise behave like DROP_OLDEST_PROGRESS.
+# Other items (delimiters, track fields, artwork) are never replaced, because this would move them to another track.
+COALESCE = "coalesce"
+
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST_PROGRESS, COALESCE)
+
+# codes whose items are superseded by the next item with the same code
+PROGRESS_CODES = frozenset(["prgr", "pvol"])
+
+
+class ItemQueue(object): # pylint: disable=R0205
+    """
+    Thread safe bounded queue of items with a selectable policy for the case that the queue is full.
+    """
+    def __init__(self, maxsize, policy=DROP_OLDEST_PROGRESS):
+        """
+        :param maxsize: maximum number of queued items
+        :param policy: one of OVERFLOW_POLICIES
+        """
+        super(ItemQueue, self).__init__()
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {0}".format(policy))
+        if maxsize <= 0:
+            raise ValueError("maxsize must be greater than 0.")
+
+        self._items = deque()
+        self._maxsize = maxsize
+        self._policy = policy
+        self._condition = Condition()
+        self._closed = False
+        self.dropped = 0  # number of items which were dropped or replaced because the queue was full
+
+    @property
+    def maxsize(self):
+        """
+        :return: maximum number of queued items
+        """
+        return self._maxsize
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """
+        Add an item to the queue. Depending on the policy this might block or drop another item if the queue is full.
+        :param item: item to add
+        """
+        with self._condition:
+            if len(self._items) >= self._maxsize:
+                if self._policy == BLOCK:
+                    while len(self._items) >= self._maxsize and not self._closed:
+                        self._condition.wait()
+                elif self._policy == COALESCE:
+                    if self._replace(item):
+                        return
+                else:
+                    self._drop(PROGRESS_CODES if self._policy == DROP_OLDEST_PROGRESS else ())
+
+            if self._closed:
+                return
+            self._items.append(item)
+            self._condition.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Remove and return the oldest item.
+        :param timeout: maximum time in seconds to wait for an item (None waits forever)
+        :return: item or None if the timeout elapsed or the queue was closed
+        """
+        with self._condition:
+            if not self._items and not self._closed:
+                self._condition.wait(timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        """
+        Wake up all waiting threads and reject new items.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _replace(self, item):
+        """
+        Replace the queued progress or volume item with the same type and code. If the item does not carry a state
+        which supersedes the previous one or there is no matching item, the oldest progress item or the oldest item is
+        dropped instead.
+        :return: True if an item was replaced
+        """
+        if item.code in PROGRESS_CODES:
+            for i, queued in enumerate(self._items):
+                if queued.code == item.code and queued.type == item.type:
+                    self._items[i] = item
+                    self.dropped += 1
+                    return True
+        self._drop(PROGRESS_CODES)
+        return False
+
+    def _drop(self, codes):
+        """
+        Drop the oldest item with one of the given codes or the oldest item if none of the items matches.
+        """
+        for i, queued in enumerate(self._items):
+            if queued.code in codes:
+                del self._items[i]
+                break
+        else:
+            self._items.popleft()
+        self.dropped += 1
@@ -1,12 +1,20 @@
 """
 Package containing different listener classes for various backends.
 """
-from .airplaylistener import logger
+import sys
+from .airplaylistener import logger, item_handler
 from .airplaypipelistener import AirplayPipeListener, DEFAULT_PIPE_FILE
 from .airplayudplistener import AirplayUDPListener, DEFAULT_PORT, DEFAULT_ADDRESS
+from .airplayreplaylistener import AirplayReplayListener
 
-__all__ = ["AirplayUDPListener", "AirplayPipeListener", "AirplayMQTTListener", "DEFAULT_PORT", "DEFAULT_ADDRESS",
-           "DEFAULT_PIPE_FILE", "logger"]
+__all__ = ["AirplayUDPListener", "AirplayPipeListener", "AirplayMQTTListener", "AirplayReplayListener",
+           "DEFAULT_PORT", "DEFAULT_ADDRESS", "DEFAULT_PIPE_FILE", "logger", "item_handler"]
+
+# The asyncio backends and the listener hub require python 3.6 or newer.
+if sys.version_info >= (3, 6):
+    from .airplayasynclistener import AsyncAirplayUDPListener, AsyncAirplayPipeListener
+    from .listenerhub import ListenerHub
+    __all__ += ["AsyncAirplayUDPListener", "AsyncAirplayPipeListener", "ListenerHub"]
 
 # Import mqtt backend if the necessary frameworks are available.
 try:
@@ -15,5 +23,6 @@ except ImportError:
     logger.warning("Can not find paho-mqtt library. AirplayMQTTListener is therefore not available. If you wish to use "
                    "this backend run: pip install paho-mqtt.")
 else:
-    from .airplaymqttlistener import AirplayMQTTListener, DEFAULT_BROKER, DEFAULT_MQTT_PORT
-    __all__ += ["AirplayMQTTListener", "DEFAULT_BROKER", "DEFAULT_MQTT_PORT"]
+    from .airplaymqttlistener import AirplayMQTTListener, MQTTHub, DEFAULT_BROKER, DEFAULT_MQTT_PORT
+    from .mqttstatepublisher import MQTTStatePublisher
+    __all__ += ["AirplayMQTTListener", "MQTTHub", "MQTTStatePublisher", "DEFAULT_BROKER", "DEFAULT_MQTT_PORT"]
@@ -0,0 +1,240 @@
+"""
+Module to listen to the udp or pipe backend of shairport-sync with asyncio instead of a background thread per
+listener. Many listeners can share a single event loop.
+
+Example:
+    listener = AsyncAirplayUDPListener()
+    await listener.start()
+    async for item in listener.items():
+        print(item.code, item.data())
+"""
+import os
+import stat
+import errno
+import asyncio
+
+from .airplaylistener import AirplayListener, logger
+from .airplayudplistener import AirplayUDPListener
+from .airplaypipelistener import AirplayPipeListener
+
+
+class AsyncListenerMixin(object): # pylint: disable=R0205
+    """
+    Mixin for AirplayListener subclasses which adds asyncio based access to the received items and properties.
+    """
+    def __init__(self, *args, **kwargs):
+        super(AsyncListenerMixin, self).__init__(*args, **kwargs)
+        self._item_queues = []  # one queue for each running `items` iterator
+
+    async def start(self):
+        """
+        Start shairport-sync and start listening for metadata on the running event loop.
+        """
+        loop = asyncio.get_event_loop()
+        # starting the daemon is blocking => do not block the event loop
+        await loop.run_in_executor(None, AirplayListener.start_listening, self)
+        await self.listen()
+
+    async def listen(self): # pylint: disable=R0201
+        """
+        Start listening for metadata on the running event loop without starting shairport-sync.
+        Each subclass should override this method.
+        """
+
+    def start_listening(self):
+        """
+        Schedule `start` on the running event loop.
+        :return: asyncio task
+        """
+        return asyncio.ensure_future(self.start())
+
+    def stop_listening(self):
+        """
+        Stop listening and finish all running `items` iterators.
+        """
+        for queue in self._item_queues:
+            # the consumer might be behind => make room for the end marker
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        super(AsyncListenerMixin, self).stop_listening()
+
+    async def items(self, max_queue_size=0):
+        """
+        Asynchronous iterator over all received items. The iterator finishes when `stop_listening` is called.
+        :param max_queue_size: maximum number of items which are buffered if the consumer is too slow, the oldest
+        items are dropped if the queue is full (0 means unlimited)
+        """
+        queue = asyncio.Queue(maxsize=max_queue_size)
+        self._item_queues.append(queue)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                yield item
+        finally:
+            self._item_queues.remove(queue)
+
+    async def wait_for(self, name):
+        """
+        Wait until the given property changes.
+        :param name: name of the property e.g. track_info
+        :return: new value of the property
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def set_result(value):
+            if not future.done():
+                future.set_result(value)
+
+        def on_change(_, value):
+            # the callback might be executed by a callback dispatcher on a different thread
+            loop.call_soon_threadsafe(set_result, value)
+
+        self.bind(**{name: on_change})
+        try:
+            return await future
+        finally:
+            self.unbind(**{name: on_change})
+
+    def _process_item(self, item):
+        """
+        Process the item and pass it to all running `items` iterators.
+        :param item: metadata item
+        """
+        super(AsyncListenerMixin, self)._process_item(item)
+
+        for queue in self._item_queues:
+            if queue.full():
+                queue.get_nowait()
+                logger.warning("Item queue is full. Dropping the oldest item.")
+            queue.put_nowait(item)
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Forward all received datagrams to the listener.
+    """
+    def __init__(self, listener):
+        super(_DatagramProtocol, self).__init__()
+        self._listener = listener
+
+    def datagram_received(self, data, addr):
+        self._listener._process_datagram(data) # pylint: disable=W0212
+
+    def error_received(self, exc): # pylint: disable=R0201
+        logger.warning("Error while receiving datagram: %s", exc)
+
+
+class AsyncAirplayUDPListener(AsyncListenerMixin, AirplayUDPListener):
+    """
+    Airplay listener class to read the shairport-sync udp server backend using asyncio.
+    """
+    def __init__(self, *args, queue_size=0, receive_buffers=0, batch_size=None, **kwargs):
+        """
+        :param queue_size: not supported, the items are processed on the event loop as soon as they are received. Use
+        the `max_queue_size` of `items` to buffer the items for a slow consumer.
+        :param receive_buffers: not supported, the event loop receives the datagrams
+        :param batch_size: not supported, the event loop receives the datagrams
+        """
+        if queue_size > 0:
+            raise ValueError("The async udp listener processes the items on the event loop and has no item queue.")
+        if receive_buffers > 0 or batch_size is not None:
+            raise ValueError("The async udp listener does not support receive buffers, the event loop receives the "
+                             "datagrams.")
+        super(AsyncAirplayUDPListener, self).__init__(*args, **kwargs)
+        self._transport = None
+
+    async def listen(self):
+        """
+        Bind the udp socket and process all received datagrams on the running event loop.
+        """
+        loop = asyncio.get_event_loop()
+        # the socket is created by the listener => the receive buffer size is applied and drop_counts works
+        self._transport, _ = await loop.create_datagram_endpoint(lambda: _DatagramProtocol(self),
+                                                                 sock=self._create_socket())
+        self._is_listening = True
+        logger.info("Start listening to socket %s:%s...", self.socket_addr[0], self.socket_addr[1])
+
+    @property
+    def bound_address(self):
+        """
+        :return: address and port the socket is bound to or None if the listener is not running
+        """
+        if self._transport is None:
+            return None
+        return self._transport.get_extra_info("sockname")[:2]
+
+    def stop_listening(self):
+        """
+        Close the udp socket and stop shairport-sync.
+        """
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+            self._socket = None
+        super(AsyncAirplayUDPListener, self).stop_listening()
+
+
+class AsyncAirplayPipeListener(AsyncListenerMixin, AirplayPipeListener):
+    """
+    Airplay listener class to read the shairport-sync pipe backend using asyncio.
+    """
+    def __init__(self, *args, **kwargs):
+        super(AsyncAirplayPipeListener, self).__init__(*args, **kwargs)
+        self._fd = None
+        self._keep_alive_fd = None
+        self._loop = None
+        self._chunk = bytearray(self._chunk_size)  # reusable read buffer
+
+    async def listen(self):
+        """
+        Open the pipe and process the data on the running event loop whenever it is readable.
+        """
+        # wait till the pipe file is found
+        while not os.path.exists(self.pipe_file) or not stat.S_ISFIFO(os.stat(self.pipe_file).st_mode):
+            logger.warning("Could not find pipe: %s. Retrying in 5 seconds...", self.pipe_file)
+            await asyncio.sleep(5)
+
+        self._fd = os.open(self.pipe_file, os.O_RDONLY | os.O_NONBLOCK)
+        # keep a writing end open, otherwise the pipe is permanently readable (EOF) while shairport-sync is not
+        # writing to the pipe
+        self._keep_alive_fd = os.open(self.pipe_file, os.O_WRONLY | os.O_NONBLOCK)
+        self._tokenizer.reset()
+        self._is_listening = True
+
+        self._loop = asyncio.get_event_loop()
+        self._loop.add_reader(self._fd, self._on_readable)
+        logger.info("Start parsing the pipe %s: ...", self.pipe_file)
+
+    def _on_readable(self):
+        """
+        Read all available data from the pipe and process the complete items.
+        """
+        view = memoryview(self._chunk)
+        while self._is_listening:
+            try:
+                size = os.readv(self._fd, [self._chunk])
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            if not size:
+                return
+
+            for item in self._tokenizer.feed(view[:size]):
+                self._process_item(item)
+
+    def stop_listening(self):
+        """
+        Close the pipe and stop shairport-sync.
+        """
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            os.close(self._keep_alive_fd)
+            self._fd = None
+            self._keep_alive_fd = None
+        super(AsyncAirplayPipeListener, self).stop_listening()
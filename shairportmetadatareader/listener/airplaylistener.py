@@ -20,11 +20,15 @@ from __future__ import division
 
 import os
 import logging
+from time import time
+from threading import Lock, Timer
 
 
 from ..remote import AirplayRemote
 from ..codetable import CORE, SSNC, CORE_CODE_DICT, SSNC_CODE_DICT
-from ..util import write_data_to_image
+from ..artwork import default_store
+from ..metrics import ListenerMetrics
+from ..progress import PlaybackProgress
 from ..shairport import stop_shairport_daemon, start_shairport_daemon
 
 
@@ -32,6 +36,10 @@ from ..shairport import stop_shairport_daemon, start_shairport_daemon
 logger = logging.getLogger("AirplayListenerLogger")
 logger.setLevel(logging.INFO)
 
+# properties which describe the normalized state of a listener, see `AirplayListener.state_snapshot`
+STATE_PROPERTIES = ("connected", "client_name", "playback_state", "playback_progress", "volume", "airplay_volume",
+                    "mute", "track_info", "artwork")
+
 def load_kivy():
     """
     Load all required Properties from kivy.
@@ -83,6 +91,40 @@ CORE_CODE_WHITELIST = {'mikd', 'minm', 'mper', 'miid', 'asal', 'asar', 'ascm', '
                        'aeEN'}
 
 
+def track_info_diff(old, new):
+    """
+    Compare two track information dictionaries.
+    :param old: previous track information
+    :param new: new track information
+    :return: dictionary with the added and changed keys mapped to their new values and the list of removed keys or
+    None if both are identical
+    """
+    added = {key: value for key, value in new.items() if key not in old}
+    changed = {key: value for key, value in new.items() if key in old and old[key] != value}
+    removed = sorted(key for key in old if key not in new)
+    if not (added or changed or removed):
+        return None
+    return {"added": added, "changed": changed, "removed": removed}
+
+
+def item_handler(item_type, *codes):
+    """
+    Decorator to register a method of an AirplayListener (sub)class as handler for items with the given codes.
+    The method receives the item as only argument. Example:
+
+    @item_handler(SSNC, "clip")
+    def _on_client_ip(self, item):
+        ...
+
+    :param item_type: ssnc or core
+    :param codes: ssnc or core codes
+    """
+    def decorator(func):
+        func.item_handler_keys = getattr(func, "item_handler_keys", ()) + tuple((item_type, c) for c in codes)
+        return func
+    return decorator
+
+
 # pylint: disable=R0902, E0602
 class AirplayListener(EventDispatcher):
     """
@@ -113,13 +155,30 @@ class AirplayListener(EventDispatcher):
     '''Playback state.'''
 
     track_info = DictProperty({})
-    '''Information about the currently playing track.'''
+    '''Information about the currently playing track. Only published if the information changed.'''
+
+    track_info_delta = DictProperty({})
+    '''
+    Changes of the track information compared to the previous track:
+    {"added": {...}, "changed": {...}, "removed": [...]} where added and changed contain the new values.
+    Published before `track_info`.
+    '''
 
     playback_progress = ListProperty([])
     '''(current playback position, duration) of the track'''
 
+    playback_position = ObjectProperty(0.0)
+    '''
+    Interpolated playback position in seconds. Updated on every progress, pause and resume message and additionally
+    every `progress_interval` seconds during the playback if the listener was created with a progress interval.
+    Use `progress.position_at()` to get the exact position at any time.
+    '''
+
     artwork = StringProperty("")
-    '''Path to artwork file.'''
+    '''
+    Path to artwork file. The same image is always published with the same path. If the artwork store keeps the images
+    only in memory, the content hash of the image is published instead, use `artwork_store.get` to load the data.
+    '''
 
     user_agent = StringProperty("")
     '''Airplay user agent. e.g. iTunes/12.2 (Macintosh; OS X 10.9.5)'''
@@ -136,11 +195,31 @@ class AirplayListener(EventDispatcher):
     mute = BooleanProperty(False)
     '''Is the ariplay device currently muted.'''
 
+    state_changes = DictProperty({})
+    '''
+    All property changes which were published together. Only used if the listener was created with a coalesce_interval.
+    Bind to this property to receive a single callback per interval instead of one callback per property.
+    '''
+
     # ------------------------------------------ constructor/destructor ------------------------------------------------
 
-    def __init__(self, sample_rate=44100, **kwargs):
+    # pylint: disable=R0913
+    def __init__(self, sample_rate=44100, coalesce_interval=None, callback_dispatcher=None, artwork_store=None,
+                 artwork_index=None, metrics=None, profiler=None, progress_interval=None, **kwargs):
         """
         :param sample_rate: sample_rate used by shairport-sync. Needed to calculate the playback progress.
+        :param coalesce_interval: time in seconds during which changes to the playback progress, volume and track
+        information are collected and published together. Use None to publish every change immediately.
+        :param callback_dispatcher: CallbackDispatcher which runs all callbacks bound with `bind` on its executor.
+        Use None to run the callbacks on the listener thread.
+        :param artwork_store: ArtworkStore to save the artwork to (the store shared by all listeners if None)
+        :param artwork_index: ArtworkIndex which maps the album of the current track to its artwork. The artwork is
+        saved to the store of the index.
+        :param metrics: ListenerMetrics which counts the received items (a new one is created if None)
+        :param profiler: StageProfiler which measures the time spent in each processing stage. The profiler can be
+        enabled and disabled at any time, but only callbacks bound after the listener was created are measured.
+        :param progress_interval: time in seconds between two updates of `playback_position` during the playback. Use
+        None to update the position only when a progress, pause or resume message is received.
         """
         # pylint: disable=W0613
         super(AirplayListener, self).__init__()
@@ -149,9 +228,19 @@ class AirplayListener(EventDispatcher):
         self._tmp_track_info = {}   # temporary storage for track metadata
 
         self.playback_progress = []  # playback progress send by ssnc
+        self._progress_time = None   # time when the playback progress was received
+
+        # interpolated playback position
+        self.progress = PlaybackProgress(sample_rate)
+        self._progress_interval = progress_interval
+        self._progress_timer = None
+        self._progress_stopped = False  # True after stop_listening => the timer is not started again
+        self._progress_lock = Lock()
 
         self.track_info = {}  # track info send by ssnc
         self._artwork = ""
+        self._artwork_index = artwork_index
+        self._artwork_store = artwork_index.store if artwork_index is not None else artwork_store
         self._has_remote_data = [False, False]  # [has dacp_id, has active_remote]
 
         # There is a "bug" inside shairport where sometimes after pause is pressed another play command is send,
@@ -162,6 +251,28 @@ class AirplayListener(EventDispatcher):
         self._did_receive_progress_msg = False
         self._did_receive_play_msg = False
 
+        # bound handler methods for all codes with a special meaning
+        self._item_handlers = {key: getattr(self, name) for key, name in self._item_handler_table().items()}
+
+        # property changes which are not yet published in coalescing mode
+        self._coalesce_interval = coalesce_interval
+        self._pending_state = {}
+        self._pending_lock = Lock()
+        self._flush_timer = None
+
+        # object with a `write(item)` method e.g. a CaptureWriter, which receives every item before it is processed
+        self.recorder = None
+
+        # counters and sampled timings for monitoring
+        self.profiler = profiler
+        self.metrics = metrics if metrics is not None else ListenerMetrics()
+        self.metrics.use_dispatcher(callback_dispatcher)
+
+        # callbacks bound while a dispatcher is used or while callbacks are timed are wrapped => remember the wrappers
+        # to unbind them
+        self._callback_dispatcher = callback_dispatcher
+        self._wrapped_callbacks = {}
+
     def __del__(self):
         # try to stop shairport if the instance of this class is destroyed
         stop_shairport_daemon()
@@ -189,6 +300,8 @@ class AirplayListener(EventDispatcher):
         Start shairport-sync and continuously parse the metadata in a background thread.
         Each subclass should override this method.
         """
+        self._enable_progress_timer()
+
         # try to start shairport-sync daemon
         start_shairport_daemon()
 
@@ -199,113 +312,211 @@ class AirplayListener(EventDispatcher):
         # stop metadata reading
         self._is_listening = False
 
+        # publish all remaining changes
+        self.flush_state()
+
+        self._disable_progress_timer()
+
         # try to stop shairport-sync
         stop_shairport_daemon()
 
+    @property
+    def artwork_store(self):
+        """
+        :return: ArtworkStore which contains the received artwork
+        """
+        if self._artwork_store is None:
+            self._artwork_store = default_store()
+        return self._artwork_store
+
+    # ------------------------------------------------ callback binding ------------------------------------------------
+
+    @property
+    def callback_dispatcher(self):
+        """
+        :return: CallbackDispatcher used to run the bound callbacks or None
+        """
+        return self._callback_dispatcher
+
+    def bind(self, **kwargs):
+        """
+        Bind callbacks to properties. If a callback dispatcher is used, the callbacks are executed by the dispatcher.
+        :param kwargs: property names mapped to callbacks
+        """
+        for name, callback in list(kwargs.items()):
+            key = (name, callback)
+            if key not in self._wrapped_callbacks:
+                wrapper = callback
+                if self._callback_dispatcher is not None:
+                    wrapper = self._callback_dispatcher.wrap(name, wrapper)
+                elif self.metrics.time_callbacks:
+                    wrapper = self.metrics.timed(name, wrapper)
+                if self.profiler is not None:
+                    wrapper = self.profiler.wrap(name, wrapper)
+                if wrapper is callback:
+                    continue
+                self._wrapped_callbacks[key] = wrapper
+            kwargs[name] = self._wrapped_callbacks[key]
+        return super(AirplayListener, self).bind(**kwargs)
+
+    def unbind(self, **kwargs):
+        """
+        Unbind callbacks which were bound with `bind`.
+        :param kwargs: property names mapped to callbacks
+        """
+        for name, callback in list(kwargs.items()):
+            kwargs[name] = self._wrapped_callbacks.pop((name, callback), callback)
+        return super(AirplayListener, self).unbind(**kwargs)
+
+    # ------------------------------------------------ state publishing ------------------------------------------------
+
+    def _set_state(self, **changes):
+        """
+        Change the given properties. In coalescing mode the changes are collected and published by `flush_state`
+        when the coalesce interval elapsed.
+        :param changes: property names mapped to their new values
+        """
+        if not self._coalesce_interval:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            return
+
+        with self._pending_lock:
+            self._pending_state.update(changes)
+            if self._flush_timer is None:
+                self._flush_timer = Timer(self._coalesce_interval, self.flush_state)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush_state(self):
+        """
+        Publish all collected property changes immediately. Each changed property is dispatched once followed by a
+        single `state_changes` event containing all changes.
+        """
+        with self._pending_lock:
+            pending, self._pending_state = self._pending_state, {}
+            timer, self._flush_timer = self._flush_timer, None
+
+        if timer:
+            timer.cancel()
+        if not pending:
+            return
+
+        for name, value in pending.items():
+            setattr(self, name, value)
+        self.state_changes = pending
+
+    def _update_position(self):
+        """
+        Publish the interpolated playback position and keep updating it every progress interval during the playback.
+        """
+        position = self.progress.position_at()
+        self.playback_position = position if position is not None else 0.0
+
+        if not self._progress_interval or not self.progress.playing:
+            return
+        with self._progress_lock:
+            if self._progress_timer is None and not self._progress_stopped:
+                self._progress_timer = Timer(self._progress_interval, self._on_progress_tick)
+                self._progress_timer.daemon = True
+                self._progress_timer.start()
+
+    def _on_progress_tick(self):
+        with self._progress_lock:
+            self._progress_timer = None
+            if self._progress_stopped:
+                return
+        self._update_position()
+
+    def _enable_progress_timer(self):
+        """
+        Allow updating the playback position every progress interval again after the listener was stopped.
+        """
+        with self._progress_lock:
+            self._progress_stopped = False
+
+    def _disable_progress_timer(self):
+        """
+        Cancel the progress timer and do not start it again until _enable_progress_timer is called.
+        """
+        with self._progress_lock:
+            self._progress_stopped = True
+            timer, self._progress_timer = self._progress_timer, None
+        if timer:
+            timer.cancel()
+
+    def state_snapshot(self):
+        """
+        :return: dictionary with the current value of all STATE_PROPERTIES. The artwork is replaced by its content
+        hash (`artwork_key`), which is also valid for other hosts than this one. `progress_time` is the unix time when
+        the playback progress was received, which allows clients to extrapolate the current playback position.
+        """
+        snapshot = {name: getattr(self, name) for name in STATE_PROPERTIES if name != "artwork"}
+        snapshot["playback_progress"] = list(snapshot["playback_progress"])
+        snapshot["track_info"] = dict(snapshot["track_info"])
+        snapshot["artwork_key"] = os.path.splitext(os.path.basename(self.artwork))[0] if self.artwork else ""
+        snapshot["progress_time"] = self._progress_time
+        return snapshot
+
     # ------------------------------------------------ data processing -------------------------------------------------
 
-    # pylint: disable=R0912, R0915
+    @classmethod
+    def _item_handler_table(cls):
+        """
+        Collect all methods decorated with `item_handler` for this class. The table is only created once per class.
+        :return: dictionary mapping (type, code) to the name of the handler method
+        """
+        if "_item_handler_names" not in cls.__dict__:
+            table = {}
+            # walk the mro in reverse order to allow subclasses to override the handlers of their base classes
+            for klass in reversed(cls.__mro__):
+                for name, attr in vars(klass).items():
+                    for key in getattr(attr, "item_handler_keys", ()):
+                        table[key] = name
+            cls._item_handler_names = table
+        return cls._item_handler_names
+
+    def register_item_handler(self, item_type, code, handler):
+        """
+        Register a handler for a specific code at runtime. This replaces an existing handler for the same code.
+        :param item_type: ssnc or core
+        :param code: ssnc or core code
+        :param handler: callable which receives the item as only argument
+        """
+        self._item_handlers[(item_type, code)] = handler
+
     def _process_item(self, item):
         """
         Process a single item from the pipe.
         :param item: metadata item
         """
-        if item.type == SSNC:
-            # snua or snam are the 'ANNOUNCE' packet to reserve the player
-            if item.code == "snua":
-                # receive new device information
-                self.user_agent = item.data()
-
-                self.connected = True
-                if all(self._has_remote_data):
-                    self._has_remote_data = [False, False]
-            elif item.code == "snam":
-                self.client_name = item.data()
-
-                # the device name can be the ANNOUNCE package as well
-                self.connected = True
-                if all(self._has_remote_data):
-                    self._has_remote_data = [False, False]
-            elif item.code == "pcst":
-                # reset artwork
-                self.artwork = ""
-            elif item.code == "PICT":
-                if item.data_base64:  # check if picture data is found
-                    self._artwork = write_data_to_image(item.data())  # Path to artwork image
-                else:
-                    self._artwork = ""
-            elif item.code == "pcen":
-                # send artwork when all data is received
-                self.artwork = self._artwork
-            elif item.code == "mdst":
-                # reset track information when new metadata starts
-                # self.track_info = {}
-                pass
-            elif item.code == "mden":
-                # only send updates if required
-                #if not (self._tmp_track_info.items() <= self.track_info.items()):
-                self.track_info = self._tmp_track_info
-                self._tmp_track_info = {}
-            elif item.code == "pfls":
-                self.playback_state = "pause"
-                self._did_receive_progress_msg = False
-                self._did_receive_play_msg = False
-            elif item.code == "prsm":
-                self._did_receive_play_msg = True
-                # workaround for a "bug" inside shairport (see __init__ for details)
-                if self._did_receive_progress_msg:
-                    self.playback_state = "play"
-                    self._did_receive_progress_msg = False
-                    self._did_receive_play_msg = False
-            # to inaccurate
-            elif item.code == "pend":
-                self.playback_state = "stop"
-                #self.track_info = {}
-                self._did_receive_progress_msg = False
-                self._did_receive_play_msg = False
-                self.connected = False
-            elif item.code == "prgr":
-                self._did_receive_progress_msg = True
-                # workaround for a "bug" inside shairport (see __init__ for details)
-                if self._did_receive_play_msg:
-                    self.playback_state = "play"
-                    self._did_receive_progress_msg = False
-                    self._did_receive_play_msg = False
-
-                # this calculation seems inaccurate => limit the values to positive numbers
-                start, cur, end = item.data()
-                self.playback_progress = [max(0, (cur-start)/self._sample_rate), max(0, (end-start)/self._sample_rate)]
-                #start, cur, end = item.data() # (start, current track progress, end) as RTP timestamp
-                #self.playback_progress = min(max(0, (cur-start)/(end-start)), 1.0)
-            elif item.code == "pvol":
-                # normalize volume
-                airplay_volume, volume, l, h = item.data()
-                self.mute = (airplay_volume == -144)
-                self.volume = max(0, (volume-l) / (h-l))
-                self.airplay_volume = max(0, (airplay_volume + 30) / 30)
-            elif item.code == "daid":
-                self.dacp_id = item.data()
-                self._has_remote_data[0] = True
-            elif item.code == "acre":
-                self.active_remote = item.data()
-                self._has_remote_data[1] = True
-            elif item.code in SSNC_CODE_DICT:
-                # unused tag recognized => just ignore it
-                pass
-            else:
+        self.metrics.record_item(item)
+        if self.recorder is not None:
+            self.recorder.write(item)
+
+        profiler = self.profiler
+        if profiler is not None and profiler.sample():
+            profiler.process_item(item, self._handle_item)
+        else:
+            self._handle_item(item)
+
+    def _handle_item(self, item):
+        """
+        Update the state of the listener for a single item.
+        :param item: metadata item
+        """
+        handler = self._item_handlers.get((item.type, item.code))
+        if handler is not None:
+            handler(item)
+        elif item.type == SSNC:
+            # unused tags are just ignored
+            if item.code not in SSNC_CODE_DICT:
                 logger.warning("Unknown shairport-sync core (ssnc) code \"%s\", with base64 data %s.", item.code,
                                item.data_base64)
-
         elif item.type == CORE:
-            if item.code in CORE_CODE_WHITELIST:
-                # save metadata info
-                dmap_key, data_type = CORE_CODE_DICT[item.code]
-                self._tmp_track_info[dmap_key] = item.data(dtype=data_type)
-            elif item.code in CORE_CODE_DICT:
-                # just ignore these and don't add them to the track info
-                # you can still listen to the item property to respond to these keys
-                pass
-            else:
+            # core codes which are not whitelisted are not added to the track info
+            # you can still listen to the item property to respond to these keys
+            if item.code not in CORE_CODE_DICT:
                 logger.warning("Unknown DMAP-core code: %s, with data %s.", item.code, item.data_base64)
 
         # send a callback if dacp_id and active_remote token are received
@@ -314,3 +525,146 @@ class AirplayListener(EventDispatcher):
             self._has_remote_data = [False, False]
 
         self.item = item
+
+    # ------------------------------------------------- item handlers --------------------------------------------------
+
+    @item_handler(SSNC, "snua")
+    def _on_user_agent(self, item):
+        """
+        snua is the 'ANNOUNCE' packet to reserve the player.
+        """
+        # receive new device information
+        self.user_agent = item.data()
+
+        self.connected = True
+        if all(self._has_remote_data):
+            self._has_remote_data = [False, False]
+
+    @item_handler(SSNC, "snam")
+    def _on_client_name(self, item):
+        """
+        snam is the device name and can be the 'ANNOUNCE' packet as well.
+        """
+        self.client_name = item.data()
+
+        self.connected = True
+        if all(self._has_remote_data):
+            self._has_remote_data = [False, False]
+
+    @item_handler(SSNC, "pcst")
+    def _on_picture_start(self, item): # pylint: disable=W0613
+        # reset artwork
+        self.artwork = ""
+
+    @item_handler(SSNC, "PICT")
+    def _on_picture(self, item):
+        data = item.data_bytes
+        if data:  # check if picture data is found
+            if self._artwork_index is not None:
+                # the picture is send after the metadata of its track, in coalescing mode its track info might not be
+                # published yet
+                track_info = self._tmp_track_info
+                if not track_info:
+                    with self._pending_lock:
+                        track_info = self._pending_state.get("track_info", self.track_info)
+                key = self._artwork_index.add(data, track_info)
+            else:
+                key = self.artwork_store.put(data)
+            self._artwork = self.artwork_store.path(key) or key  # Path to artwork image
+        else:
+            self._artwork = ""
+
+    @item_handler(SSNC, "pcen")
+    def _on_picture_end(self, item): # pylint: disable=W0613
+        # send artwork when all data is received
+        self.artwork = self._artwork
+
+    @item_handler(SSNC, "mdst")
+    def _on_metadata_start(self, item): # pylint: disable=W0613
+        # reset track information when new metadata starts
+        # self.track_info = {}
+        pass
+
+    @item_handler(SSNC, "mden")
+    def _on_metadata_end(self, item): # pylint: disable=W0613
+        track_info, self._tmp_track_info = self._tmp_track_info, {}
+
+        # only send updates if required, in coalescing mode compare against the change which is not yet published
+        with self._pending_lock:
+            previous = self._pending_state.get("track_info", self.track_info)
+        if track_info == previous:
+            return
+
+        delta = track_info_diff(self.track_info, track_info) or {"added": {}, "changed": {}, "removed": []}
+        self._set_state(track_info_delta=delta, track_info=track_info)
+
+    @item_handler(SSNC, "pfls")
+    def _on_pause(self, item): # pylint: disable=W0613
+        self.playback_state = "pause"
+        self._did_receive_progress_msg = False
+        self._did_receive_play_msg = False
+        self.progress.pause()
+        self._update_position()
+
+    @item_handler(SSNC, "prsm")
+    def _on_resume(self, item): # pylint: disable=W0613
+        self._did_receive_play_msg = True
+        # workaround for a "bug" inside shairport (see __init__ for details)
+        if self._did_receive_progress_msg:
+            self.playback_state = "play"
+            self._did_receive_progress_msg = False
+            self._did_receive_play_msg = False
+            self.progress.resume()
+            self._update_position()
+
+    @item_handler(SSNC, "pend")
+    def _on_stop(self, item): # pylint: disable=W0613
+        # to inaccurate
+        self.playback_state = "stop"
+        #self.track_info = {}
+        self._did_receive_progress_msg = False
+        self._did_receive_play_msg = False
+        self.connected = False
+        self.progress.reset()
+        self._update_position()
+
+    @item_handler(SSNC, "prgr")
+    def _on_progress(self, item):
+        self._did_receive_progress_msg = True
+        # workaround for a "bug" inside shairport (see __init__ for details)
+        if self._did_receive_play_msg:
+            self.playback_state = "play"
+            self._did_receive_progress_msg = False
+            self._did_receive_play_msg = False
+
+        start, cur, end = item.data()
+        self._progress_time = time()
+        position, duration = self.progress.update(start, cur, end, playing=(self.playback_state == "play"))
+        self._set_state(playback_progress=[position, duration])
+        self._update_position()
+        #start, cur, end = item.data() # (start, current track progress, end) as RTP timestamp
+        #self.playback_progress = min(max(0, (cur-start)/(end-start)), 1.0)
+
+    @item_handler(SSNC, "pvol")
+    def _on_volume(self, item):
+        # normalize volume
+        airplay_volume, volume, l, h = item.data()
+        self._set_state(mute=(airplay_volume == -144),
+                        volume=max(0, (volume-l) / (h-l)),
+                        airplay_volume=max(0, (airplay_volume + 30) / 30))
+
+    @item_handler(SSNC, "daid")
+    def _on_dacp_id(self, item):
+        self.dacp_id = item.data()
+        self._has_remote_data[0] = True
+
+    @item_handler(SSNC, "acre")
+    def _on_active_remote(self, item):
+        self.active_remote = item.data()
+        self._has_remote_data[1] = True
+
+    @item_handler(CORE, *sorted(CORE_CODE_WHITELIST))
+    def _on_track_metadata(self, item):
+        # save metadata info
+        dmap_key, data_type = CORE_CODE_DICT[item.code]
+        self._tmp_track_info[dmap_key] = item.data(dtype=data_type)
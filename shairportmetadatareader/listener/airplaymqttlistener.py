@@ -1,16 +1,157 @@
 """
 Module to listen to the MQTT backend of shairport-sync.
 """
+import os
+from zlib import crc32
+from uuid import uuid4
 from socket import gethostname
+from threading import Lock
 from paho.mqtt.client import Client
 
+try:
+    from paho.mqtt.client import CallbackAPIVersion
+except ImportError:  # paho-mqtt < 2.0
+    CallbackAPIVersion = None
+
+try:
+    from paho.mqtt.client import MQTTv5
+except ImportError:  # paho-mqtt < 1.5
+    MQTTv5 = None
+
 from ..item import Item
 from .airplaylistener import AirplayListener, logger
 
 DEFAULT_BROKER = "127.0.0.1" #"iot.eclipse.org""
 DEFAULT_MQTT_PORT = 1883
 
-class AirplayMQTTListener(AirplayListener):
+# number of QoS 1/2 messages which may be unacknowledged at the same time
+DEFAULT_MAX_INFLIGHT = 100
+
+# maximum number of cached topics, the cache is cleared if it grows beyond this size
+MAX_CACHED_TOPICS = 4096
+
+
+def unique_client_id(prefix="ShairportListener"):
+    """
+    :param prefix: prefix of the client id
+    :return: client id which is unique for this process, host and instance. The broker disconnects a client if another
+    client connects with the same id.
+    """
+    return "{0}-{1}-{2}-{3}".format(prefix, gethostname(), os.getpid(), uuid4().hex[:8])
+
+
+def create_client(client_id, max_inflight=DEFAULT_MAX_INFLIGHT, shared=False):
+    """
+    Create a paho client for paho-mqtt 1.x and 2.x.
+    :param client_id: unique client id
+    :param max_inflight: maximum number of unacknowledged QoS 1/2 messages
+    :param shared: use MQTT v5 which is required for shared subscriptions
+    :return: paho client
+    """
+    kwargs = {"client_id": client_id}
+    if shared:
+        if MQTTv5 is None:
+            raise ValueError("Shared subscriptions require paho-mqtt 1.5 or newer.")
+        kwargs["protocol"] = MQTTv5
+    if CallbackAPIVersion is not None:
+        client = Client(CallbackAPIVersion.VERSION2, **kwargs)
+    else:
+        client = Client(**kwargs)
+    client.max_inflight_messages_set(max_inflight)
+    return client
+
+
+def subscription_filter(topic, shared_group=None):
+    """
+    :param topic: topic configured in shairport-sync
+    :param shared_group: name of the MQTT v5 shared subscription group or None for a normal subscription
+    :return: topic filter which matches all messages of the topic. The broker delivers each message of a shared
+    subscription to only one of the clients of the group.
+    """
+    topic_filter = "/{0}/#".format(topic)
+    if shared_group:
+        return "$share/{0}/{1}".format(shared_group, topic_filter)
+    return topic_filter
+
+
+def zone_partition(topic, partitions):
+    """
+    Assign a zone to a partition by the hash of its topic prefix. Unlike hash() the result is the same in every process.
+    :param topic: topic configured in shairport-sync
+    :param partitions: number of partitions
+    :return: partition index of the zone
+    """
+    return crc32(TopicRouter.prefix(topic).encode("utf-8")) % partitions
+
+
+class TopicRouter(object): # pylint: disable=R0205
+    """
+    Map the topics of the raw shairport-sync messages (/<zone topic>/<type>/<code>) to the listener of the zone and
+    the type and code of the item. The result is cached for every topic.
+    """
+    def __init__(self):
+        super(TopicRouter, self).__init__()
+        self._zones = {}  # topic prefix => listener
+        self._cache = {}  # topic => (listener, type, code)
+        self._lock = Lock()
+
+    @staticmethod
+    def prefix(topic):
+        """
+        :param topic: topic configured in shairport-sync
+        :return: prefix of all messages of this topic
+        """
+        return "/{0}/".format(topic)
+
+    def add(self, topic, listener):
+        """
+        Route all messages of the topic to the listener.
+        """
+        with self._lock:
+            self._zones[self.prefix(topic)] = listener
+            self._cache = {}
+
+    def remove(self, topic):
+        """
+        Stop routing the messages of the topic.
+        """
+        with self._lock:
+            del self._zones[self.prefix(topic)]
+            self._cache = {}
+
+    def route(self, topic):
+        """
+        :param topic: topic of a received message
+        :return: tuple of (listener, type, code) or None if the topic does not belong to any zone
+        """
+        route = self._cache.get(topic)
+        if route is not None:
+            return route
+
+        parts = topic.rsplit("/", 2)
+        if len(parts) != 3:
+            return None
+        # the zone is everything before /<type>/<code> => nested zone topics are matched exactly
+        zone, msg_type, msg_code = parts
+        with self._lock:
+            listener = self._zones.get(zone + "/")
+            if listener is None:
+                return None
+            if len(self._cache) >= MAX_CACHED_TOPICS:
+                self._cache = {}
+            route = self._cache[topic] = (listener, msg_type, msg_code)
+        return route
+
+
+def item_from_message(msg_type, msg_code, message):
+    """
+    :return: item for the raw payload of a message
+    """
+    msg_data = message.payload
+    return Item(item_type=msg_type, code=msg_code, text=msg_data, length=len(msg_data), encoding="bytes")
+
+
+class AirplayMQTTListener(AirplayListener): # pylint: disable=R0902
     """
     You should make sure that you configured shairport-sync correctly before using this backend class.
     This listener class only works if you already started your MQTT Broker instance and initialized this class with
@@ -18,11 +159,17 @@ class AirplayMQTTListener(AirplayListener):
     the future). Make sure that that you configured shairport-sync to send the raw data (`publish_raw`).
     The `enable_remote` option is not required for the `AirplayRemote` instance to work.
     """
-    def __init__(self, *args, hostname=DEFAULT_BROKER, port=DEFAULT_MQTT_PORT, topic=gethostname(), **kwargs):
+    # pylint: disable=R0913
+    def __init__(self, *args, hostname=DEFAULT_BROKER, port=DEFAULT_MQTT_PORT, topic=gethostname(), client_id=None,
+                 qos=0, max_inflight=DEFAULT_MAX_INFLIGHT, shared_group=None, **kwargs):
         """
         :param hostname: name of the mqtt broker
         :param port: port of the mqtt broker as int
         :param topic: name of the mqtt broker (Use None to use the default hostname)
+        :param client_id: mqtt client id (a unique id is generated if None)
+        :param qos: quality of service level of the subscription
+        :param max_inflight: maximum number of unacknowledged QoS 1/2 messages
+        :param shared_group: subscribe as member of this MQTT v5 shared subscription group (`$share/<group>/...`)
         """
         super(AirplayMQTTListener, self).__init__(*args, **kwargs)
 
@@ -33,6 +180,12 @@ class AirplayMQTTListener(AirplayListener):
         self._broker = hostname
         self._port = port
         self._topic = topic
+        self._client_id = client_id or unique_client_id()
+        self._qos = qos
+        self._max_inflight = max_inflight
+        self._shared_group = shared_group
+        self._router = TopicRouter()
+        self._router.add(topic, self)
 
     @property
     def broker(self):
@@ -55,6 +208,13 @@ class AirplayMQTTListener(AirplayListener):
         """
         return self._topic
 
+    @property
+    def client_id(self):
+        """
+        :return: MQTT client id as string.
+        """
+        return self._client_id
+
     def receive_message(self, client, userdata, message): # pylint: disable=W0613
         """
         Callback when the MQTT client receives a message.
@@ -62,14 +222,17 @@ class AirplayMQTTListener(AirplayListener):
         :param userdata:
         :param message: received message
         """
-        _, msg_type, msg_code = message.topic.rsplit("/", 2)
-        msg_data = message.payload
-        item = Item(item_type=msg_type,
-                    code=msg_code,
-                    text=msg_data,
-                    length=len(msg_data),
-                    encoding="bytes")
-        self._process_item(item)
+        route = self._router.route(message.topic)
+        if route is not None:
+            self._process_item(item_from_message(route[1], route[2], message))
+
+    def _on_connect(self, client, *args): # pylint: disable=W0613
+        """
+        Subscribe after each (re)connect, the broker might not keep the subscriptions.
+        """
+        topic_filter = subscription_filter(self.topic, self._shared_group)
+        client.subscribe(topic_filter, qos=self._qos)
+        logger.info("Subscribe to %s: ...", topic_filter)
 
     def start_listening(self):
         """
@@ -77,13 +240,12 @@ class AirplayMQTTListener(AirplayListener):
         """
         super(AirplayMQTTListener, self).start_listening()
 
-        self._client = Client("ShairportListener")
+        self._client = create_client(self._client_id, self._max_inflight, shared=bool(self._shared_group))
         self._client.on_message = self.receive_message
+        self._client.on_connect = self._on_connect
         try:
             self._client.connect(self.broker, port=self.port)
             self._client.loop_start()
-            self._client.subscribe("/{0}/#".format(self.topic))
-            logger.info("Subscribe to %s: ...", "/{0}/#".format(self.topic))
         except ConnectionRefusedError:
             logger.warning("Connection refused. Make sure that mosquitto is running in the background.")
         else:
@@ -98,3 +260,157 @@ class AirplayMQTTListener(AirplayListener):
         self._client.loop_stop()
 
         super(AirplayMQTTListener, self).stop_listening()
+
+
+class MQTTHub(object): # pylint: disable=R0205, R0902
+    """
+    Receive the metadata of many shairport-sync instances (zones) over a single connection to the broker. Each zone
+    publishes to its own topic and the messages are routed to one AirplayListener state object per zone.
+
+    To spread many zones over several worker processes, configure every worker with the same zones and a partition
+    `(index, count)`. Each worker only subscribes to the zones whose topic hash falls into its partition, therefore
+    all messages of a zone are processed by the same worker in the order they were published.
+    With a `shared_group` the subscriptions are MQTT v5 shared subscriptions (`$share/<group>-<index>/...`). Workers
+    with the same partition index form a group and the broker delivers each message to only one of them. Run a single
+    worker per partition index for strict ordering and add standby workers only if the broker assigns the messages of
+    a topic to a sticky group member (e.g. the EMQX `sticky` or `hash_topic` strategies), mosquitto delivers the
+    messages round robin.
+
+    Example:
+        hub = MQTTHub(hostname="127.0.0.1")
+        kitchen = hub.add_zone("kitchen", topic="kitchen-speaker")
+        kitchen.bind(track_info=on_track_info)
+        hub.start()
+    """
+    # pylint: disable=R0913
+    def __init__(self, hostname=DEFAULT_BROKER, port=DEFAULT_MQTT_PORT, client_id=None, qos=0,
+                 max_inflight=DEFAULT_MAX_INFLIGHT, shared_group=None, partition=None):
+        """
+        :param hostname: name of the mqtt broker
+        :param port: port of the mqtt broker as int
+        :param client_id: mqtt client id (a unique id is generated if None)
+        :param qos: quality of service level of the subscriptions
+        :param max_inflight: maximum number of unacknowledged QoS 1/2 messages
+        :param shared_group: name of the MQTT v5 shared subscription group or None for normal subscriptions
+        :param partition: tuple of (index, count) to process only a part of the zones or None for all zones
+        """
+        super(MQTTHub, self).__init__()
+        if partition is not None and not 0 <= partition[0] < partition[1]:
+            raise ValueError("Invalid partition {0}, the index has to be in range(count).".format(partition))
+
+        self.broker = hostname
+        self.port = port
+        self.client_id = client_id or unique_client_id("ShairportHub")
+        self.partition = partition
+        self._qos = qos
+        self._max_inflight = max_inflight
+        self._shared_group = shared_group
+        if shared_group and partition is not None:
+            self._shared_group = "{0}-{1}".format(shared_group, partition[0])
+        self._zones = {}  # zone name => (topic, listener)
+        self._router = TopicRouter()
+        self._client = None
+
+    def add_zone(self, name, topic=None, listener=None):
+        """
+        Receive the messages of a shairport-sync instance. The messages are only subscribed if the zone belongs to
+        the partition of the hub.
+        :param name: unique name of the zone
+        :param topic: topic configured in shairport-sync (the name is used if None)
+        :param listener: AirplayListener which stores the state of the zone (a new one is created if None)
+        :return: listener of the zone
+        """
+        if name in self._zones:
+            raise ValueError("Zone {0} already exists.".format(name))
+        topic = topic or name
+        listener = listener if listener is not None else AirplayListener()
+        self._zones[name] = (topic, listener)
+        if self.owns_zone(name):
+            self._router.add(topic, listener)
+            if self._client is not None:
+                self._client.subscribe(self._subscription(topic), qos=self._qos)
+        return listener
+
+    def remove_zone(self, name):
+        """
+        Stop receiving the messages of a zone.
+        :param name: name of the zone
+        """
+        owned = self.owns_zone(name)
+        topic, _ = self._zones.pop(name)
+        if owned:
+            self._router.remove(topic)
+            if self._client is not None:
+                self._client.unsubscribe(self._subscription(topic))
+
+    def zone(self, name):
+        """
+        :param name: name of the zone
+        :return: listener of the zone
+        """
+        return self._zones[name][1]
+
+    @property
+    def zones(self):
+        """
+        :return: list of all zone names
+        """
+        return list(self._zones)
+
+    def owns_zone(self, name):
+        """
+        :param name: name of the zone
+        :return: True if the zone belongs to the partition of this hub
+        """
+        if self.partition is None:
+            return True
+        index, count = self.partition
+        return zone_partition(self._zones[name][0], count) == index
+
+    @property
+    def owned_zones(self):
+        """
+        :return: list of the zone names which are processed by this hub
+        """
+        return [name for name in self._zones if self.owns_zone(name)]
+
+    def _subscription(self, topic):
+        return subscription_filter(topic, self._shared_group)
+
+    def receive_message(self, client, userdata, message): # pylint: disable=W0613
+        """
+        Route a received message to the listener of its zone.
+        """
+        route = self._router.route(message.topic)
+        if route is not None:
+            listener, msg_type, msg_code = route
+            listener._process_item(item_from_message(msg_type, msg_code, message)) # pylint: disable=W0212
+
+    def _on_connect(self, client, *args): # pylint: disable=W0613
+        """
+        Subscribe to all zones of the partition after each (re)connect.
+        """
+        topics = [(self._subscription(self._zones[name][0]), self._qos) for name in self.owned_zones]
+        if topics:
+            client.subscribe(topics)
+
+    def start(self):
+        """
+        Connect to the broker and process the messages in a background thread.
+        """
+        self._client = create_client(self.client_id, self._max_inflight, shared=bool(self._shared_group))
+        self._client.on_message = self.receive_message
+        self._client.on_connect = self._on_connect
+        self._client.connect(self.broker, port=self.port)
+        self._client.loop_start()
+        logger.info("Start listening to mqtt broker %s with %s of %s zones: ...", self.broker,
+                    len(self.owned_zones), len(self._zones))
+
+    def stop(self):
+        """
+        Disconnect from the broker.
+        """
+        if self._client is not None:
+            self._client.disconnect()
+            self._client.loop_stop()
+            self._client = None
@@ -6,20 +6,26 @@ import stat
 from time import sleep
 from threading import Thread
 
-from ..item import Item
+from ..tokenizer import ItemTokenizer
+from ..profiling import ANY_CODE
+from ..util import perf_counter_ns
 from .airplaylistener import AirplayListener, logger
 
 # import this name to parse the dafault pipe
 DEFAULT_PIPE_FILE = "/tmp/shairport-sync-metadata"
 
+# number of bytes to read from the pipe at once
+DEFAULT_CHUNK_SIZE = 65536
+
 
 class AirplayPipeListener(AirplayListener):
     """
     Airplay listener class to read the shairport-sync pipe backend.
     """
-    def __init__(self, *args, pipe_name=DEFAULT_PIPE_FILE, **kwargs):
+    def __init__(self, *args, pipe_name=DEFAULT_PIPE_FILE, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
         """
         :param pipe_name: path to shairport-sync pipe file
+        :param chunk_size: number of bytes to read from the pipe at once
         """
         super(AirplayPipeListener, self).__init__(*args, **kwargs)
 
@@ -28,6 +34,10 @@ class AirplayPipeListener(AirplayListener):
             raise ValueError("Pipefile must be a string.")
 
         self._pipe_file = pipe_name
+        self._chunk_size = chunk_size
+        self._tokenizer = ItemTokenizer()
+        self._tokenizer.profiler = self.profiler
+        self.metrics.add_source(lambda: {"parse_failures": self._tokenizer.failures})
 
     @property
     def pipe_file(self):
@@ -61,26 +71,33 @@ class AirplayPipeListener(AirplayListener):
 
         logger.info("Start parsing the pipe %s: ...", self.pipe_file)
 
-        tmp = ""  # temporary string which stores one item
+        tokenizer = self._tokenizer
+        chunk = bytearray(self._chunk_size)  # reusable read buffer
+        view = memoryview(chunk)
         while self._is_listening:
-            with open(self.pipe_file) as pipe:
-                for line in pipe:
-                    # service was stopped
-                    if not self._is_listening:
+            tokenizer.reset()
+            with open(self.pipe_file, "rb", buffering=0) as pipe:
+                while self._is_listening:
+                    size = self._read(pipe, chunk)
+                    # the writer closed the pipe => reopen it
+                    if not size:
                         break
 
-                    strip_line = line.strip()
-                    if strip_line.endswith("</item>"):
-                        item = Item.item_from_xml_string(tmp + strip_line)
-                        if item:
-                            self._process_item(item)
-                        tmp = ""
-                    elif strip_line.startswith("<item>"):
-                        # if only a closing tag is missing we try to close the tag and try to parse the data
-                        if tmp != "":
-                            item = Item.item_from_xml_string(tmp + "</item>")
-                            if item:
-                                self._process_item(item)
-                        tmp = strip_line
-                    else:
-                        tmp += strip_line
+                    for item in tokenizer.feed(view[:size]):
+                        # service was stopped
+                        if not self._is_listening:
+                            break
+                        self._process_item(item)
+
+    def _read(self, pipe, chunk):
+        """
+        Read from the pipe into the chunk and measure the read stage if the read is sampled.
+        :return: number of bytes read
+        """
+        profiler = self.profiler
+        if profiler is None or not profiler.sample():
+            return pipe.readinto(chunk)
+        start = perf_counter_ns()
+        size = pipe.readinto(chunk)
+        profiler.record("read", ANY_CODE, perf_counter_ns() - start)
+        return size
@@ -0,0 +1,74 @@
+"""
+Module to replay the items of a capture file instead of listening to shairport-sync.
+"""
+from time import sleep, monotonic
+from threading import Thread
+
+from ..capture import read_capture
+from .airplaylistener import AirplayListener, logger
+
+
+class AirplayReplayListener(AirplayListener):
+    """
+    Airplay listener class which processes the items recorded inside a capture file.
+    """
+    def __init__(self, *args, capture_file, speed=1.0, **kwargs):
+        """
+        :param capture_file: path to the capture file
+        :param speed: replay speed relative to the original timing (e.g. 10 for ten times faster). Use None or 0 to
+        replay all items as fast as possible.
+        """
+        super(AirplayReplayListener, self).__init__(*args, **kwargs)
+        self._capture_file = capture_file
+        self._speed = speed
+        self.replayed = 0  # number of processed items
+
+    @property
+    def capture_file(self):
+        """
+        :return: Readonly path to the capture file.
+        """
+        return self._capture_file
+
+    def start_listening(self):
+        """
+        Replay the capture file in a background thread. shairport-sync is not started.
+        """
+        self._enable_progress_timer()
+        thread = Thread(target=self.replay)
+        thread.daemon = True
+        thread.start()
+
+    def stop_listening(self):
+        """
+        Stop replaying the capture file.
+        """
+        self._is_listening = False
+        self.flush_state()
+        self._disable_progress_timer()
+
+    def replay(self):
+        """
+        Process all items of the capture file with their original timing scaled by the speed. This method is blocking.
+        :return: number of processed items
+        """
+        self._is_listening = True
+        logger.info("Start replaying %s ...", self.capture_file)
+
+        start = first_timestamp = None
+        for timestamp, item in read_capture(self.capture_file):
+            if not self._is_listening:
+                break
+
+            if self._speed:
+                if start is None:
+                    start, first_timestamp = monotonic(), timestamp
+                delay = start + (timestamp - first_timestamp) / self._speed - monotonic()
+                if delay > 0:
+                    sleep(delay)
+
+            self._process_item(item)
+            self.replayed += 1
+
+        self._is_listening = False
+        return self.replayed
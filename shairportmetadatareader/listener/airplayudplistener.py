@@ -1,11 +1,18 @@
 """
 Module to listen to the udp backend of shairport-sync.
 """
+import os
 import socket
+import selectors
+from weakref import ref
+from time import monotonic
 from threading import Thread
+from collections import OrderedDict
 
 from ..item import Item
-from ..util import to_unicode, hex_bytes_to_int
+from ..itemqueue import ItemQueue, DROP_OLDEST_PROGRESS
+from ..profiling import ANY_CODE
+from ..util import to_unicode, hex_bytes_to_int, perf_counter_ns
 from .airplaylistener import AirplayListener, logger
 
 
@@ -13,18 +20,263 @@ from .airplaylistener import AirplayListener, logger
 DEFAULT_ADDRESS = "127.0.0.1"
 DEFAULT_PORT = 5555
 
+# linux socket tables which contain the number of datagrams dropped by the kernel
+PROC_NET_UDP = ("/proc/net/udp", "/proc/net/udp6")
 
-class AirplayUDPListener(AirplayListener):
+
+def kernel_drop_count(sock, tables=PROC_NET_UDP):
+    """
+    Read the number of datagrams the kernel dropped for a socket because its receive buffer was full.
+    :param sock: bound udp socket
+    :param tables: socket tables to search for the socket
+    :return: number of dropped datagrams or None if the count is not available on this platform
+    """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+    except (OSError, ValueError):
+        return None
+
+    for table in tables:
+        try:
+            with open(table) as file:
+                lines = file.readlines()[1:]
+        except IOError:
+            continue
+        for line in lines:
+            # sl local_address rem_address st tx_queue:rx_queue tr:tm->when retrnsmt uid timeout inode ref pointer drops
+            fields = line.split()
+            if len(fields) >= 13 and fields[9] == inode:
+                return int(fields[-1])
+    return None
+
+
+class _PendingMessage(object): # pylint: disable=R0205, R0902, R0903
+    """
+    Chunks of a single message which is not yet complete. All chunks except the last one have the same size, therefore
+    each chunk can be written directly to its final position inside the buffer. The buffer grows with the received
+    chunks, so the memory used by a message is limited by the data which was actually received.
+    """
+    __slots__ = ("count", "created", "received", "missing", "chunk_size", "buffer", "last_chunk", "last_length")
+
+    def __init__(self, count, created):
+        self.count = count            # number of chunks of the message
+        self.created = created        # time when the first chunk was received
+        self.received = bytearray(count)  # 1 for each chunk index which was already received
+        self.missing = count          # number of chunks which are not yet received
+        self.chunk_size = None        # size of all chunks except the last one
+        self.buffer = None            # buffer for the whole message, grows up to the end of the last written chunk
+        self.last_chunk = None        # copy of the last chunk if it was received before the chunk size is known
+        self.last_length = 0          # size of the last chunk
+
+
+class ChunkReassembler(object): # pylint: disable=R0205, R0902
+    """
+    Reassemble the "chnk" datagrams which shairport-sync uses to send large items (e.g. artwork). Chunks are collected
+    per logical message (type, code, chunk count), so other datagrams can be received in between and chunks can arrive
+    in any order. Incomplete messages are dropped after a timeout or if too many messages are incomplete. A chunk for an
+    index which was already received belongs to a new transfer (e.g. the next artwork after a chunk was lost), in this
+    case the incomplete message is dropped and the new one is started with this chunk.
+
+    The chunk count is taken from the untrusted datagram header, therefore messages with more than `max_chunks` chunks
+    or more than `max_message_bytes` bytes are dropped as malformed.
+    """
+    # pylint: disable=R0913
+    def __init__(self, timeout=5.0, max_pending=8, clock=monotonic, max_chunks=65536,
+                 max_message_bytes=16 * 1024 * 1024):
+        """
+        :param timeout: time in seconds after which an incomplete message is dropped
+        :param max_pending: maximum number of incomplete messages, the oldest one is dropped if this limit is exceeded
+        :param clock: function which returns the current time in seconds
+        :param max_chunks: maximum number of chunks of a single message
+        :param max_message_bytes: maximum size of a reassembled message in bytes
+        """
+        super(ChunkReassembler, self).__init__()
+        self._timeout = timeout
+        self._max_pending = max_pending
+        self._max_chunks = max_chunks
+        self._max_message_bytes = max_message_bytes
+        self._clock = clock
+        self._pending = OrderedDict()  # (type, code, chunk count) => _PendingMessage
+
+        self.completed = 0   # number of reassembled messages
+        self.dropped = 0     # number of incomplete messages which were dropped
+        self.malformed = 0   # number of chunks with an invalid header or size
+
+    def stats(self):
+        """
+        :return: dictionary with all counters and the number of currently incomplete messages
+        """
+        return {"completed": self.completed, "dropped": self.dropped, "malformed": self.malformed,
+                "pending": len(self._pending)}
+
+    def add(self, msg_data):
+        """
+        Add a chunk datagram.
+        :param msg_data: datagram as bytes like object
+        :return: item if the message is complete, otherwise None
+        """
+        now = self._clock()
+        self._evict(now)
+
+        if len(msg_data) < 24:
+            self.malformed += 1
+            return None
+
+        index = hex_bytes_to_int(msg_data[8:12])   # position of the chunk inside the message
+        count = hex_bytes_to_int(msg_data[12:16])  # amount of chunks which need to be received
+        if index >= count or count > self._max_chunks:
+            self.malformed += 1
+            return None
+
+        item_type = to_unicode(msg_data[16:20])
+        code = to_unicode(msg_data[20:24])
+        data = memoryview(msg_data)[24:]
+        if count == 1:
+            self.completed += 1
+            return Item(item_type, code, text=data, length=len(data), encoding="bytes")
+
+        key = (item_type, code, count)
+        message = self._pending.get(key)
+        if message is not None and message.received[index]:
+            # never mix the chunks of two transfers => drop the stale message and start a new one
+            del self._pending[key]
+            self.dropped += 1
+            logger.warning("Dropping incomplete %s message, a new transfer started.", code)
+            message = None
+        if message is None:
+            if len(self._pending) >= self._max_pending:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+            message = self._pending[key] = _PendingMessage(count, now)
+
+        if not self._write(message, index, data):
+            del self._pending[key]
+            self.malformed += 1
+            return None
+
+        message.received[index] = 1
+        message.missing -= 1
+        if message.missing:
+            return None
+
+        # all chunks were received => create the item
+        del self._pending[key]
+        self.completed += 1
+        length = (count - 1) * message.chunk_size + message.last_length
+        return Item(item_type, code, text=memoryview(message.buffer)[:length], length=length, encoding="bytes")
+
+    def _write(self, message, index, data): # pylint: disable=R0911
+        """
+        Copy a chunk to its position inside the message buffer.
+        :return: False if the chunk size does not match the other chunks or the message would be too large
+        """
+        if index == message.count - 1:
+            # the last chunk might be smaller than all other chunks
+            message.last_length = len(data)
+            if message.chunk_size is None:
+                # the datagram might be stored in a buffer which is reused => keep a copy
+                message.last_chunk = bytes(data)
+                return True
+            if len(data) > message.chunk_size:
+                return False
+        else:
+            if message.chunk_size is None:
+                if not data or len(data) * (message.count - 1) > self._max_message_bytes:
+                    return False
+                message.chunk_size = len(data)
+                message.buffer = bytearray()
+                if message.last_chunk is not None:
+                    last_chunk, message.last_chunk = message.last_chunk, None
+                    if not self._write(message, message.count - 1, last_chunk):
+                        return False
+            elif len(data) != message.chunk_size:
+                return False
+
+        offset = index * message.chunk_size
+        end = offset + len(data)
+        if end > self._max_message_bytes:
+            return False
+        if end > len(message.buffer):
+            message.buffer.extend(bytes(end - len(message.buffer)))
+        message.buffer[offset:end] = data
+        return True
+
+    def _evict(self, now):
+        """
+        Drop all incomplete messages whose first chunk was received before the timeout.
+        """
+        while self._pending:
+            key, message = next(iter(self._pending.items()))
+            if now - message.created < self._timeout:
+                break
+            del self._pending[key]
+            self.dropped += 1
+            logger.warning("Dropping incomplete %s message after %s seconds.", key[1], self._timeout)
+
+
+def chunk_failures(reassembler):
+    """
+    :param reassembler: ChunkReassembler
+    :return: number of chunked messages which were dropped or malformed
+    """
+    return reassembler.dropped + reassembler.malformed
+
+
+class DatagramDecoder(object): # pylint: disable=R0205, R0903
+    """
+    Convert the datagrams send by the shairport-sync udp server to items. Large items (e.g. artwork) are split by
+    shairport-sync into multiple chunks which are reassembled by a ChunkReassembler.
+    """
+    def __init__(self, reassembler=None):
+        """
+        :param reassembler: ChunkReassembler to use (a default one is created if None)
+        """
+        super(DatagramDecoder, self).__init__()
+        self.reassembler = reassembler if reassembler is not None else ChunkReassembler()
+
+    def decode(self, msg_data):
+        """
+        Decode a single datagram.
+        :param msg_data: received datagram as bytes like object
+        :return: item or None if the datagram is only a part of an item
+        """
+        if msg_data[4:8] == b"chnk":
+            return self.reassembler.add(msg_data)
+
+        # process normal message which might include an optional argument
+        return Item(to_unicode(msg_data[:4]), to_unicode(msg_data[4:8]), text=memoryview(msg_data)[8:],
+                    length=len(msg_data)-8, encoding="bytes")
+
+
+class AirplayUDPListener(AirplayListener): # pylint: disable=R0902
     """
     Airplay listener class to read the shairport-sync udp server backend.
     """
-    def __init__(self, *args, socket_address=DEFAULT_ADDRESS, socket_port=DEFAULT_PORT, **kwargs):
+    # pylint: disable=R0913
+    def __init__(self, *args, socket_address=DEFAULT_ADDRESS, socket_port=DEFAULT_PORT, receive_buffers=0,
+                 batch_size=64, rcvbuf_size=None, queue_size=0, overflow_policy=DROP_OLDEST_PROGRESS, **kwargs):
         """
         :param socket_addr: tuple consisting of (socket_ip, socket_port)
+        :param receive_buffers: number of preallocated buffers the datagrams are received into. Items only keep a view
+        of these buffers, their data is copied if an item is still in use when its buffer is reused. Use 0 to allocate
+        a new buffer for every datagram.
+        :param batch_size: maximum number of datagrams to receive at once if receive_buffers is used
+        :param rcvbuf_size: size of the kernel receive buffer of the socket in bytes (None keeps the system default)
+        :param queue_size: maximum number of items queued between the receiving thread and the thread which processes
+        the items and runs the callbacks. Use 0 to process the items on the receiving thread.
+        :param overflow_policy: what to do if the queue is full: "drop_oldest_progress", "coalesce" or "block"
         """
         super(AirplayUDPListener, self).__init__(*args, **kwargs)
 
         self._socket_addr = (socket_address, socket_port)
+        self._decoder = DatagramDecoder()
+        self._receive_buffers = receive_buffers
+        self._batch_size = batch_size
+        self._rcvbuf_size = rcvbuf_size
+        self._overflow_policy = overflow_policy
+        self._queue = ItemQueue(queue_size, overflow_policy) if queue_size > 0 else None
+        self._socket = None
+        self.metrics.add_source(lambda: {"chunk_failures": chunk_failures(self._decoder.reassembler)})
 
     @property
     def socket_addr(self):
@@ -33,6 +285,23 @@ class AirplayUDPListener(AirplayListener):
         """
         return self._socket_addr
 
+    @property
+    def chunk_stats(self):
+        """
+        :return: counters for reassembled, dropped and malformed chunked messages
+        """
+        return self._decoder.reassembler.stats()
+
+    @property
+    def drop_counts(self):
+        """
+        :return: number of datagrams dropped by the kernel (None if unknown) and number of items dropped because the
+        queue was full
+        """
+        kernel = kernel_drop_count(self._socket) if self._socket is not None else None
+        queue = self._queue.dropped if self._queue is not None else 0
+        return {"kernel": kernel, "queue": queue}
+
     def start_listening(self):
         """
         Start shairport sync and continuously parse the metadata socket in a background thread.
@@ -43,52 +312,150 @@ class AirplayUDPListener(AirplayListener):
         thread.daemon = True
         thread.start()
 
+    def stop_listening(self):
+        """
+        Stop parsing the metadata and wake up the receiving thread if it waits for room in a full queue.
+        """
+        super(AirplayUDPListener, self).stop_listening()
+        if self._queue is not None:
+            self._queue.close()
+
     def parse_socket(self, buffer_size=65000):
         """
         Parse the udp socket for metadata information. This method is blocking.
         :param buffer_size: default buffer size to receive (65000 is the shairport-sync default)
         """
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Internet UDP socket
-        sock.bind(self.socket_addr)
-
+        sock = self._create_socket()
         self._is_listening = True
 
         logger.info("Start listening to socket %s:%s...", self.socket_addr[0], self.socket_addr[1])
 
-        i = 0        # number of chunks which were already received
-        chunks = []  # list with all chunks
+        if self._queue is not None:
+            # a closed queue rejects all items => use a new one if the listener is restarted
+            self._queue = ItemQueue(self._queue.maxsize, self._overflow_policy)
+            worker = Thread(target=self._process_queue)
+            worker.daemon = True
+            worker.start()
+
+        try:
+            if self._receive_buffers > 0:
+                self._receive_into_buffers(sock, buffer_size)
+                return
+
+            while self._is_listening:
+                profiler = self.profiler
+                if profiler is not None and profiler.sample():
+                    start = perf_counter_ns()
+                    msg_data, _ = sock.recvfrom(buffer_size)
+                    profiler.record("read", ANY_CODE, perf_counter_ns() - start)
+                else:
+                    msg_data, _ = sock.recvfrom(buffer_size)
+                self._process_datagram(msg_data)
+        finally:
+            if self._queue is not None:
+                self._queue.close()
 
+    def _create_socket(self):
+        """
+        Create the udp socket with the configured receive buffer size and bind it to the socket address.
+        :return: bound socket
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Internet UDP socket
+        if self._rcvbuf_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._rcvbuf_size)
+            # the kernel limits the size (e.g. net.core.rmem_max on linux) and linux reports twice the requested size
+            actual_size = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+            if actual_size < self._rcvbuf_size:
+                logger.warning("Receive buffer size limited to %s bytes instead of %s bytes.", actual_size,
+                               self._rcvbuf_size)
+        sock.bind(self.socket_addr)
+        self._socket = sock
+        return sock
+
+    def _process_queue(self):
+        """
+        Process the queued items until the listener is stopped.
+        """
         while self._is_listening:
-            msg_data, _ = sock.recvfrom(buffer_size)
-            item_type = to_unicode(msg_data[:4])
-            code = to_unicode(msg_data[4:8])
-
-            if code == "chnk":
-                # accumulate data if only a chunk is send
-                i += 1
-                chunk_index = hex_bytes_to_int(msg_data[8:12])   # position of the chunk inside the target bytes array
-                chunk_count = hex_bytes_to_int(msg_data[12:16])  # amount of chunks which need to be received
-                # create an empty dummy array for all chunks
-                if not chunks:
-                    chunks = [b""]*chunk_count
-                # insert data chunk into the array at the correct position
-                # there is no guarantee that the chunks are received in the correct order
-                chunks[chunk_index] = msg_data[24:]
-
-                # all chunks were received => create the item
-                if chunk_count == i:
-                    item = Item(item_type=to_unicode(msg_data[16:20]),
-                                code=to_unicode(msg_data[20:24]),
-                                text=b"".join(chunks),
-                                length=sum(len(c) for c in chunks),
-                                encoding="bytes")
-                    self._process_item(item)
-            else:
-                # reset chunk data if at least one chunk was received in the meantime
-                if i > 0:
-                    i = 0
-                    chunks = []
-
-                # process normal message which might include an optional argument
-                item = Item(item_type, code, text=msg_data[8:] or None, length=len(msg_data)-8, encoding="bytes")
+            item = self._queue.get(timeout=1.0)
+            if item is not None:
                 self._process_item(item)
+
+    def _dispatch_item(self, item):
+        """
+        Process the item on this thread or pass it to the processing thread if a queue is used.
+        :param item: metadata item
+        """
+        if self._queue is not None:
+            self._queue.put(item)
+        else:
+            self._process_item(item)
+
+    def _receive_into_buffers(self, sock, buffer_size):
+        """
+        Receive the datagrams into a ring of preallocated buffers. All pending datagrams are received in a batch
+        whenever the socket becomes readable.
+        :param sock: bound udp socket
+        :param buffer_size: size of each buffer
+        """
+        buffers = [bytearray(buffer_size) for _ in range(self._receive_buffers)]
+        views = [memoryview(buf) for buf in buffers]
+        owners = [None] * len(buffers)  # weak reference to the last item which uses each buffer
+        index = 0
+
+        sock.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+
+        while self._is_listening:
+            if not selector.select(timeout=1.0):
+                continue
+
+            for _ in range(self._batch_size):
+                # the item which uses this buffer is still alive => it needs its own copy of the data
+                owner = owners[index] and owners[index]()
+                if owner is not None:
+                    owner.detach()
+                owners[index] = None
+
+                profiler = self.profiler
+                sampled = profiler is not None and profiler.sample()
+                start = perf_counter_ns() if sampled else 0
+                try:
+                    size = sock.recv_into(buffers[index])
+                except (BlockingIOError, InterruptedError):
+                    break
+                if sampled:
+                    profiler.record("read", ANY_CODE, perf_counter_ns() - start)
+
+                item = self._decode(views[index][:size])
+                if item:
+                    self._dispatch_item(item)
+                    owners[index] = ref(item)
+                index = (index + 1) % len(buffers)
+        selector.close()
+
+    def _process_datagram(self, msg_data):
+        """
+        Decode a datagram and process the item if it is complete.
+        :param msg_data: received datagram as bytes
+        """
+        item = self._decode(msg_data)
+        if item:
+            self._dispatch_item(item)
+
+    def _decode(self, msg_data):
+        """
+        Decode a datagram and measure the framing (chunk reassembly) or item stage if the datagram is sampled.
+        :param msg_data: received datagram as bytes like object
+        :return: item or None if the datagram is only a part of an item
+        """
+        profiler = self.profiler
+        if profiler is None or not profiler.sample():
+            return self._decoder.decode(msg_data)
+
+        start = perf_counter_ns()
+        item = self._decoder.decode(msg_data)
+        stage = "framing" if msg_data[4:8] == b"chnk" else "item"
+        profiler.record(stage, item.code if item else ANY_CODE, perf_counter_ns() - start)
+        return item
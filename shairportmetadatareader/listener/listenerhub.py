@@ -0,0 +1,336 @@
+"""
+Module to serve many shairport-sync instances (zones) from a single thread. All udp sockets and pipes are registered
+on one selector and the decoded items are routed to one AirplayListener state object per zone.
+
+Example:
+    hub = ListenerHub()
+    kitchen = hub.add_udp_zone("kitchen", socket_port=5555)
+    living_room = hub.add_pipe_zone("living_room", pipe_name="/tmp/shairport-sync-living-room")
+    kitchen.bind(track_info=on_track_info)
+    hub.start()
+"""
+import os
+import stat
+import errno
+import socket
+import selectors
+from time import time, sleep
+from threading import Thread, Lock
+
+from .airplaylistener import AirplayListener, logger
+from .airplayudplistener import DatagramDecoder, chunk_failures, DEFAULT_ADDRESS, DEFAULT_PORT
+from .airplaypipelistener import DEFAULT_PIPE_FILE, DEFAULT_CHUNK_SIZE
+from ..tokenizer import ItemTokenizer
+
+# maximum size of a datagram send by shairport-sync
+MAX_DATAGRAM_SIZE = 65536
+
+
+class Zone(object): # pylint: disable=R0205, R0902, R0903
+    """
+    A single shairport-sync instance served by the hub.
+    """
+    def __init__(self, name, listener):
+        super(Zone, self).__init__()
+        self.name = name
+        self.listener = listener  # AirplayListener which stores the state of this zone
+        self.source = None        # udp socket or pipe file descriptor
+        self.decoder = None       # DatagramDecoder or ItemTokenizer
+
+        # throughput counters
+        self.items = 0
+        self.bytes = 0
+        self.reads = 0
+        self.errors = 0  # number of failed reads and items which could not be processed
+        self.created = time()
+
+    def stats(self):
+        """
+        :return: dictionary with the throughput counters of this zone
+        """
+        duration = max(time() - self.created, 1e-9)
+        return {"items": self.items, "bytes": self.bytes, "reads": self.reads, "errors": self.errors,
+                "items_per_second": self.items / duration, "bytes_per_second": self.bytes / duration}
+
+
+class UDPZone(Zone):
+    """
+    Zone which receives the metadata from a shairport-sync udp server.
+    """
+    def __init__(self, name, listener, socket_addr):
+        super(UDPZone, self).__init__(name, listener)
+        self.socket_addr = socket_addr
+        self.decoder = DatagramDecoder()
+        listener.metrics.add_source(lambda: {"chunk_failures": chunk_failures(self.decoder.reassembler)})
+
+    def open(self):
+        """
+        Bind the udp socket.
+        """
+        self.source = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.source.setblocking(False)
+        self.source.bind(self.socket_addr)
+
+    def close(self):
+        """
+        Close the udp socket.
+        """
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+
+    def read(self):
+        """
+        Receive all pending datagrams.
+        :return: list of complete items
+        """
+        items = []
+        while True:
+            try:
+                msg_data = self.source.recv(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return items
+            self.reads += 1
+            self.bytes += len(msg_data)
+            item = self.decoder.decode(msg_data)
+            if item:
+                items.append(item)
+
+
+class PipeZone(Zone):
+    """
+    Zone which reads the metadata from a shairport-sync pipe.
+    """
+    def __init__(self, name, listener, pipe_name, chunk_size=DEFAULT_CHUNK_SIZE):
+        super(PipeZone, self).__init__(name, listener)
+        self.pipe_name = pipe_name
+        self.decoder = ItemTokenizer()
+        self.decoder.profiler = listener.profiler
+        listener.metrics.add_source(lambda: {"parse_failures": self.decoder.failures})
+        self._keep_alive_fd = None
+        self._chunk = bytearray(chunk_size)  # reusable read buffer
+
+    def open(self):
+        """
+        Open the pipe without blocking.
+        """
+        self.source = os.open(self.pipe_name, os.O_RDONLY | os.O_NONBLOCK)
+        # keep a writing end open, otherwise the pipe is permanently readable (EOF) while shairport-sync is not
+        # writing to the pipe
+        self._keep_alive_fd = os.open(self.pipe_name, os.O_WRONLY | os.O_NONBLOCK)
+        self.decoder.reset()
+
+    def close(self):
+        """
+        Close the pipe.
+        """
+        if self.source is not None:
+            os.close(self.source)
+            os.close(self._keep_alive_fd)
+            self.source = None
+            self._keep_alive_fd = None
+
+    def exists(self):
+        """
+        :return: True if the pipe file exists
+        """
+        return os.path.exists(self.pipe_name) and stat.S_ISFIFO(os.stat(self.pipe_name).st_mode)
+
+    def read(self):
+        """
+        Read all available data from the pipe.
+        :return: list of complete items
+        """
+        items = []
+        view = memoryview(self._chunk)
+        while True:
+            try:
+                size = os.readv(self.source, [self._chunk])
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return items
+                raise
+            if not size:
+                return items
+            self.reads += 1
+            self.bytes += size
+            items += self.decoder.feed(view[:size])
+
+
+class ListenerHub(object): # pylint: disable=R0205
+    """
+    Serve many udp and pipe zones with a single selector loop running in one background thread.
+    """
+    def __init__(self, poll_interval=1.0):
+        """
+        :param poll_interval: maximum time in seconds to wait inside the selector before checking if the hub was
+        stopped or if missing pipes were created
+        """
+        super(ListenerHub, self).__init__()
+        self._selector = selectors.DefaultSelector()
+        self._zones = {}
+        self._waiting_pipes = []  # pipe zones whose pipe file does not exist yet
+        self._lock = Lock()
+        self._poll_interval = poll_interval
+        self._is_running = False
+        self._thread = None
+
+    # ----------------------------------------------------- zones ------------------------------------------------------
+
+    def add_udp_zone(self, name, listener=None, socket_address=DEFAULT_ADDRESS, socket_port=DEFAULT_PORT):
+        """
+        Listen to a shairport-sync udp server.
+        :param name: unique name of the zone
+        :param listener: AirplayListener which stores the state of the zone (a new one is created if None)
+        :param socket_address: address to bind the udp socket to
+        :param socket_port: port to bind the udp socket to
+        :return: listener of the zone
+        """
+        zone = UDPZone(name, listener if listener is not None else AirplayListener(), (socket_address, socket_port))
+        zone.open()
+        self._add_zone(zone)
+        return zone.listener
+
+    def add_pipe_zone(self, name, listener=None, pipe_name=DEFAULT_PIPE_FILE):
+        """
+        Read a shairport-sync pipe. If the pipe does not exist yet, it is opened as soon as it is created.
+        :param name: unique name of the zone
+        :param listener: AirplayListener which stores the state of the zone (a new one is created if None)
+        :param pipe_name: path to the shairport-sync pipe file
+        :return: listener of the zone
+        """
+        zone = PipeZone(name, listener if listener is not None else AirplayListener(), pipe_name)
+        if zone.exists():
+            zone.open()
+            self._add_zone(zone)
+        else:
+            logger.warning("Could not find pipe: %s. Waiting till it is created...", pipe_name)
+            with self._lock:
+                self._check_name(name)
+                self._zones[name] = zone
+                self._waiting_pipes.append(zone)
+        return zone.listener
+
+    def remove_zone(self, name):
+        """
+        Stop serving a zone.
+        :param name: name of the zone
+        """
+        with self._lock:
+            zone = self._zones.pop(name)
+            if zone in self._waiting_pipes:
+                self._waiting_pipes.remove(zone)
+            else:
+                self._selector.unregister(zone.source)
+            zone.close()
+
+    def zone(self, name):
+        """
+        :param name: name of the zone
+        :return: listener of the zone
+        """
+        return self._zones[name].listener
+
+    @property
+    def zones(self):
+        """
+        :return: list of all zone names
+        """
+        return list(self._zones)
+
+    def stats(self):
+        """
+        :return: dictionary mapping each zone name to its throughput counters
+        """
+        return {name: zone.stats() for name, zone in list(self._zones.items())}
+
+    def _check_name(self, name):
+        if name in self._zones:
+            raise ValueError("Zone {0} already exists.".format(name))
+
+    def _add_zone(self, zone):
+        with self._lock:
+            try:
+                self._check_name(zone.name)
+            except ValueError:
+                zone.close()
+                raise
+            self._zones[zone.name] = zone
+            self._selector.register(zone.source, selectors.EVENT_READ, zone)
+
+    # -------------------------------------------- start / stop listening ----------------------------------------------
+
+    def start(self):
+        """
+        Process all zones in a background thread.
+        """
+        self._is_running = True
+        self._thread = Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread and close all zones.
+        """
+        self._is_running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        for name in list(self._zones):
+            self.remove_zone(name)
+        self._selector.close()
+
+    def run(self):
+        """
+        Process all zones until `stop` is called. This method is blocking.
+        """
+        self._is_running = True
+        while self._is_running:
+            self.poll(self._poll_interval)
+
+    def poll(self, timeout=0):
+        """
+        Wait for data on any zone and process all received items. Errors are logged and counted per zone, a single
+        malformed item never stops the processing of the other items and zones.
+        :param timeout: maximum time to wait in seconds
+        :return: number of processed items
+        """
+        self._open_waiting_pipes()
+
+        # some selectors raise an error if no file descriptor is registered
+        if not self._selector.get_map():
+            sleep(timeout)
+            return 0
+
+        count = 0
+        for key, _ in self._selector.select(timeout):
+            zone = key.data
+            try:
+                items = zone.read()
+            except Exception: # pylint: disable=W0703
+                zone.errors += 1
+                logger.exception("Could not read the data of zone %s.", zone.name)
+                continue
+            for item in items:
+                zone.items += 1
+                count += 1
+                try:
+                    zone.listener._process_item(item) # pylint: disable=W0212
+                except Exception: # pylint: disable=W0703
+                    zone.errors += 1
+                    logger.exception("Could not process %s item of zone %s.", item.code, zone.name)
+        return count
+
+    def _open_waiting_pipes(self):
+        """
+        Open all pipes which were created in the meantime.
+        """
+        if not self._waiting_pipes:
+            return
+        with self._lock:
+            for zone in [zone for zone in self._waiting_pipes if zone.exists()]:
+                zone.open()
+                self._waiting_pipes.remove(zone)
+                self._selector.register(zone.source, selectors.EVENT_READ, zone)
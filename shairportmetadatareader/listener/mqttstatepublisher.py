@@ -0,0 +1,186 @@
+"""
+Module to publish the normalized state of a listener to a MQTT broker.
+
+Display clients subscribe to the retained snapshot instead of parsing the raw shairport-sync metadata themselves:
+
+    <topic>          retained snapshot of the state (json or msgpack), see `AirplayListener.state_snapshot`
+    <topic>/artwork  retained image data of the current artwork (optional)
+    <topic>/online   retained "1" while the publisher is connected, the broker publishes "0" if the connection is lost
+"""
+from time import monotonic
+from threading import Lock, Timer
+
+from ..util import encode_json, serializable_value
+from .airplaylistener import STATE_PROPERTIES, logger
+from .airplaymqttlistener import create_client, unique_client_id, DEFAULT_BROKER, DEFAULT_MQTT_PORT
+
+# msgpack is only required for the msgpack serializer.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def encode_msgpack(snapshot):
+    """
+    :param snapshot: state snapshot
+    :return: msgpack representation
+    """
+    return msgpack.packb(snapshot, use_bin_type=True, default=serializable_value)
+
+
+SERIALIZERS = {"json": encode_json, "msgpack": encode_msgpack}
+
+
+class MQTTStatePublisher(object): # pylint: disable=R0205, R0902
+    """
+    Publish the state of a listener as retained snapshot whenever it changes. Changes are published at most once per
+    `min_interval` (the last change is always published) and a snapshot which equals the previously published one is
+    suppressed.
+
+    Example:
+        listener = AirplayUDPListener()
+        publisher = MQTTStatePublisher(listener, topic="shairport/kitchen", hostname="127.0.0.1")
+        publisher.start()
+        listener.start_listening()
+    """
+    # pylint: disable=R0913
+    def __init__(self, listener, topic, hostname=DEFAULT_BROKER, port=DEFAULT_MQTT_PORT, client_id=None, qos=1,
+                 min_interval=0.5, serializer="json", publish_artwork=True):
+        """
+        :param listener: AirplayListener whose state is published
+        :param topic: topic of the snapshot
+        :param hostname: name of the mqtt broker
+        :param port: port of the mqtt broker as int
+        :param client_id: mqtt client id (a unique id is generated if None)
+        :param qos: quality of service level of the published messages
+        :param min_interval: minimum time in seconds between two snapshots
+        :param serializer: "json" or "msgpack"
+        :param publish_artwork: publish the image data of the artwork to <topic>/artwork
+        """
+        super(MQTTStatePublisher, self).__init__()
+        if serializer not in SERIALIZERS:
+            raise ValueError("Unknown serializer {0}, use one of {1}.".format(serializer, sorted(SERIALIZERS)))
+        if serializer == "msgpack" and msgpack is None:
+            raise ValueError("The msgpack serializer requires msgpack: pip install msgpack")
+
+        self.listener = listener
+        self.topic = topic
+        self.broker = hostname
+        self.port = port
+        self.client_id = client_id or unique_client_id("ShairportState")
+        self.qos = qos
+        self.min_interval = min_interval
+        self.publish_artwork = publish_artwork
+        self.published = 0   # number of published snapshots
+        self.suppressed = 0  # number of snapshots which were not published because nothing changed
+        self._encode = SERIALIZERS[serializer]
+        self._client = None
+        self._lock = Lock()
+        self._timer = None
+        self._last_publish = None   # monotonic time of the last published snapshot
+        self._last_payload = None
+        self._artwork_key = None
+        self._bound = False
+        self._bind()
+
+    def _bind(self):
+        """
+        Publish the changes of the listener state.
+        """
+        if not self._bound:
+            self.listener.bind(**{name: self._on_change for name in STATE_PROPERTIES})
+            self._bound = True
+
+    def _unbind(self):
+        """
+        Stop reacting to the changes of the listener state.
+        """
+        if self._bound:
+            self.listener.unbind(**{name: self._on_change for name in STATE_PROPERTIES})
+            self._bound = False
+
+    def publish(self, force=False):
+        """
+        Publish the current snapshot immediately.
+        :param force: publish the snapshot even if it did not change
+        :return: True if the snapshot was published
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            # encode and publish while holding the lock => concurrent snapshots are published in order
+            snapshot = self.listener.state_snapshot()
+            payload = self._encode(snapshot)
+            if payload == self._last_payload and not force:
+                self.suppressed += 1
+                return False
+            self._last_payload = payload
+            self._last_publish = monotonic()
+            self.published += 1
+
+            if self._client is not None:
+                self._client.publish(self.topic, payload, qos=self.qos, retain=True)
+                if self.publish_artwork:
+                    self._publish_artwork(snapshot["artwork_key"])
+        return True
+
+    def _publish_artwork(self, key):
+        """
+        Publish the image data if the artwork changed.
+        :param key: artwork key of the published snapshot
+        """
+        if key == self._artwork_key:
+            return
+        data = self.listener.artwork_store.get(key) if key else b""
+        self._artwork_key = key
+        self._client.publish("{0}/artwork".format(self.topic), data or b"", qos=self.qos, retain=True)
+
+    def _on_change(self, *args): # pylint: disable=W0613
+        """
+        Publish the state immediately or schedule the publication if the last snapshot was published too recently.
+        """
+        with self._lock:
+            if self._timer is not None:
+                return  # the scheduled snapshot will contain this change
+            wait = 0 if self._last_publish is None else self._last_publish + self.min_interval - monotonic()
+            if wait > 0:
+                self._timer = Timer(wait, self.publish)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        self.publish()
+
+    def start(self):
+        """
+        Connect to the broker and publish the current state.
+        """
+        self._bind()
+        self._client = create_client(self.client_id)
+        self._client.will_set("{0}/online".format(self.topic), b"0", qos=self.qos, retain=True)
+        self._client.connect(self.broker, port=self.port)
+        self._client.loop_start()
+        self._client.publish("{0}/online".format(self.topic), b"1", qos=self.qos, retain=True)
+        self.publish(force=True)
+        logger.info("Publish the listener state to %s: ...", self.topic)
+
+    def stop(self):
+        """
+        Publish the pending changes, mark the state as offline and disconnect from the broker. Changes of the listener
+        state are not published until the publisher is started again.
+        """
+        self._unbind()
+        with self._lock:
+            pending = self._timer is not None
+        if pending:
+            self.publish()
+        if self._client is not None:
+            info = self._client.publish("{0}/online".format(self.topic), b"0", qos=self.qos, retain=True)
+            try:
+                info.wait_for_publish(1)
+            except RuntimeError:
+                pass  # not connected, the broker publishes the will message
+            self._client.disconnect()
+            self._client.loop_stop()
+            self._client = None
@@ -0,0 +1,299 @@
+"""
+Lightweight metrics which are collected while listening to shairport-sync.
+
+Example:
+    listener = AirplayUDPListener(metrics=ListenerMetrics(time_callbacks=True))
+    print(listener.metrics.snapshot())
+    MetricsServer({"kitchen": listener}, port=9405).start()  # Prometheus text format on /metrics
+"""
+from bisect import bisect_left
+from threading import Lock, Thread
+from time import monotonic, perf_counter
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+except ImportError:
+    ThreadingHTTPServer = None
+
+# upper bounds of the latency buckets in seconds (50us ... ~26s)
+DEFAULT_LATENCY_BOUNDS = tuple(0.00005 * 2 ** i for i in range(20))
+
+
+class LatencyHistogram(object): # pylint: disable=R0205
+    """
+    Thread safe histogram of durations with fixed, exponentially growing buckets.
+    """
+    def __init__(self, bounds=DEFAULT_LATENCY_BOUNDS):
+        """
+        :param bounds: sorted upper bounds of the buckets in seconds, larger values are counted in an overflow bucket
+        """
+        super(LatencyHistogram, self).__init__()
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = Lock()
+
+    def record(self, duration):
+        """
+        Add a duration.
+        :param duration: duration in seconds
+        """
+        with self._lock:
+            self.buckets[bisect_left(self.bounds, duration)] += 1
+            self.count += 1
+            self.total += duration
+            self.max = max(self.max, duration)
+
+    def percentile(self, percent):
+        """
+        Estimate a percentile by the upper bound of the bucket which contains it.
+        :param percent: percentile between 0 and 100
+        :return: duration in seconds or None if no duration was recorded
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(1, percent / 100.0 * self.count)
+            seen = 0
+            for i, amount in enumerate(self.buckets):
+                seen += amount
+                if seen >= rank:
+                    return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        """
+        :return: dictionary with the count, mean, maximum and the 50th, 90th and 99th percentile in seconds
+        """
+        return {"count": self.count, "mean": self.total / self.count if self.count else None, "max": self.max,
+                "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99)}
+
+
+class ListenerMetrics(object): # pylint: disable=R0205, R0902
+    """
+    Counters of an AirplayListener. Recording an item only increments two dictionary entries, all other values are
+    computed when a snapshot is taken.
+    """
+    def __init__(self, time_callbacks=False, clock=monotonic):
+        """
+        :param time_callbacks: measure the duration of each callback bound with `AirplayListener.bind`. Callbacks
+        executed by a CallbackDispatcher are always measured by the dispatcher.
+        :param clock: function which returns the current time in seconds
+        """
+        super(ListenerMetrics, self).__init__()
+        self.time_callbacks = time_callbacks
+        self._clock = clock
+        self.items = {}   # (type, code) => number of items
+        self.bytes = {}   # (type, code) => number of payload bytes
+        self.last_item_time = None
+        self.callbacks = {}  # callback name => LatencyHistogram
+        self._sources = []   # functions which return additional counters e.g. parse failures
+        self._dispatcher = None
+
+    def record_item(self, item):
+        """
+        Count a received item.
+        :param item: metadata item
+        """
+        key = (item.type, item.code)
+        items = self.items
+        if key in items:
+            items[key] += 1
+            self.bytes[key] += item.length
+        else:
+            items[key] = 1
+            self.bytes[key] = item.length
+        self.last_item_time = self._clock()
+
+    def add_source(self, source):
+        """
+        Add a function which returns a dictionary of additional counters (e.g. parse_failures or chunk_failures). The
+        function is only called when a snapshot is taken. Counters with the same name are summed.
+        :param source: function without arguments
+        """
+        self._sources.append(source)
+
+    def use_dispatcher(self, dispatcher):
+        """
+        Include the callback latencies measured by a CallbackDispatcher.
+        :param dispatcher: CallbackDispatcher or None
+        """
+        self._dispatcher = dispatcher
+
+    def timed(self, name, callback):
+        """
+        :param name: name of the property the callback is bound to
+        :param callback: callback to measure
+        :return: function which calls the callback and records its duration
+        """
+        key = "{0}:{1}".format(name, getattr(callback, "__qualname__", None) or repr(callback))
+        histogram = self.callbacks.setdefault(key, LatencyHistogram())
+
+        def timed_callback(*args):
+            start = perf_counter()
+            try:
+                return callback(*args)
+            finally:
+                histogram.record(perf_counter() - start)
+        return timed_callback
+
+    def seconds_since_last_item(self):
+        """
+        :return: time in seconds since the last item was received or None if no item was received
+        """
+        return None if self.last_item_time is None else self._clock() - self.last_item_time
+
+    def counters(self):
+        """
+        :return: dictionary with the parse_failures, chunk_failures and all counters of the sources
+        """
+        counters = {"parse_failures": 0, "chunk_failures": 0}
+        for source in self._sources:
+            for name, value in source().items():
+                counters[name] = counters.get(name, 0) + value
+        return counters
+
+    def callback_histograms(self):
+        """
+        :return: dictionary mapping each callback name to its LatencyHistogram
+        """
+        histograms = dict(self.callbacks)
+        if self._dispatcher is not None:
+            histograms.update(self._dispatcher.histograms())
+        return histograms
+
+    def snapshot(self):
+        """
+        :return: dictionary with all counters
+        """
+        snapshot = self.counters()
+        snapshot["items"] = {"{0}/{1}".format(*key): value for key, value in list(self.items.items())}
+        snapshot["bytes"] = {"{0}/{1}".format(*key): value for key, value in list(self.bytes.items())}
+        snapshot["seconds_since_last_item"] = self.seconds_since_last_item()
+        snapshot["callbacks"] = {name: histogram.snapshot()
+                                 for name, histogram in self.callback_histograms().items()}
+        return snapshot
+
+
+# ------------------------------------------------ prometheus exporter ------------------------------------------------
+
+def _labels(**labels):
+    return "{" + ",".join('{0}="{1}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for key, value in sorted(labels.items())) + "}"
+
+
+def prometheus_text(listeners, prefix="shairport"):
+    """
+    Format the metrics of many listeners in the Prometheus text format.
+    :param listeners: dictionary mapping a zone name to an AirplayListener
+    :param prefix: prefix of all metric names
+    :return: metrics as str
+    """
+    lines = []
+
+    def metric(name, kind, description, samples):
+        lines.append("# HELP {0}_{1} {2}".format(prefix, name, description))
+        lines.append("# TYPE {0}_{1} {2}".format(prefix, name, kind))
+        for suffix, labels, value in samples:
+            lines.append("{0}_{1}{2}{3} {4}".format(prefix, name, suffix, _labels(**labels), value))
+
+    zones = sorted(listeners.items())
+    metrics = [(zone, listener.metrics) for zone, listener in zones]
+    metric("items_total", "counter", "Number of received items.",
+           [("", {"zone": zone, "type": key[0], "code": key[1]}, value)
+            for zone, m in metrics for key, value in sorted(m.items.items())])
+    metric("bytes_total", "counter", "Number of received payload bytes.",
+           [("", {"zone": zone, "type": key[0], "code": key[1]}, value)
+            for zone, m in metrics for key, value in sorted(m.bytes.items())])
+
+    counters = [(zone, m.counters()) for zone, m in metrics]
+    metric("parse_failures_total", "counter", "Number of items which could not be parsed.",
+           [("", {"zone": zone}, c["parse_failures"]) for zone, c in counters])
+    metric("chunk_failures_total", "counter", "Number of chunked messages which could not be reassembled.",
+           [("", {"zone": zone}, c["chunk_failures"]) for zone, c in counters])
+    metric("seconds_since_last_item", "gauge", "Time since the last item was received.",
+           [("", {"zone": zone}, m.seconds_since_last_item()) for zone, m in metrics
+            if m.last_item_time is not None])
+
+    samples = []
+    for zone, m in metrics:
+        for name, histogram in sorted(m.callback_histograms().items()):
+            cumulative = 0
+            for bound, amount in zip(histogram.bounds + ("+Inf",), histogram.buckets):
+                cumulative += amount
+                samples.append(("_bucket", {"zone": zone, "callback": name, "le": bound}, cumulative))
+            samples.append(("_sum", {"zone": zone, "callback": name}, histogram.total))
+            samples.append(("_count", {"zone": zone, "callback": name}, histogram.count))
+    metric("callback_duration_seconds", "histogram", "Duration of the bound callbacks.", samples)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer(object): # pylint: disable=R0205
+    """
+    Serve the metrics of many listeners in the Prometheus text format on a local http endpoint.
+    """
+    def __init__(self, listeners, address="127.0.0.1", port=9405, path="/metrics"):
+        """
+        :param listeners: dictionary mapping a zone name to an AirplayListener or a single AirplayListener
+        :param address: address to bind the http server to
+        :param port: port to bind the http server to (0 to use a free port)
+        :param path: url path of the metrics
+        """
+        super(MetricsServer, self).__init__()
+        if ThreadingHTTPServer is None:
+            raise RuntimeError("The metrics server requires python 3.7 or newer.")
+
+        self.listeners = listeners if isinstance(listeners, dict) else {"default": listeners}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Answer GET requests for the metrics path.
+            """
+            def do_GET(self): # pylint: disable=C0103
+                """
+                Send the metrics of all listeners in the Prometheus text format.
+                """
+                if self.path.split("?")[0] != path:
+                    self.send_error(404)
+                    return
+                body = prometheus_text(server.listeners).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args): # pylint: disable=W0221
+                pass
+
+        self._httpd = ThreadingHTTPServer((address, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        :return: address and port the server is bound to
+        """
+        return self._httpd.server_address[:2]
+
+    def start(self):
+        """
+        Serve the metrics in a background thread.
+        """
+        self._thread = Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the server.
+        """
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,165 @@
+"""
+Sampled timing of the stages every item passes through while it is received and processed:
+
+- read: reading raw data from the pipe or socket (blocking reads include the time spent waiting for data)
+- framing: finding the item boundaries in the pipe stream or reassembling udp chunks
+- item: creating the Item
+- decode: decoding the payload to bytes (base64 in pipe items)
+- process: converting the data and updating the state of the listener in the item handlers (without the time
+  spent in callbacks)
+- dispatch: executing the callbacks bound to the changed properties
+
+Example:
+    profiler = StageProfiler(sample_rate=0.05)
+    listener = AirplayPipeListener(profiler=profiler)
+    ...
+    profiler.enable()     # can be enabled and disabled at any time
+    print(profiler.format_report())
+"""
+from random import random
+from threading import Lock, local
+
+from .util import perf_counter_ns
+
+STAGES = ("read", "framing", "item", "decode", "process", "dispatch")
+
+# code used for stages which are measured before the code of the item is known
+ANY_CODE = "*"
+
+
+class StageProfiler(object): # pylint: disable=R0205
+    """
+    Collect sampled durations per stage and code. While the profiler is disabled each hook only checks a flag.
+    """
+    def __init__(self, sample_rate=0.01, enabled=False):
+        """
+        :param sample_rate: fraction of the reads, items and callbacks which are measured (1.0 measures everything)
+        :param enabled: start measuring immediately
+        """
+        super(StageProfiler, self).__init__()
+        self.sample_rate = sample_rate
+        self.enabled = enabled
+        self._lock = Lock()
+        self._stats = {}        # (stage, code) => [count, total ns, max ns]
+        # per thread: in_sample is True while a sampled item is processed => measure the callbacks,
+        # dispatch_ns is the time spent in callbacks during the sampled item
+        self._local = local()
+
+    def enable(self, sample_rate=None):
+        """
+        Start measuring.
+        :param sample_rate: new fraction of measured events or None to keep the current one
+        """
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop measuring. The collected durations are kept.
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Discard all collected durations.
+        """
+        with self._lock:
+            self._stats = {}
+
+    def sample(self):
+        """
+        :return: True if the current event should be measured
+        """
+        return self.enabled and (self.sample_rate >= 1.0 or random() < self.sample_rate)
+
+    def record(self, stage, code, duration_ns):
+        """
+        Add a measured duration.
+        :param stage: one of STAGES
+        :param code: code of the item or ANY_CODE
+        :param duration_ns: duration in nanoseconds
+        """
+        key = (stage, code)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                self._stats[key] = [1, duration_ns, duration_ns]
+            else:
+                stats[0] += 1
+                stats[1] += duration_ns
+                if duration_ns > stats[2]:
+                    stats[2] = duration_ns
+
+    # ------------------------------------------------ listener hooks --------------------------------------------------
+
+    def process_item(self, item, handle):
+        """
+        Measure the decode, process and dispatch stages of a sampled item.
+        :param item: metadata item
+        :param handle: function which processes the item
+        """
+        start = perf_counter_ns()
+        # only the bytes are cached by the item => the type conversion is measured as part of the handler
+        item.data_bytes # pylint: disable=W0104
+        decoded = perf_counter_ns()
+
+        state = self._local
+        state.in_sample, state.dispatch_ns = True, 0
+        try:
+            handle(item)
+        finally:
+            state.in_sample = False
+        end = perf_counter_ns()
+
+        self.record("decode", item.code, decoded - start)
+        self.record("process", item.code, end - decoded - state.dispatch_ns)
+
+    def wrap(self, name, callback):
+        """
+        :param name: name of the property the callback is bound to
+        :param callback: bound callback
+        :return: function which measures the callback while a sampled item is processed
+        """
+        def profiled_callback(*args):
+            state = self._local
+            if not getattr(state, "in_sample", False):
+                return callback(*args)
+            start = perf_counter_ns()
+            try:
+                return callback(*args)
+            finally:
+                duration = perf_counter_ns() - start
+                state.dispatch_ns += duration
+                self.record("dispatch", name, duration)
+        return profiled_callback
+
+    # --------------------------------------------------- reporting ----------------------------------------------------
+
+    def report(self):
+        """
+        :return: dictionary mapping each stage to a dictionary mapping each code to its count, total, mean and maximum
+        duration in microseconds. Dispatch durations are reported per property instead of per code.
+        """
+        with self._lock:
+            stats = {key: list(value) for key, value in self._stats.items()}
+
+        report = {}
+        for (stage, code), (count, total, maximum) in stats.items():
+            report.setdefault(stage, {})[code] = {"count": count, "total_us": total / 1000.0,
+                                                  "mean_us": total / 1000.0 / count, "max_us": maximum / 1000.0}
+        return report
+
+    def format_report(self):
+        """
+        :return: report as text table sorted by the stage and the total duration
+        """
+        report = self.report()
+        lines = ["{0:<10} {1:<16} {2:>8} {3:>12} {4:>10} {5:>10}".format("stage", "code", "samples", "total us",
+                                                                         "mean us", "max us")]
+        for stage in STAGES:
+            codes = report.get(stage, {})
+            for code, stats in sorted(codes.items(), key=lambda entry: -entry[1]["total_us"]):
+                lines.append("{0:<10} {1:<16} {2:>8} {3:>12.1f} {4:>10.1f} {5:>10.1f}".format(
+                    stage, code, stats["count"], stats["total_us"], stats["mean_us"], stats["max_us"]))
+        return "\n".join(lines)
@@ -0,0 +1,125 @@
+"""
+Interpolation of the playback position between the sparse progress messages of shairport-sync.
+
+shairport-sync only sends the RTP timestamps (start, current, end) of the track when the playback starts, resumes or
+jumps. The PlaybackProgress stores these anchors together with the monotonic time they were received and calculates
+the position at any later point in time without further messages.
+
+Example:
+    progress = PlaybackProgress(sample_rate=44100)
+    progress.update(start, current, end)  # prgr received
+    ...
+    position = progress.position_at()     # seconds since the start of the track
+"""
+from time import monotonic
+from threading import Lock
+
+# RTP timestamps are unsigned 32 bit integers which wrap around
+RTP_MODULO = 1 << 32
+
+
+def rtp_difference(first, second):
+    """
+    :param first: RTP timestamp
+    :param second: later RTP timestamp
+    :return: number of frames from first to second. The result is negative if second is before first.
+    """
+    difference = (second - first) % RTP_MODULO
+    return difference - RTP_MODULO if difference >= RTP_MODULO // 2 else difference
+
+
+class PlaybackProgress(object): # pylint: disable=R0205
+    """
+    Playback position of the current track based on the last RTP anchors and a monotonic clock.
+    """
+    def __init__(self, sample_rate=44100, clock=monotonic):
+        """
+        :param sample_rate: sample rate used by shairport-sync
+        :param clock: function returning the current time in seconds, must be monotonic
+        """
+        super(PlaybackProgress, self).__init__()
+        self.sample_rate = sample_rate
+        self._clock = clock
+        self._lock = Lock()
+        self._position = None   # position in seconds at the anchor time
+        self._duration = None   # duration of the track in seconds
+        self._anchor_time = 0.0
+        self._playing = False
+
+    def update(self, start, current, end, playing=True, now=None):
+        """
+        Store new RTP anchors received with a progress message.
+        :param start: RTP timestamp of the first frame of the track
+        :param current: RTP timestamp of the frame which is currently played
+        :param end: RTP timestamp of the frame after the last frame of the track
+        :param playing: True if the position advances from now on
+        :param now: time the message was received (the current time if None)
+        :return: tuple of (position, duration) in seconds at the time of the message
+        """
+        # the current frame might be slightly before the start => limit the values to positive numbers
+        duration = max(0, rtp_difference(start, end)) / self.sample_rate
+        position = min(max(0, rtp_difference(start, current)) / self.sample_rate, duration)
+        with self._lock:
+            self._position = position
+            self._duration = duration
+            self._anchor_time = self._clock() if now is None else now
+            self._playing = playing
+        return position, duration
+
+    def pause(self, now=None):
+        """
+        Freeze the position.
+        :param now: time of the pause (the current time if None)
+        """
+        now = self._clock() if now is None else now
+        with self._lock:
+            if self._playing and self._position is not None:
+                self._position = self._advanced(now)
+                self._anchor_time = now
+            self._playing = False
+
+    def resume(self, now=None):
+        """
+        Continue advancing the position.
+        :param now: time of the resume (the current time if None)
+        """
+        with self._lock:
+            if not self._playing:
+                self._anchor_time = self._clock() if now is None else now
+                self._playing = True
+
+    def reset(self):
+        """
+        Forget the current track e.g. when the playback stopped.
+        """
+        with self._lock:
+            self._position = self._duration = None
+            self._playing = False
+
+    def _advanced(self, now):
+        return min(self._duration, self._position + max(0.0, now - self._anchor_time))
+
+    def position_at(self, now=None):
+        """
+        :param now: time as returned by the clock (the current time if None)
+        :return: playback position in seconds or None if no progress was received yet
+        """
+        now = self._clock() if now is None else now
+        with self._lock:
+            if self._position is None:
+                return None
+            return self._advanced(now) if self._playing else self._position
+
+    @property
+    def duration(self):
+        """
+        :return: duration of the track in seconds or None if no progress was received yet
+        """
+        return self._duration
+
+    @property
+    def playing(self):
+        """
+        :return: True if the position is currently advancing
+        """
+        return self._playing
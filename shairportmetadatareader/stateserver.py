@@ -0,0 +1,382 @@
+"""
+Local asyncio server which shares the state of a single listener with many clients e.g. touch panels, instead of
+letting each client run its own listener or poll.
+
+    GET /state    current state snapshot as json (see `AirplayListener.state_snapshot`), supports If-None-Match
+    GET /artwork  image data of the current artwork, the ETag is the content hash of the image
+    GET /events   server sent events: a `state` event with the full snapshot followed by `delta` events
+    GET /ws       websocket: {"type": "state", "state": {...}} followed by {"type": "delta", "changes": {...}}
+
+Every update is serialized once and the encoded bytes are shared by all connected clients. A client which does not
+read its updates fast enough is disconnected, it receives the full state again when it reconnects.
+
+Example:
+    listener = AsyncAirplayUDPListener()
+    server = StateServer(listener, port=8080)
+    await server.start()
+    await listener.start()
+"""
+import struct
+import asyncio
+from hashlib import sha1
+from base64 import b64encode
+from threading import Lock
+
+from .listener.airplaylistener import STATE_PROPERTIES, logger
+from .util import encode_json, image_extension
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_TEXT, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x8, 0x9, 0xA
+
+# maximum size of a frame send by a websocket client, the clients are only expected to send control frames
+MAX_CLIENT_FRAME = 64 * 1024
+
+CONTENT_TYPES = {".jpg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".bmp": "image/bmp",
+                 ".tiff": "image/tiff", ".webp": "image/webp"}
+
+SSE_HEARTBEAT = b": heartbeat\n\n"
+
+
+def http_response(status, headers=(), body=b""):
+    """
+    :param status: status code and reason e.g. "200 OK"
+    :param headers: list of (name, value) tuples
+    :param body: body as binary
+    :return: encoded response
+    """
+    lines = ["HTTP/1.1 {0}".format(status)] + ["{0}: {1}".format(name, value) for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def websocket_accept(key):
+    """
+    :param key: Sec-WebSocket-Key send by the client
+    :return: Sec-WebSocket-Accept value of the handshake response
+    """
+    return b64encode(sha1(key.encode("latin-1") + WEBSOCKET_GUID).digest()).decode("ascii")
+
+
+def websocket_frame(payload, opcode=WS_TEXT):
+    """
+    :param payload: payload as binary
+    :param opcode: frame type
+    :return: unmasked websocket frame as send by a server
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_websocket_frame(reader):
+    """
+    Read a single frame send by a websocket client.
+    :param reader: asyncio StreamReader
+    :return: tuple of (opcode, unmasked payload)
+    """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack(">H", await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack(">Q", await reader.readexactly(8))
+    if length > MAX_CLIENT_FRAME:
+        raise ValueError("Websocket frame too large: {0} bytes".format(length))
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return first & 0x0F, payload
+
+
+async def read_request(reader):
+    """
+    Read the request line and the headers of a http request.
+    :param reader: asyncio StreamReader
+    :return: tuple of (method, path, headers) with lower case header names or None if the connection was closed
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, target = request_line.decode("latin-1").split()[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return method, target.split("?")[0], headers
+
+
+class _Subscriber(object): # pylint: disable=R0205, R0903
+    """
+    Push channel of a connected SSE or websocket client.
+    """
+    def __init__(self, kind, max_queue_size):
+        self.kind = kind  # "sse" or "ws"
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+
+    def send(self, messages):
+        """
+        Queue the encoded update for this client.
+        :param messages: dictionary mapping the client kind to the encoded update
+        :return: False if the client is too slow and was disconnected
+        """
+        try:
+            self.queue.put_nowait(messages[self.kind])
+            return True
+        except asyncio.QueueFull:
+            self.close()
+            return False
+
+    def close(self):
+        """
+        Discard the queued updates and let the writer close the connection.
+        """
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class StateServer(object): # pylint: disable=R0205, R0902
+    """
+    Serve the state and artwork of a listener over http and push each change to all SSE and websocket clients.
+    """
+    # pylint: disable=R0913
+    def __init__(self, listener, address="127.0.0.1", port=8080, heartbeat=15.0, max_queue_size=64):
+        """
+        :param listener: AirplayListener whose state is served
+        :param address: address to bind the server to
+        :param port: port to bind the server to (0 to use a free port)
+        :param heartbeat: seconds without update after which a heartbeat is send to detect disconnected push clients
+        :param max_queue_size: maximum number of updates queued for a push client before it is disconnected
+        """
+        super(StateServer, self).__init__()
+        self.listener = listener
+        self.heartbeat = heartbeat
+        self.dropped_clients = 0  # number of push clients which were disconnected because they were too slow
+        self._address = address
+        self._port = port
+        self._max_queue_size = max_queue_size
+        self._loop = None
+        self._server = None
+        self._subscribers = set()
+        self._connections = set()
+
+        # property changes of the listener thread are published together once the event loop runs the flush
+        self._lock = Lock()
+        self._flush_scheduled = False
+        self._callbacks = {name: self._on_change for name in STATE_PROPERTIES}
+
+        # encoded representations of the current state, updated once per change
+        self._state = {}
+        self._etag = None
+        self._state_messages = {}
+
+    @property
+    def address(self):
+        """
+        :return: address and port the server is bound to
+        """
+        return self._server.sockets[0].getsockname()[:2]
+
+    @property
+    def client_count(self):
+        """
+        :return: number of connected SSE and websocket clients
+        """
+        return len(self._subscribers)
+
+    async def start(self):
+        """
+        Start serving on the running event loop.
+        """
+        self._loop = asyncio.get_event_loop()
+        self._update_state(self.listener.state_snapshot())
+        self.listener.bind(**self._callbacks)
+        self._server = await asyncio.start_server(self._handle_connection, self._address, self._port)
+        logger.info("Serve the listener state on http://%s:%s/state: ...", *self.address)
+
+    async def stop(self):
+        """
+        Disconnect all clients and stop the server.
+        """
+        self.listener.unbind(**self._callbacks)
+        self._server.close()
+        for subscriber in list(self._subscribers):
+            subscriber.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+
+    # ------------------------------------------------- state updates --------------------------------------------------
+
+    def _on_change(self, *args): # pylint: disable=W0613
+        """
+        Called from the listener thread. All changes until the event loop runs the flush are published together.
+        """
+        with self._lock:
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._loop.call_soon_threadsafe(self._flush)
+
+    def _update_state(self, snapshot):
+        """
+        Encode the new state.
+        :return: True if the state changed
+        """
+        body = encode_json(snapshot)
+        etag = '"{0}"'.format(sha1(body).hexdigest()[:20])
+        if etag == self._etag:
+            return False
+        self._state, self._etag = snapshot, etag
+        self._state_messages = {"sse": b"event: state\ndata: " + body + b"\n\n",
+                                "ws": websocket_frame(b'{"type":"state","state":' + body + b"}"),
+                                "body": body}
+        return True
+
+    def _flush(self):
+        """
+        Publish the pending changes to all push clients. The delta is serialized once for all clients.
+        """
+        with self._lock:
+            self._flush_scheduled = False
+
+        previous = self._state
+        if not self._update_state(self.listener.state_snapshot()):
+            return
+        changes = {key: value for key, value in self._state.items() if previous.get(key) != value}
+        if not changes:
+            return
+
+        delta = encode_json(changes)
+        messages = {"sse": b"event: delta\ndata: " + delta + b"\n\n",
+                    "ws": websocket_frame(b'{"type":"delta","changes":' + delta + b"}")}
+        for subscriber in list(self._subscribers):
+            if not subscriber.send(messages):
+                self.dropped_clients += 1
+
+    # ------------------------------------------------ request handling ------------------------------------------------
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Answer the requests of a connection until it is closed or upgraded to a push channel.
+        """
+        self._connections.add(writer)
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers = request
+                if method != "GET":
+                    writer.write(http_response("405 Method Not Allowed", [("Content-Length", "0")]))
+                elif path == "/state":
+                    self._send_state(writer, headers)
+                elif path == "/artwork":
+                    self._send_artwork(writer, headers)
+                elif path == "/events":
+                    await self._push_events(reader, writer)
+                    break
+                elif path == "/ws":
+                    await self._push_websocket(reader, writer, headers)
+                    break
+                else:
+                    writer.write(http_response("404 Not Found", [("Content-Length", "0")]))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _send_cached(writer, headers, etag, content_type, body):
+        """
+        Send the body or 304 Not Modified if the client already has the current version.
+        """
+        if headers.get("if-none-match") == etag:
+            writer.write(http_response("304 Not Modified", [("ETag", etag), ("Content-Length", "0")]))
+        else:
+            writer.write(http_response("200 OK", [("Content-Type", content_type), ("ETag", etag),
+                                                  ("Cache-Control", "no-cache"), ("Content-Length", len(body))], body))
+
+    def _send_state(self, writer, headers):
+        self._send_cached(writer, headers, self._etag, "application/json", self._state_messages["body"])
+
+    def _send_artwork(self, writer, headers):
+        key = self._state.get("artwork_key")
+        data = self.listener.artwork_store.get(key) if key else None
+        if not data:
+            writer.write(http_response("404 Not Found", [("Content-Length", "0")]))
+            return
+        content_type = CONTENT_TYPES.get(image_extension(data, default=None), "application/octet-stream")
+        self._send_cached(writer, headers, '"{0}"'.format(key), content_type, data)
+
+    async def _push(self, writer, subscriber, heartbeat):
+        """
+        Write the full state followed by the queued updates until the subscriber is closed.
+        """
+        self._subscribers.add(subscriber)
+        try:
+            writer.write(self._state_messages[subscriber.kind])
+            await writer.drain()
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    message = heartbeat
+                if message is None:
+                    break
+                writer.write(message)
+                await writer.drain()
+        finally:
+            self._subscribers.discard(subscriber)
+
+    async def _push_events(self, reader, writer): # pylint: disable=W0613
+        writer.write(http_response("200 OK", [("Content-Type", "text/event-stream"), ("Cache-Control", "no-cache"),
+                                              ("Connection", "keep-alive")]))
+        await self._push(writer, _Subscriber("sse", self._max_queue_size), SSE_HEARTBEAT)
+
+    async def _push_websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key")
+        if headers.get("upgrade", "").lower() != "websocket" or not key:
+            writer.write(http_response("400 Bad Request", [("Content-Length", "0")]))
+            return
+
+        writer.write(http_response("101 Switching Protocols", [("Upgrade", "websocket"), ("Connection", "Upgrade"),
+                                                               ("Sec-WebSocket-Accept", websocket_accept(key))]))
+        subscriber = _Subscriber("ws", self._max_queue_size)
+        receiver = asyncio.ensure_future(self._receive_websocket(reader, writer, subscriber))
+        try:
+            await self._push(writer, subscriber, websocket_frame(b"", WS_PING))
+            if not receiver.done():
+                # closed by the server e.g. because the client was too slow => 1001 going away
+                writer.write(websocket_frame(struct.pack(">H", 1001), WS_CLOSE))
+        finally:
+            receiver.cancel()
+
+    @staticmethod
+    async def _receive_websocket(reader, writer, subscriber):
+        """
+        Answer the control frames of a websocket client and close the push channel if the client disconnects.
+        """
+        try:
+            while True:
+                opcode, payload = await read_websocket_frame(reader)
+                if opcode == WS_PING:
+                    writer.write(websocket_frame(payload, WS_PONG))
+                elif opcode == WS_CLOSE:
+                    writer.write(websocket_frame(payload[:2], WS_CLOSE))
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        subscriber.close()
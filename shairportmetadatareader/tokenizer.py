@@ -0,0 +1,203 @@
+"""
+Incremental byte tokenizer for the xml stream written to the shairport-sync metadata pipe.
+
+The pipe contains a sequence of items in the following format:
+<item><type>73736e63</type><code>70637374</code><length>10</length>
+<data encoding="base64">
+MjkzNDE5NDIzMg==</data></item>
+
+Instead of building an ElementTree for every item, the tokenizer scans the raw bytes for the item boundaries and
+extracts the type, code, length and data fields directly.
+"""
+from .item import Item, logger
+from .util import to_unicode, perf_counter_ns
+
+ITEM_START = b"<item>"
+ITEM_END = b"</item>"
+
+# (opening tag, closing tag) of the fields inside an item
+TYPE_TAGS = (b"<type>", b"</type>")
+CODE_TAGS = (b"<code>", b"</code>")
+LENGTH_TAGS = (b"<length>", b"</length>")
+DATA_TAGS = (b"<data", b"</data>")
+ENCODING_ATTRIBUTE = b'encoding="'
+
+# byte values of whitespace characters
+WHITESPACE = frozenset(bytearray(b" \t\r\n"))
+
+
+def _find_field(buf, tags, start, end):
+    """
+    Find the content of a field inside buf[start:end].
+    :param buf: bytes like object to search in
+    :param tags: tuple of (opening tag, closing tag)
+    :param start: start index of the item
+    :param end: end index of the item
+    :return: (content start, content end) or None if the field does not exist
+    """
+    open_tag, close_tag = tags
+    pos = buf.find(open_tag, start, end)
+    if pos < 0:
+        return None
+    pos += len(open_tag)
+    stop = buf.find(close_tag, pos, end)
+    if stop < 0:
+        return None
+    return pos, stop
+
+
+def parse_item_fields(buf, start, end): # pylint: disable=R0914
+    """
+    Extract the fields of a single item stored in buf[start:end] without creating an xml tree.
+    :param buf: bytes like object containing the item
+    :param start: index after the <item> tag
+    :param end: index of the </item> tag
+    :return: tuple of (type_hex, code_hex, length, encoding, payload range) or None if the item is malformed
+    """
+    type_range = _find_field(buf, TYPE_TAGS, start, end)
+    code_range = _find_field(buf, CODE_TAGS, start, end)
+    length_range = _find_field(buf, LENGTH_TAGS, start, end)
+    if not (type_range and code_range and length_range):
+        return None
+
+    try:
+        length = int(bytes(buf[length_range[0]:length_range[1]]))
+    except ValueError:
+        return None
+
+    type_hex = bytes(buf[type_range[0]:type_range[1]]).strip()
+    code_hex = bytes(buf[code_range[0]:code_range[1]]).strip()
+
+    encoding, payload_range = None, None
+    data_range = _find_field(buf, DATA_TAGS, code_range[1], end)
+    if data_range:
+        tag_end = buf.find(b">", data_range[0], data_range[1])
+        if tag_end < 0:
+            return None
+        attr = buf.find(ENCODING_ATTRIBUTE, data_range[0], tag_end)
+        if attr >= 0:
+            attr += len(ENCODING_ATTRIBUTE)
+            encoding = to_unicode(bytes(buf[attr:buf.find(b'"', attr, tag_end)]))
+        # strip the whitespace around the payload without copying it
+        payload_start, payload_end = tag_end + 1, data_range[1]
+        while payload_start < payload_end and buf[payload_start] in WHITESPACE:
+            payload_start += 1
+        while payload_end > payload_start and buf[payload_end - 1] in WHITESPACE:
+            payload_end -= 1
+        payload_range = (payload_start, payload_end)
+
+    return type_hex, code_hex, length, encoding, payload_range
+
+
+# pylint: disable=R0913
+def item_from_fields(buf, type_hex, code_hex, length, encoding, payload_range):
+    """
+    Create an item from the fields returned by `parse_item_fields`.
+    :param buf: bytes like object containing the item
+    :return: item on success or None
+    """
+    if payload_range is None:
+        return Item.from_pipe_fields(type_hex, code_hex, length)
+    if encoding != "base64":
+        logger.warning("Unknown encoding format: %s", encoding)
+        return None
+    # copy the payload exactly once, the item decodes it when it is accessed
+    with memoryview(buf) as view:
+        payload = view[payload_range[0]:payload_range[1]].tobytes()
+    return Item.from_pipe_fields(type_hex, code_hex, length, payload)
+
+
+class ItemTokenizer(object): # pylint: disable=R0205
+    """
+    Split a byte stream into items. Data can be fed in chunks of arbitrary size, incomplete items are kept in an
+    internal buffer until the rest of the item is received.
+    """
+    def __init__(self):
+        super(ItemTokenizer, self).__init__()
+        self._buffer = bytearray()
+        self._scan_pos = 0  # position up to which the buffer was already searched for a closing tag
+        self.failures = 0   # number of malformed items which were skipped
+        self.profiler = None  # StageProfiler which measures the framing and item stages
+
+    def feed(self, data):
+        """
+        Add data to the internal buffer and return all items that are complete.
+        :param data: bytes like object read from the pipe
+        :return: list of items
+        """
+        self._buffer += data
+        return self._tokenize()
+
+    def reset(self):
+        """
+        Discard all buffered data, e.g. if the pipe was reopened.
+        """
+        del self._buffer[:]
+        self._scan_pos = 0
+
+    def _tokenize(self):
+        """
+        Extract all complete items from the buffer.
+        :return: list of items
+        """
+        buf = self._buffer
+        items = []
+        consumed = 0
+        profiler = self.profiler
+
+        while True:
+            start = buf.find(ITEM_START, consumed)
+            if start < 0:
+                # no item start found => drop everything except a possibly incomplete start tag
+                consumed = max(consumed, len(buf) - len(ITEM_START) + 1)
+                self._scan_pos = consumed
+                break
+
+            # only search the part of the buffer which was not searched before
+            body = start + len(ITEM_START)
+            scan_from = max(body, self._scan_pos)
+            end = buf.find(ITEM_END, scan_from)
+            next_start = buf.find(ITEM_START, scan_from, end if end >= 0 else len(buf))
+
+            if next_start >= 0:
+                # the closing tag is missing => try to parse the data which was received until the next item starts
+                item_end = consumed = next_start
+            elif end >= 0:
+                item_end, consumed = end, end + len(ITEM_END)
+            else:
+                # incomplete item => remember where to continue searching for the closing tag
+                consumed = start
+                self._scan_pos = max(body, len(buf) - len(ITEM_END) + 1)
+                break
+
+            self._scan_pos = consumed
+            if profiler is not None and profiler.sample():
+                item = self._profiled_item(profiler, buf, body, item_end)
+            else:
+                fields = parse_item_fields(buf, body, item_end)
+                item = item_from_fields(buf, *fields) if fields else None
+            if item:
+                items.append(item)
+            else:
+                self.failures += 1
+
+        if consumed > 0:
+            del buf[:consumed]
+            self._scan_pos = max(0, self._scan_pos - consumed)
+        return items
+
+    @staticmethod
+    def _profiled_item(profiler, buf, start, end):
+        """
+        Parse an item and measure the framing and item stages.
+        """
+        begin = perf_counter_ns()
+        fields = parse_item_fields(buf, start, end)
+        parsed = perf_counter_ns()
+        item = item_from_fields(buf, *fields) if fields else None
+        created = perf_counter_ns()
+
+        code = item.code if item else "*"
+        profiler.record("framing", code, parsed - begin)
+        profiler.record("item", code, created - parsed)
+        return item
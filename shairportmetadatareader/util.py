@@ -2,7 +2,10 @@
 Common util functions used by all classes.
 """
 import sys
+import json
 import tempfile
+from datetime import date
+from binascii import hexlify
 from collections import defaultdict
 
 IS_PY2 = sys.version_info.major <= 2
@@ -12,6 +15,18 @@ if IS_PY2:
 else:
     from base64 import decodebytes, encodebytes # pylint: disable=W0611
 
+# perf_counter_ns is only available in python >= 3.7
+try:
+    from time import perf_counter_ns # pylint: disable=W0611
+except ImportError:
+    from time import perf_counter
+
+    def perf_counter_ns():
+        """
+        :return: value of perf_counter in nanoseconds
+        """
+        return int(perf_counter() * 1e9)
+
 
 def to_unicode(string_or_bytes):
     """
@@ -20,7 +35,8 @@ def to_unicode(string_or_bytes):
     """
     if IS_PY2:
         return string_or_bytes.decode("utf-8") if isinstance(string_or_bytes, str) else string_or_bytes
-    return string_or_bytes if isinstance(string_or_bytes, str) else string_or_bytes.decode("utf-8")
+    # str() accepts every bytes like object including bytearray and memoryview
+    return string_or_bytes if isinstance(string_or_bytes, str) else str(string_or_bytes, "utf-8")
 
 
 def to_binary(string_or_unicode):
@@ -52,8 +68,8 @@ def hex_bytes_to_int(hex_bytes):
     :return: integer representation of hex_bytes
     """
     if IS_PY2:
-        return int(''.join([str(ord(x)) for x in hex_bytes]), 16)
-    return int(hex_bytes.hex(), 16)
+        return int(hexlify(hex_bytes) or b"0", 16)
+    return int.from_bytes(hex_bytes, "big")
 
 
 def binary_ip_to_string(ip_address):
@@ -80,13 +96,13 @@ def ascii_integers_to_string(string, base=16, digits_per_char=2):
 def encoded_to_str(data, encoding, as_bytes=True):
     """
     Encode bytes to a base64 string or bytes object. Further encoding might be added in the future.
-    :param data: data as bytes
+    :param data: encoded data as str or bytes
     :param encoding: encoding as str (currently only: base64)
     :param as_bytes: True to return bytes, False to return a str
     :return:
     """
     if encoding == "base64":
-        bytes_decoded = decodebytes(data.encode('ascii')) # pylint: disable=W1505
+        bytes_decoded = decodebytes(to_binary(data)) # pylint: disable=W1505
         return bytes_decoded if as_bytes else to_unicode(bytes_decoded)
     raise AttributeError("Unknown encoding format: {0}".format(encoding))
 
@@ -119,14 +135,56 @@ def xml_to_dict(ele):
     return d
 
 
-def write_data_to_image(data, extension=".png"):
+# magic bytes at the start of the supported image formats
+IMAGE_SIGNATURES = ((b"\xff\xd8\xff", ".jpg"), (b"\x89PNG\r\n\x1a\n", ".png"), (b"GIF87a", ".gif"),
+                    (b"GIF89a", ".gif"), (b"BM", ".bmp"), (b"II*\x00", ".tiff"), (b"MM\x00*", ".tiff"))
+
+
+def image_extension(data, default=".png"):
+    """
+    Detect the image type from the magic bytes at the start of the data.
+    :param data: image data as binary
+    :param default: extension to use if the image type is unknown
+    :return: file extension including the dot e.g. .jpg
+    """
+    header = bytes(data[:12])
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    return default
+
+
+def serializable_value(value):
+    """
+    Convert values which are not supported by json or msgpack e.g. the dates of the track information.
+    :param value: value of an unsupported type
+    :return: value as string
+    """
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return hexlify(value).decode("ascii")
+    return str(value)
+
+
+def encode_json(value):
+    """
+    :param value: json serializable value e.g. a state snapshot
+    :return: compact json representation with sorted keys as binary
+    """
+    return json.dumps(value, separators=(",", ":"), sort_keys=True, default=serializable_value).encode("utf-8")
+
+
+def write_data_to_image(data, extension=None):
     """
     Write image data encoded as binary or raw string to a file.
     :param data: image data as binary
-    :param extension: file extension to use
+    :param extension: file extension to use (detected from the data if None)
     :return path to temporary file
     """
-    temp_file = tempfile.NamedTemporaryFile(prefix="image_", suffix=extension, delete=False)
+    temp_file = tempfile.NamedTemporaryFile(prefix="image_", suffix=extension or image_extension(data), delete=False)
     with temp_file as file:
         file.write(data)
     return temp_file.name
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Test the asyncio based listeners.
+"""
+import os
+import socket
+import asyncio
+import tempfile
+from unittest import TestCase, main
+
+from shairportmetadatareader.listener.airplayasynclistener import AsyncAirplayUDPListener, AsyncAirplayPipeListener
+
+
+LOCALHOST = "127.0.0.1"
+
+# snua -- User Agent
+USER_AGENT_ITEM = b'<item><type>73736e63</type><code>736e7561</code><length>15</length><data encoding="base64">' \
+                  b'QWlyUGxheS8zNzEuNC43</data></item>\n'
+
+
+class TestAsyncAirplayListener(TestCase):
+    """
+    Class to test the asyncio listeners.
+    """
+
+    def test_udp_listener(self):
+        """
+        Send datagrams over the loopback interface and receive them as items.
+        """
+        async def run():
+            listener = AsyncAirplayUDPListener(socket_address=LOCALHOST, socket_port=0)
+            await listener.listen()
+            items = listener.items()
+            user_agent = asyncio.ensure_future(listener.wait_for("user_agent"))
+
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.sendto(b"ssncsnuaAirPlay/371.4.7", listener.bound_address)
+            sock.sendto(b"ssncpfls", listener.bound_address)
+            sock.close()
+
+            item = await asyncio.wait_for(items.__anext__(), 2)
+            self.assertEqual((item.code, item.data()), ("snua", "AirPlay/371.4.7"))
+            self.assertEqual(await asyncio.wait_for(user_agent, 2), "AirPlay/371.4.7")
+            item = await asyncio.wait_for(items.__anext__(), 2)
+            self.assertEqual(item.code, "pfls")
+            self.assertEqual(listener.playback_state, "pause")
+
+            listener.stop_listening()
+            with self.assertRaises(StopAsyncIteration):
+                await items.__anext__()
+
+        asyncio.run(run())
+
+    def test_udp_queue(self):
+        """
+        The async udp listener has no processing thread which could drain an item queue.
+        """
+        self.assertRaises(ValueError, AsyncAirplayUDPListener, socket_address=LOCALHOST, socket_port=0, queue_size=8)
+        self.assertRaises(ValueError, AsyncAirplayUDPListener, socket_address=LOCALHOST, socket_port=0,
+                          receive_buffers=8)
+
+    def test_stop_slow_consumer(self):
+        """
+        Stopping should finish an iterator whose queue is full and apply the socket options of the udp listener.
+        """
+        async def run():
+            listener = AsyncAirplayUDPListener(socket_address=LOCALHOST, socket_port=0, rcvbuf_size=1 << 16)
+            await listener.listen()
+            # the socket is created with the options of the udp listener
+            sock = listener._socket # pylint: disable=W0212
+            self.assertGreaterEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), 1 << 16)
+            if os.path.exists("/proc/net/udp"):
+                self.assertEqual(listener.drop_counts["kernel"], 0)
+
+            items = listener.items(max_queue_size=1)
+            first = asyncio.ensure_future(items.__anext__())
+            await asyncio.sleep(0)  # start the iterator
+            listener._process_datagram(b"ssncpfls") # pylint: disable=W0212
+            self.assertEqual((await first).code, "pfls")
+            listener._process_datagram(b"ssncprsm") # pylint: disable=W0212
+
+            # the queue of the iterator is full
+            listener.stop_listening()
+            with self.assertRaises(StopAsyncIteration):
+                await asyncio.wait_for(items.__anext__(), 2)
+
+        asyncio.run(run())
+
+    def test_pipe_listener(self):
+        """
+        Write items to a fifo and receive them as items.
+        """
+        pipe_name = os.path.join(tempfile.mkdtemp(), "shairport-sync-metadata")
+        os.mkfifo(pipe_name)
+
+        async def run():
+            listener = AsyncAirplayPipeListener(pipe_name=pipe_name)
+            await listener.listen()
+            items = listener.items()
+
+            with open(pipe_name, "wb") as pipe:
+                pipe.write(USER_AGENT_ITEM)
+
+            item = await asyncio.wait_for(items.__anext__(), 2)
+            self.assertEqual((item.code, item.data()), ("snua", "AirPlay/371.4.7"))
+            self.assertEqual(listener.user_agent, "AirPlay/371.4.7")
+            listener.stop_listening()
+
+        try:
+            asyncio.run(run())
+        finally:
+            os.remove(pipe_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,16 @@
 Test the basic AirplayListener functionality.
 """
 import socket
+from time import sleep
+from threading import current_thread
 from unittest import TestCase, main
 from zeroconf import ServiceInfo, Zeroconf
 
-from shairportmetadatareader.listener.airplaylistener import AirplayListener
+from shairportmetadatareader.listener.airplaylistener import AirplayListener, item_handler
 from shairportmetadatareader.item import Item
-from shairportmetadatareader.codetable import CORE_CODE_DICT
+from shairportmetadatareader.dispatcher import CallbackDispatcher
+from shairportmetadatareader.artwork import ArtworkStore
+from shairportmetadatareader.codetable import CORE_CODE_DICT, SSNC
 from shairportmetadatareader.remote.airplayservicelistener import AIRPLAY_PREFIX
 
 
@@ -77,6 +81,152 @@ class TestAirplayListener(TestCase):
         # is working correctly
         self.assertTrue(binding_was_called[0])
 
+    def test_item_handler(self):
+        """
+        Check that subclasses can register handlers for additional codes.
+        """
+        class ClientIPListener(AirplayListener):
+            """
+            Listener which remembers the client ip address.
+            """
+            client_ip = None
+
+            @item_handler(SSNC, "clip")
+            def _on_client_ip(self, item):
+                self.client_ip = item.data()
+
+        listener = ClientIPListener()
+        listener._process_item(Item(SSNC, "clip", 11, "MTkyLjE2OC4xLjI=", encoding="base64")) # pylint: disable=W0212
+        self.assertEqual(listener.client_ip, "192.168.1.2")
+
+        # existing handlers are still used
+        listener._process_item(Item(SSNC, "pfls")) # pylint: disable=W0212
+        self.assertEqual(listener.playback_state, "pause")
+
+        # handlers can be registered at runtime
+        received = []
+        listener.register_item_handler(SSNC, "svip", received.append)
+        item = Item(SSNC, "svip", 11, "MTkyLjE2OC4xLjM=", encoding="base64")
+        listener._process_item(item) # pylint: disable=W0212
+        self.assertEqual(received, [item])
+
+    def test_coalesce_state(self):
+        """
+        Check that rapid volume changes are published as a single change in coalescing mode.
+        """
+        volume_changes = []
+        state_changes = []
+
+        listener = AirplayListener(coalesce_interval=60)
+        listener.bind(volume=lambda _, volume: volume_changes.append(volume))
+        listener.bind(state_changes=lambda _, changes: state_changes.append(changes))
+
+        # pvol -- -20.0,-20.0,-30.0,0.0 / -15.0,-15.0,-30.0,0.0
+        for data in ("LTIwLjAsLTIwLjAsLTMwLjAsMC4w", "LTE1LjAsLTE1LjAsLTMwLjAsMC4w"):
+            listener._process_item(Item(SSNC, "pvol", 21, data, encoding="base64")) # pylint: disable=W0212
+        self.assertEqual(volume_changes, [])
+
+        listener.flush_state()
+        self.assertEqual(volume_changes, [0.5])
+        self.assertEqual(len(state_changes), 1)
+        self.assertEqual(state_changes[0]["volume"], 0.5)
+        self.assertFalse(state_changes[0]["mute"])
+
+    def test_track_info_delta(self):
+        """
+        Check that only changed track information is published together with its delta.
+        """
+        listener = AirplayListener()
+        track_infos = []
+        deltas = []
+        listener.bind(track_info=lambda _, info: track_infos.append(dict(info)))
+        listener.bind(track_info_delta=lambda _, delta: deltas.append(dict(delta)))
+
+        def send_track(**fields):
+            # pylint: disable=W0212
+            for code, data in fields.items():
+                listener._process_item(Item("core", code, text=data, length=len(data), encoding="bytes"))
+            listener._process_item(Item(SSNC, "mden", text=b"", length=0, encoding="bytes"))
+
+        send_track(minm=b"Track", asar=b"Artist")
+        send_track(minm=b"Track", asar=b"Artist")
+        send_track(minm=b"Other Track", asal=b"Album")
+
+        self.assertEqual(track_infos, [{"itemname": "Track", "songartist": "Artist"},
+                                       {"itemname": "Other Track", "songalbum": "Album"}])
+        self.assertEqual(deltas[-1], {"added": {"songalbum": "Album"}, "changed": {"itemname": "Other Track"},
+                                      "removed": ["songartist"]})
+        self.assertEqual(len(deltas), 2)
+
+    def test_state_snapshot(self):
+        """
+        The snapshot should contain the normalized state and the content hash of the artwork.
+        """
+        listener = AirplayListener(artwork_store=ArtworkStore(directory=None))
+        # pylint: disable=W0212
+        listener._process_item(Item(SSNC, "pvol", text=b"-15.00,-30.00,-96.30,0.00", length=25, encoding="bytes"))
+        listener._process_item(Item(SSNC, "PICT", text=b"\x89PNG", length=4, encoding="bytes"))
+        listener._process_item(Item(SSNC, "pcen", text=b"", length=0, encoding="bytes"))
+
+        snapshot = listener.state_snapshot()
+        self.assertEqual(snapshot["airplay_volume"], 0.5)
+        self.assertEqual(snapshot["artwork_key"], ArtworkStore.key_for(b"\x89PNG"))
+        self.assertEqual((snapshot["playback_state"], snapshot["track_info"]), ("stop", {}))
+        self.assertNotIn("artwork", snapshot)
+
+    def test_playback_position(self):
+        """
+        The playback position should be interpolated between the progress messages while the track is playing.
+        """
+        listener = AirplayListener(progress_interval=0.02)
+        positions = []
+        listener.bind(playback_position=lambda _, position: positions.append(position))
+
+        # pylint: disable=W0212
+        listener._process_item(Item(SSNC, "prsm", text=b"", length=0, encoding="bytes"))
+        listener._process_item(Item(SSNC, "prgr", text=b"0/441000/13230000", length=17, encoding="bytes"))
+        self.assertEqual(listener.playback_state, "play")
+        self.assertEqual(listener.playback_progress, [10.0, 300.0])
+        sleep(0.2)
+        self.assertGreater(len(positions), 3)
+        self.assertTrue(10.1 < listener.playback_position < 10.5)
+
+        listener._process_item(Item(SSNC, "pfls", text=b"", length=0, encoding="bytes"))
+        paused = listener.playback_position
+        sleep(0.1)
+        self.assertEqual((listener.playback_position, listener.progress.position_at()), (paused, paused))
+        listener.stop_listening()
+
+    def test_callback_dispatcher(self):
+        """
+        Check that bound callbacks are executed in order on a worker thread if a dispatcher is used.
+        """
+        dispatcher = CallbackDispatcher(max_workers=2)
+        listener = AirplayListener(callback_dispatcher=dispatcher)
+        volumes = []
+        threads = []
+
+        def on_volume(_, volume):
+            sleep(0.01)  # slow callbacks should not reorder the changes
+            volumes.append(volume)
+            threads.append(current_thread())
+
+        listener.bind(volume=on_volume)
+        # pvol -- -20.0,-20.0,-30.0,0.0 / -15.0,-15.0,-30.0,0.0 / -30.0,-30.0,-30.0,0.0
+        for data in ("LTIwLjAsLTIwLjAsLTMwLjAsMC4w", "LTE1LjAsLTE1LjAsLTMwLjAsMC4w", "LTMwLjAsLTMwLjAsLTMwLjAsMC4w"):
+            listener._process_item(Item(SSNC, "pvol", 21, data, encoding="base64")) # pylint: disable=W0212
+        dispatcher.shutdown()
+
+        self.assertEqual(volumes, [1/3, 0.5, 0.0])
+        self.assertNotIn(current_thread(), threads)
+        self.assertEqual(list(dispatcher.latencies()), ["volume:" + on_volume.__qualname__])
+        self.assertEqual(list(dispatcher.latencies().values())[0]["count"], 3)
+
+        # the wrapped callback is removed by unbind
+        listener.unbind(volume=on_volume)
+        listener.volume = 1.0
+        self.assertEqual(len(volumes), 3)
+
     def test_get_remote(self):
         """
         :return:
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Test routing the raw mqtt messages of shairport-sync. The tests are skipped if paho-mqtt is not installed.
+"""
+from unittest import TestCase, main, skipIf
+
+try:
+    from shairportmetadatareader.listener.airplaymqttlistener import AirplayMQTTListener, MQTTHub, TopicRouter, \
+        create_client, subscription_filter, zone_partition, MQTTv5
+except ImportError:
+    AirplayMQTTListener = None
+
+
+class FakeMessage(object): # pylint: disable=R0205, R0903
+    """
+    Stand-in for paho.mqtt.client.MQTTMessage.
+    """
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeClient(object): # pylint: disable=R0205, R0903
+    """
+    Stand-in for paho.mqtt.client.Client which records the subscriptions.
+    """
+    def __init__(self):
+        self.subscriptions = []
+
+    def subscribe(self, topic, qos=0):
+        """
+        Record a single subscription or a list of (topic, qos) tuples.
+        """
+        self.subscriptions += topic if isinstance(topic, list) else [(topic, qos)]
+
+
+@skipIf(AirplayMQTTListener is None, "paho-mqtt is not installed")
+class TestAirplayMQTTListener(TestCase):
+    """
+    Class to test the AirplayMQTTListener and the MQTTHub without a broker.
+    """
+
+    def test_router(self):
+        """
+        Topics should be mapped to the listener, type and code of their zone.
+        """
+        router = TopicRouter()
+        router.add("kitchen", "kitchen listener")
+        self.assertEqual(router.route("/kitchen/ssnc/pvol"), ("kitchen listener", "ssnc", "pvol"))
+        self.assertIs(router.route("/kitchen/ssnc/pvol"), router.route("/kitchen/ssnc/pvol"))
+        self.assertIsNone(router.route("/living-room/ssnc/pvol"))
+
+        router.remove("kitchen")
+        self.assertIsNone(router.route("/kitchen/ssnc/pvol"))
+
+        # nested zone topics
+        router.add("shairport", "shairport listener")
+        router.add("shairport/kitchen", "kitchen listener")
+        self.assertEqual(router.route("/shairport/kitchen/ssnc/pvol"), ("kitchen listener", "ssnc", "pvol"))
+        self.assertEqual(router.route("/shairport/ssnc/pvol"), ("shairport listener", "ssnc", "pvol"))
+        self.assertIsNone(router.route("/shairport/office/ssnc/pvol"))
+
+    def test_client_ids(self):
+        """
+        Each listener should use its own client id unless one is configured.
+        """
+        first, second = AirplayMQTTListener(topic="kitchen"), AirplayMQTTListener(topic="kitchen")
+        self.assertNotEqual(first.client_id, second.client_id)
+        self.assertEqual(AirplayMQTTListener(client_id="speaker").client_id, "speaker")
+        self.assertEqual(create_client("speaker")._client_id, b"speaker") # pylint: disable=W0212
+
+    def test_hub(self):
+        """
+        Messages of many zones should be routed to the listener of each zone.
+        """
+        hub = MQTTHub()
+        kitchen = hub.add_zone("kitchen")
+        living_room = hub.add_zone("living_room", topic="living-room-speaker")
+        with self.assertRaises(ValueError):
+            hub.add_zone("kitchen")
+
+        hub.receive_message(None, None, FakeMessage("/kitchen/ssnc/snua", b"AirPlay/371.4.7"))
+        hub.receive_message(None, None, FakeMessage("/living-room-speaker/ssnc/pfls", b""))
+        hub.receive_message(None, None, FakeMessage("/unknown/ssnc/pfls", b""))
+
+        self.assertEqual(kitchen.user_agent, "AirPlay/371.4.7")
+        self.assertEqual((kitchen.playback_state, living_room.playback_state), ("stop", "pause"))
+        self.assertEqual(sorted(hub.zones), ["kitchen", "living_room"])
+
+    def test_shared_subscriptions(self):
+        """
+        Shared subscriptions should use the $share prefix and MQTT v5.
+        """
+        self.assertEqual(subscription_filter("kitchen"), "/kitchen/#")
+        self.assertEqual(subscription_filter("kitchen", "workers"), "$share/workers//kitchen/#")
+        self.assertEqual(create_client("speaker", shared=True)._protocol, MQTTv5) # pylint: disable=W0212
+
+        client = FakeClient()
+        AirplayMQTTListener(topic="kitchen", qos=1, shared_group="workers")._on_connect(client) # pylint: disable=W0212
+        self.assertEqual(client.subscriptions, [("$share/workers//kitchen/#", 1)])
+
+    def test_partitions(self):
+        """
+        Each zone should be processed by exactly one partition.
+        """
+        with self.assertRaises(ValueError):
+            MQTTHub(partition=(2, 2))
+
+        names = ["zone{0}".format(i) for i in range(20)]
+        hubs = [MQTTHub(shared_group="workers", partition=(index, 2)) for index in range(2)]
+        for hub in hubs:
+            for name in names:
+                hub.add_zone(name)
+        owned = [hub.owned_zones for hub in hubs]
+        self.assertEqual(sorted(owned[0] + owned[1]), sorted(names))
+        self.assertTrue(owned[0] and owned[1])
+        self.assertEqual(owned[0], [name for name in names if zone_partition(name, 2) == 0])
+
+        client = FakeClient()
+        hubs[1]._on_connect(client) # pylint: disable=W0212
+        self.assertEqual(client.subscriptions, [("$share/workers-1//{0}/#".format(name), 0) for name in owned[1]])
+
+        # messages of zones owned by another partition are ignored
+        hubs[1].receive_message(None, None, FakeMessage("/{0}/ssnc/pfls".format(owned[0][0]), b""))
+        hubs[1].receive_message(None, None, FakeMessage("/{0}/ssnc/pfls".format(owned[1][0]), b""))
+        self.assertEqual(hubs[1].zone(owned[0][0]).playback_state, "stop")
+        self.assertEqual(hubs[1].zone(owned[1][0]).playback_state, "pause")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Test decoding the datagrams of the shairport-sync udp server.
+"""
+import socket
+import struct
+from time import sleep
+from threading import Thread, Event, current_thread
+from unittest import TestCase, main
+
+from shairportmetadatareader.itemqueue import BLOCK
+from shairportmetadatareader.listener.airplayudplistener import DatagramDecoder, ChunkReassembler, AirplayUDPListener
+
+LOCALHOST = "127.0.0.1"
+
+
+def make_chunks(item_type, code, data, chunk_size):
+    """
+    Split data into chunk datagrams like shairport-sync.
+    """
+    parts = [data[i:i+chunk_size] for i in range(0, len(data), chunk_size)]
+    return [b"ssncchnk" + struct.pack(">II", i, len(parts)) + item_type + code + part for i, part in enumerate(parts)]
+
+
+class TestDatagramDecoder(TestCase):
+    """
+    Class to test the DatagramDecoder and ChunkReassembler.
+    """
+
+    def test_interleaved_chunks(self):
+        """
+        Chunks received in any order and interleaved with other datagrams should be reassembled.
+        """
+        picture = bytes(bytearray(range(256))) * 10
+        chunks = make_chunks(b"ssnc", b"PICT", picture, 1000)
+        decoder = DatagramDecoder()
+
+        self.assertIsNone(decoder.decode(chunks[2]))
+        self.assertEqual(decoder.decode(b"ssncprgr1/2/3").code, "prgr")
+        self.assertIsNone(decoder.decode(chunks[0]))
+        item = decoder.decode(chunks[1])
+
+        self.assertEqual((item.code, item.length, item.data()), ("PICT", len(picture), picture))
+        self.assertEqual(decoder.reassembler.stats(), {"completed": 1, "dropped": 0, "malformed": 0, "pending": 0})
+
+    def test_lost_chunk(self):
+        """
+        A new transfer after a lost chunk should never be completed with the chunks of the previous transfer.
+        """
+        reassembler = ChunkReassembler()
+        first = make_chunks(b"ssnc", b"PICT", b"A" * 10, 4)
+        second = make_chunks(b"ssnc", b"PICT", b"B" * 10, 4)
+
+        self.assertIsNone(reassembler.add(first[0]))
+        self.assertIsNone(reassembler.add(first[1]))
+        # first[2] is lost
+        self.assertIsNone(reassembler.add(second[0]))
+        self.assertIsNone(reassembler.add(second[1]))
+        item = reassembler.add(second[2])
+
+        self.assertEqual(bytes(item.data_bytes), b"B" * 10)
+        self.assertEqual(reassembler.stats(), {"completed": 1, "dropped": 1, "malformed": 0, "pending": 0})
+
+    def test_eviction(self):
+        """
+        Incomplete messages should be dropped after the timeout.
+        """
+        now = [0]
+        reassembler = ChunkReassembler(timeout=5, max_pending=1, clock=lambda: now[0])
+        first = make_chunks(b"ssnc", b"PICT", b"x" * 30, 10)
+        second = make_chunks(b"ssnc", b"PICT", b"y" * 20, 10)
+
+        self.assertIsNone(reassembler.add(first[0]))
+        # a different message replaces the oldest one
+        self.assertIsNone(reassembler.add(second[0]))
+        self.assertEqual(reassembler.stats()["dropped"], 1)
+
+        now[0] = 10
+        self.assertIsNone(reassembler.add(first[1]))
+        self.assertEqual(reassembler.stats()["dropped"], 2)
+        self.assertEqual(reassembler.stats()["pending"], 1)
+
+        # chunks with a different size are malformed
+        self.assertIsNone(reassembler.add(first[2][:-1] + b"xx"))
+        self.assertEqual(reassembler.stats()["malformed"], 1)
+
+    def test_oversized_messages(self):
+        """
+        Chunk counts and message sizes above the limits should be dropped as malformed without allocating the message.
+        """
+        reassembler = ChunkReassembler(max_chunks=100, max_message_bytes=1000)
+        header = lambda index, count: b"ssncchnk" + struct.pack(">II", index, count) + b"ssncPICT"
+
+        self.assertIsNone(reassembler.add(header(0, 0x7FFFFFFF) + b"x" * 10))
+        self.assertIsNone(reassembler.add(header(0, 0) + b"x" * 10))
+        self.assertIsNone(reassembler.add(header(0, 100) + b"x" * 20))
+        self.assertEqual(reassembler.stats(), {"completed": 0, "dropped": 0, "malformed": 3, "pending": 0})
+
+        # the buffer only grows up to the received chunks
+        self.assertIsNone(reassembler.add(header(1, 100) + b"x" * 10))
+        message = next(iter(reassembler._pending.values())) # pylint: disable=W0212
+        self.assertEqual(len(message.buffer), 20)
+
+
+class TestAirplayUDPListener(TestCase):
+    """
+    Class to test receiving datagrams with the AirplayUDPListener.
+    """
+
+    def test_receive_buffers(self):
+        """
+        Items which are kept after their receive buffer was reused should keep their data.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((LOCALHOST, 0))
+        address = sock.getsockname()
+        sock.close()
+
+        listener = AirplayUDPListener(socket_address=address[0], socket_port=address[1], receive_buffers=2)
+        kept_items = []
+        listener.bind(item=lambda _, item: kept_items.append(item))
+        thread = Thread(target=listener.parse_socket)
+        thread.daemon = True
+        thread.start()
+        sleep(0.1)
+
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        names = [b"First", b"Second", b"Third", b"Fourth"]
+        for name in names:
+            sender.sendto(b"ssncclip" + name, address)
+            sleep(0.05)
+        sender.close()
+        listener._is_listening = False # pylint: disable=W0212
+
+        self.assertEqual([item.data_bytes for item in kept_items], names)
+
+    def test_processing_queue(self):
+        """
+        Items should be processed on a separate thread if a queue is used and the drops should be counted.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((LOCALHOST, 0))
+        address = sock.getsockname()
+        sock.close()
+
+        listener = AirplayUDPListener(socket_address=address[0], socket_port=address[1], rcvbuf_size=1 << 20,
+                                      queue_size=2)
+        threads = []
+        listener.bind(user_agent=lambda *_: threads.append(current_thread()))
+        thread = Thread(target=listener.parse_socket)
+        thread.daemon = True
+        thread.start()
+        sleep(0.1)
+
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.sendto(b"ssncsnuaAirPlay/371.4.7", address)
+        sender.close()
+        sleep(0.1)
+        listener._is_listening = False # pylint: disable=W0212
+
+        self.assertEqual(listener.user_agent, "AirPlay/371.4.7")
+        self.assertEqual(len(threads), 1)
+        self.assertNotIn(threads[0], (thread, current_thread()))
+        self.assertEqual(listener.drop_counts["queue"], 0)
+        self.assertIn(listener.drop_counts["kernel"], (0, None))
+
+    def test_stop_blocked_queue(self):
+        """
+        Stopping the listener should wake up the receiving thread while it waits for room in a full blocking queue.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((LOCALHOST, 0))
+        address = sock.getsockname()
+        sock.close()
+
+        listener = AirplayUDPListener(socket_address=address[0], socket_port=address[1], queue_size=1,
+                                      overflow_policy=BLOCK)
+        release = Event()
+        listener.bind(user_agent=lambda *_: release.wait(5))
+        thread = Thread(target=listener.parse_socket)
+        thread.daemon = True
+        thread.start()
+        sleep(0.1)
+
+        # the first item blocks the processing thread, the second one fills the queue
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for name in (b"First", b"Second", b"Third"):
+            sender.sendto(b"ssncsnua" + name, address)
+        sender.close()
+        sleep(0.1)
+        self.assertTrue(thread.is_alive())
+
+        listener.stop_listening()
+        thread.join(2)
+        release.set()
+        self.assertFalse(thread.is_alive())
+
+
+if __name__ == "__main__":
+    main()
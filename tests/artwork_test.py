@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Test storing the artwork.
+"""
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import TestCase, main, skipIf
+
+from shairportmetadatareader.artwork import ArtworkStore, ArtworkIndex, PILImage, default_store
+from shairportmetadatareader.codetable import SSNC
+from shairportmetadatareader.item import Item
+from shairportmetadatareader.listener.airplaylistener import AirplayListener
+from shairportmetadatareader.util import image_extension
+
+JPEG = b"\xff\xd8\xff\xe0" + b"j" * 96
+PNG = b"\x89PNG\r\n\x1a\n" + b"p" * 92
+GIF = b"GIF89a" + b"g" * 94
+
+
+class TestArtworkStore(TestCase):
+    """
+    Class to test the ArtworkStore.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_image_extension(self):
+        """
+        The image type should be detected from the magic bytes.
+        """
+        self.assertEqual(image_extension(JPEG), ".jpg")
+        self.assertEqual(image_extension(PNG), ".png")
+        self.assertEqual(image_extension(b"RIFF\x00\x00\x00\x00WEBPVP8 "), ".webp")
+        self.assertEqual(image_extension(b"unknown", default=".bin"), ".bin")
+
+    def test_memory_tier(self):
+        """
+        Without a directory only the most recently used images are kept in memory.
+        """
+        store = ArtworkStore(directory=None, max_memory_items=2)
+        jpeg_key = store.put(JPEG)
+        png_key = store.put(PNG)
+        self.assertEqual(store.get(jpeg_key), JPEG)  # jpeg is now the most recently used image
+        gif_key = store.put(GIF)
+
+        self.assertIsNone(store.get(png_key))
+        self.assertEqual((store.get(jpeg_key), store.get(gif_key)), (JPEG, GIF))
+        self.assertIsNone(store.path(jpeg_key))
+
+    def test_disk_tier(self):
+        """
+        Images should be deduplicated and the least recently used files deleted if the size limit is exceeded.
+        """
+        store = ArtworkStore(directory=self.directory, max_memory_items=1, max_disk_bytes=250)
+        jpeg_key = store.put(JPEG)
+        self.assertEqual(store.put(JPEG), jpeg_key)
+        png_key = store.put(PNG)
+        self.assertEqual(store.disk_usage, 200)
+        self.assertTrue(store.path(jpeg_key).endswith(".jpg"))
+        self.assertEqual(store.get(jpeg_key), JPEG)  # loaded from disk
+
+        store.put(JPEG)  # mark as recently used => png is evicted
+        store.put(GIF)
+        self.assertIsNone(store.path(png_key))
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([jpeg_key + ".jpg", store.key_for(GIF) + ".gif"]))
+
+        # a new store picks up the existing files
+        self.assertEqual(ArtworkStore(directory=self.directory).disk_usage, 200)
+
+    def test_derived_files(self):
+        """
+        Files created from an image should count towards the disk limit and be deleted together with the image.
+        """
+        store = ArtworkStore(directory=self.directory, max_disk_bytes=250)
+        key = store.put(JPEG)
+        derived = os.path.join(self.directory, "thumbnail")
+        with open(derived, "wb") as file:
+            file.write(b"t" * 50)
+        self.assertTrue(store.attach(key, derived))
+        self.assertTrue(store.attach(key, derived))
+        self.assertEqual(store.disk_usage, 150)
+
+        store.put(PNG)
+        store.put(GIF)
+        self.assertFalse(os.path.exists(derived))
+        self.assertEqual(store.disk_usage, 200)
+
+        # files derived from an evicted image are deleted right away
+        with open(derived, "wb") as file:
+            file.write(b"t" * 50)
+        self.assertFalse(store.attach(key, derived))
+        self.assertFalse(os.path.exists(derived))
+
+    def test_listener_artwork(self):
+        """
+        The listener should publish the same path for a repeated cover.
+        """
+        listener = AirplayListener(artwork_store=ArtworkStore(directory=self.directory))
+        paths = []
+        # pylint: disable=W0212
+        for _ in range(2):
+            listener._process_item(Item(SSNC, "PICT", text=JPEG, length=len(JPEG), encoding="bytes"))
+            listener._process_item(Item(SSNC, "pcen", text=b"", length=0, encoding="bytes"))
+            paths.append(listener.artwork)
+        self.assertEqual(paths[0], paths[1])
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(paths[0])])
+
+    def test_default_store(self):
+        """
+        Listeners without an own store should share the default store.
+        """
+        first, second = AirplayListener(), AirplayListener()
+        self.assertIs(first.artwork_store, second.artwork_store)
+        self.assertIs(first.artwork_store, default_store())
+
+
+class TestArtworkIndex(TestCase):
+    """
+    Class to test the ArtworkIndex.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        """
+        Albums should be found by their id or by their name and artist, also after the index was reopened.
+        """
+        index = ArtworkIndex(ArtworkStore(directory=self.directory))
+        key = index.add(JPEG, {"songalbumid": 42, "songalbum": "Album", "songartist": "Artist"})
+        index.close()
+
+        index = ArtworkIndex(ArtworkStore(directory=self.directory))
+        self.assertEqual(index.lookup({"songalbumid": 42}), key)
+        self.assertEqual(index.lookup({"songalbum": "Album", "songartist": "Artist"}), key)
+        self.assertIsNone(index.lookup({"songalbum": "Album", "songartist": "Other"}))
+        # the index database is not mistaken for an image
+        self.assertEqual(index.store.disk_usage, len(JPEG))
+
+    def test_listener_index(self):
+        """
+        The listener should map the album of the current track to the received artwork.
+        """
+        listener = AirplayListener(artwork_index=ArtworkIndex(ArtworkStore(directory=self.directory)))
+        listener.track_info = {"songalbumid": 7}
+        # pylint: disable=W0212
+        listener._process_item(Item(SSNC, "PICT", text=PNG, length=len(PNG), encoding="bytes"))
+        self.assertEqual(listener.artwork_store.get(listener._artwork_index.lookup({"songalbumid": 7})), PNG)
+
+        # in coalescing mode the track info of the picture might not be published yet
+        listener = AirplayListener(artwork_index=listener._artwork_index, coalesce_interval=60)
+        listener.track_info = {"songalbumid": 7}
+        listener._set_state(track_info={"songalbumid": 8})
+        listener._process_item(Item(SSNC, "PICT", text=JPEG, length=len(JPEG), encoding="bytes"))
+        self.assertEqual(listener.artwork_store.get(listener._artwork_index.lookup({"songalbumid": 8})), JPEG)
+        self.assertEqual(listener.artwork_store.get(listener._artwork_index.lookup({"songalbumid": 7})), PNG)
+        listener.stop_listening()
+
+    @skipIf(PILImage is None, "pillow is not installed")
+    def test_thumbnails(self):
+        """
+        Thumbnails should be created once for each configured size.
+        """
+        image = BytesIO()
+        PILImage.new("RGB", (400, 200), (255, 0, 0)).save(image, "PNG")
+        index = ArtworkIndex(ArtworkStore(directory=self.directory), thumbnail_sizes=(100,))
+        key = index.add(image.getvalue(), {"songalbumid": 1})
+
+        path = index.thumbnail_for({"songalbumid": 1}, 100)
+        self.assertEqual(PILImage.open(path).size, (100, 50))
+        self.assertEqual(index.thumbnail(key, 100), path)
+        self.assertEqual(index.store.disk_usage, len(image.getvalue()) + os.path.getsize(path))
+
+        # truncated images are skipped
+        self.assertIsNone(index.thumbnail(index.add(PNG), 100))
+
+        # the thumbnails are deleted together with their image
+        index.store._max_disk_bytes = 0 # pylint: disable=W0212
+        index.add(JPEG)
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Test recording and replaying items.
+"""
+import os
+import shutil
+import tempfile
+from time import monotonic, sleep
+from unittest import TestCase, main
+
+from shairportmetadatareader.capture import CaptureWriter, read_capture
+from shairportmetadatareader.codetable import SSNC, CORE
+from shairportmetadatareader.item import Item
+from shairportmetadatareader.listener.airplaylistener import AirplayListener
+from shairportmetadatareader.listener.airplayreplaylistener import AirplayReplayListener
+
+
+def make_item(item_type, code, data=b""):
+    """
+    Create an item with raw data.
+    """
+    return Item(item_type, code, length=len(data), text=data, encoding="bytes")
+
+
+class TestCapture(TestCase):
+    """
+    Class to test the capture format and the AirplayReplayListener.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "capture.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_and_append(self):
+        """
+        Items recorded by a listener should be read back and new records should be appended.
+        """
+        listener = AirplayListener()
+        listener.recorder = CaptureWriter(self.path)
+        listener._process_item(make_item(SSNC, "snua", b"AirPlay/371.4.7")) # pylint: disable=W0212
+        listener.recorder.close()
+
+        with CaptureWriter(self.path) as writer:
+            writer.write(make_item(SSNC, "pfls"), timestamp=10.0)
+            writer.write(make_item(CORE, "minm", b"Track"), timestamp=10.5)
+
+        # a partially written record is ignored
+        with open(self.path, "ab") as file:
+            file.write(b"\x00\x00")
+
+        records = list(read_capture(self.path))
+        self.assertEqual([(item.type, item.code, item.data_bytes) for _, item in records],
+                         [(SSNC, "snua", b"AirPlay/371.4.7"), (SSNC, "pfls", None), (CORE, "minm", b"Track")])
+        self.assertEqual([timestamp for timestamp, _ in records[1:]], [10.0, 10.5])
+
+        with open(self.path, "wb") as file:
+            file.write(b"no capture")
+        with self.assertRaises(ValueError):
+            list(read_capture(self.path))
+
+    def test_replay(self):
+        """
+        The replay listener should keep the timing scaled by the speed or replay as fast as possible.
+        """
+        with CaptureWriter(self.path) as writer:
+            writer.write(make_item(SSNC, "snua", b"AirPlay/371.4.7"), timestamp=0.0)
+            writer.write(make_item(SSNC, "pfls"), timestamp=2.0)
+
+        listener = AirplayReplayListener(capture_file=self.path, speed=10)
+        start = monotonic()
+        self.assertEqual(listener.replay(), 2)
+        self.assertGreaterEqual(monotonic() - start, 0.19)
+        self.assertEqual((listener.user_agent, listener.playback_state), ("AirPlay/371.4.7", "pause"))
+
+        listener = AirplayReplayListener(capture_file=self.path, speed=None)
+        start = monotonic()
+        self.assertEqual(listener.replay(), 2)
+        self.assertLess(monotonic() - start, 0.19)
+
+    def test_stop_progress_updates(self):
+        """
+        Stopping the replay should stop updating the playback position.
+        """
+        with CaptureWriter(self.path) as writer:
+            writer.write(make_item(SSNC, "prsm"), timestamp=0.0)
+            writer.write(make_item(SSNC, "prgr", b"0/441000/13230000"), timestamp=0.0)
+
+        listener = AirplayReplayListener(capture_file=self.path, speed=None, progress_interval=0.01)
+        positions = []
+        listener.bind(playback_position=lambda _, position: positions.append(position))
+        listener.replay()
+        sleep(0.05)
+        listener.stop_listening()
+        updates = len(positions)
+        self.assertGreater(updates, 1)
+        sleep(0.05)
+        self.assertEqual(len(positions), updates)
+        self.assertIsNone(listener._progress_timer) # pylint: disable=W0212
+
+        # a progress message after the stop does not start the timer again
+        listener._process_item(make_item(SSNC, "prgr", b"0/441000/13230000")) # pylint: disable=W0212
+        self.assertIsNone(listener._progress_timer) # pylint: disable=W0212
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,8 @@
 Basic tests for the item class.
 """
 from unittest import TestCase, main
-from shairportmetadatareader.item import Item
-from shairportmetadatareader.codetable import SSNC
+from shairportmetadatareader.item import Item, decode_int_items
+from shairportmetadatareader.codetable import SSNC, CORE
 
 class TestItem(TestCase):
     """
@@ -26,5 +26,54 @@ class TestItem(TestCase):
         self.assertRaises(ValueError, Item, SSNC, "pcst", 10, "", encoding="base64")
         self.assertRaises(ValueError, Item, SSNC, "pcst", -1, "", encoding="base64")
 
+    def test_from_pipe_fields(self):
+        """
+        Check creating an item from the raw pipe fields.
+        """
+        expected_item = Item(SSNC, "pcst", 10, "MjkzNDE5NDIzMg==", encoding="base64")
+        self.assertEqual(Item.from_pipe_fields(b"73736e63", b"70637374", 10, b"MjkzNDE5NDIzMg=="), expected_item)
+        self.assertEqual(Item.from_pipe_fields("73736e63", "70637374", 10, "MjkzNDE5NDIzMg=="), expected_item)
+
+        # unknown codes are decoded as well
+        self.assertEqual(Item.from_pipe_fields(b"73736e63", b"78797a77", 0).code, "xyzw")
+
+        # This should fail
+        self.assertIsNone(Item.from_pipe_fields(b"73736e6", b"70637374", 10, b"MjkzNDE5NDIzMg=="))
+        self.assertIsNone(Item.from_pipe_fields(b"73736e63", b"70637374", 0, b"MjkzNDE5NDIzMg=="))
+
+    def test_lazy_decoding(self):
+        """
+        Check that the data is only decoded when it is accessed.
+        """
+        payload = b"MjkzNDE5NDIzMg=="
+        item = Item(SSNC, "pcst", 10, memoryview(payload), encoding="base64")
+        self.assertIsNone(item._data) # pylint: disable=W0212
+        self.assertEqual(item.data_bytes, b"2934194232")
+        self.assertEqual(item.data_base64, payload.decode("ascii"))
+
+        item = Item(SSNC, "snua", 4, memoryview(b"ssncsnuaTest")[8:], encoding="bytes")
+        self.assertEqual(item.data_str, "Test")
+        self.assertEqual(item.data_base64, b"VGVzdA==\n")
+
+    def test_data_int(self):
+        """
+        Check decoding integers including bytes with leading zeros.
+        """
+        item = Item(CORE, "astm", 4, b"\x00\x03\x04\xc0", encoding="bytes")
+        self.assertEqual(item.data_int, 0x304c0)
+
+    def test_decode_int_items(self):
+        """
+        Check decoding many integer items at once.
+        """
+        items = [Item(CORE, "astm", 4, b"\x00\x03\x04\xc0", encoding="bytes"),
+                 Item(CORE, "astn", 2, b"\x00\x07", encoding="bytes"),
+                 Item(CORE, "asyr", 2, b"\x07\xe3", encoding="bytes"),
+                 Item(CORE, "mper", 8, b"\x77\x1d\x3c\x84\x6e\x58\x7f\xc8", encoding="bytes"),
+                 Item(CORE, "asai", 3, b"\x01\x00\x01", encoding="bytes"),
+                 Item(CORE, "astc", 0)]
+        self.assertEqual(list(decode_int_items(items)), [item.data_int or 0 for item in items])
+        self.assertEqual(list(decode_int_items(items[:1])), [0x304c0])
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Test the overflow policies of the ItemQueue.
+"""
+from threading import Thread
+from unittest import TestCase, main
+
+from shairportmetadatareader.item import Item
+from shairportmetadatareader.itemqueue import ItemQueue, BLOCK, COALESCE, DROP_OLDEST_PROGRESS
+
+
+def make_item(code, data=b""):
+    """
+    Create a ssnc item with the given code.
+    """
+    return Item("ssnc", code, text=data, length=len(data), encoding="bytes")
+
+
+class TestItemQueue(TestCase):
+    """
+    Class to test the ItemQueue.
+    """
+
+    def drain(self, queue):
+        """
+        :return: list of (code, data) of all queued items
+        """
+        items = []
+        while queue:
+            item = queue.get()
+            items.append((item.code, item.data_bytes))
+        return items
+
+    def test_drop_oldest_progress(self):
+        """
+        A full queue should drop the oldest progress item before any other item.
+        """
+        queue = ItemQueue(3, DROP_OLDEST_PROGRESS)
+        queue.put(make_item("snua", b"a"))
+        queue.put(make_item("prgr", b"1"))
+        queue.put(make_item("prgr", b"2"))
+        queue.put(make_item("pfls"))
+        self.assertEqual(self.drain(queue), [("snua", b"a"), ("prgr", b"2"), ("pfls", None)])
+        self.assertEqual(queue.dropped, 1)
+
+    def test_coalesce(self):
+        """
+        A full queue should replace the queued item with the same code in place.
+        """
+        queue = ItemQueue(2, COALESCE)
+        queue.put(make_item("pvol", b"1"))
+        queue.put(make_item("snua", b"a"))
+        queue.put(make_item("pvol", b"2"))
+        self.assertEqual(self.drain(queue), [("pvol", b"2"), ("snua", b"a")])
+
+        # without a matching item the oldest one is dropped
+        queue.put(make_item("pvol", b"1"))
+        queue.put(make_item("snua", b"a"))
+        queue.put(make_item("pfls"))
+        self.assertEqual(self.drain(queue), [("snua", b"a"), ("pfls", None)])
+        self.assertEqual(queue.dropped, 2)
+
+        # track fields are never replaced, they would be moved to another track
+        queue = ItemQueue(3, COALESCE)
+        queue.put(make_item("minm", b"Track 1"))
+        queue.put(make_item("mden"))
+        queue.put(make_item("prgr", b"1"))
+        queue.put(make_item("minm", b"Track 2"))
+        self.assertEqual(self.drain(queue), [("minm", b"Track 1"), ("mden", None), ("minm", b"Track 2")])
+
+    def test_block(self):
+        """
+        A full queue should block the producer until an item was removed.
+        """
+        queue = ItemQueue(1, BLOCK)
+        queue.put(make_item("prgr", b"1"))
+        producer = Thread(target=queue.put, args=(make_item("prgr", b"2"),))
+        producer.start()
+        producer.join(0.1)
+        self.assertTrue(producer.is_alive())
+
+        self.assertEqual(queue.get().data_bytes, b"1")
+        producer.join(1)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(self.drain(queue), [("prgr", b"2")])
+        self.assertEqual(queue.dropped, 0)
+
+        with self.assertRaises(ValueError):
+            ItemQueue(1, "unknown")
+
+
+if __name__ == "__main__":
+    main()
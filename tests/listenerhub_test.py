@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Test serving multiple zones with the listener hub.
+"""
+import os
+import socket
+import tempfile
+from unittest import TestCase, main
+
+from shairportmetadatareader.listener.listenerhub import ListenerHub
+
+
+LOCALHOST = "127.0.0.1"
+
+
+class TestListenerHub(TestCase):
+    """
+    Class to test the ListenerHub.
+    """
+
+    def test_zones(self):
+        """
+        Items of different zones should be routed to the listener of the zone.
+        """
+        hub = ListenerHub()
+        kitchen = hub.add_udp_zone("kitchen", socket_address=LOCALHOST, socket_port=0)
+        office = hub.add_udp_zone("office", socket_address=LOCALHOST, socket_port=0)
+        self.assertRaises(ValueError, hub.add_udp_zone, "office", socket_address=LOCALHOST, socket_port=0)
+
+        pipe_name = os.path.join(tempfile.mkdtemp(), "shairport-sync-metadata")
+        living_room = hub.add_pipe_zone("living_room", pipe_name=pipe_name)
+        os.mkfifo(pipe_name)
+
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # pylint: disable=W0212
+            sock.sendto(b"ssncsnuaKitchen/1.0", hub._zones["kitchen"].source.getsockname())
+            sock.sendto(b"ssncsnuaOffice/1.0", hub._zones["office"].source.getsockname())
+            sock.close()
+
+            processed = 0
+            while processed < 2:
+                processed += hub.poll(1)
+
+            # the pipe is opened on the next poll
+            hub.poll(0)
+            with open(pipe_name, "wb") as pipe:
+                pipe.write(b'<item><type>73736e63</type><code>736e7561</code><length>10</length><data encoding='
+                           b'"base64">TGl2aW5nLzEuMA==</data></item>')
+            while processed < 3:
+                processed += hub.poll(1)
+
+            self.assertEqual(kitchen.user_agent, "Kitchen/1.0")
+            self.assertEqual(office.user_agent, "Office/1.0")
+            self.assertEqual(living_room.user_agent, "Living/1.0")
+            self.assertIs(hub.zone("office"), office)
+
+            stats = hub.stats()
+            self.assertEqual(stats["kitchen"]["items"], 1)
+            self.assertEqual(stats["office"]["bytes"], 18)
+        finally:
+            hub.stop()
+            os.remove(pipe_name)
+        self.assertEqual(hub.zones, [])
+
+    def test_malformed_item(self):
+        """
+        An item which can not be processed should not stop the processing of the other items and zones.
+        """
+        hub = ListenerHub()
+        first = hub.add_udp_zone("a", socket_address=LOCALHOST, socket_port=0)
+        second = hub.add_udp_zone("b", socket_address=LOCALHOST, socket_port=0)
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # pylint: disable=W0212
+            sock.sendto(b"ssncprgrmalformed", hub._zones["a"].source.getsockname())
+            sock.sendto(b"ssncsnuaFirst/1.0", hub._zones["a"].source.getsockname())
+            sock.sendto(b"ssncsnuaSecond/1.0", hub._zones["b"].source.getsockname())
+            sock.close()
+
+            processed = 0
+            while processed < 3:
+                processed += hub.poll(1)
+
+            self.assertEqual((first.user_agent, second.user_agent), ("First/1.0", "Second/1.0"))
+            self.assertEqual((hub.stats()["a"]["errors"], hub.stats()["b"]["errors"]), (1, 0))
+        finally:
+            hub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Test the listener metrics and the Prometheus exporter.
+"""
+from unittest import TestCase, main
+from urllib.request import urlopen
+
+from shairportmetadatareader.codetable import SSNC
+from shairportmetadatareader.item import Item
+from shairportmetadatareader.listener.airplaylistener import AirplayListener
+from shairportmetadatareader.listener.airplaypipelistener import AirplayPipeListener
+from shairportmetadatareader.metrics import LatencyHistogram, ListenerMetrics, MetricsServer, prometheus_text
+
+# pvol -- -20.0,-20.0,-30.0,0.0
+VOLUME_ITEM = ("LTIwLjAsLTIwLjAsLTMwLjAsMC4w", 21)
+
+
+class TestListenerMetrics(TestCase):
+    """
+    Class to test the ListenerMetrics.
+    """
+
+    def test_latency_histogram(self):
+        """
+        Percentiles should be estimated by the upper bound of their bucket.
+        """
+        histogram = LatencyHistogram(bounds=(0.001, 0.01, 0.1))
+        self.assertIsNone(histogram.percentile(50))
+        for duration in (0.0005, 0.0005, 0.005, 0.05, 1.0):
+            histogram.record(duration)
+        self.assertEqual(histogram.buckets, [2, 1, 1, 1])
+        self.assertEqual(histogram.percentile(50), 0.01)
+        self.assertEqual(histogram.percentile(99), 1.0)
+
+    def test_snapshot(self):
+        """
+        Items, bytes, parse failures and callback durations should be counted.
+        """
+        now = [100.0]
+        listener = AirplayPipeListener(pipe_name="/tmp/unused",
+                                       metrics=ListenerMetrics(time_callbacks=True, clock=lambda: now[0]))
+        self.assertIsNone(listener.metrics.snapshot()["seconds_since_last_item"])
+        listener.bind(volume=lambda *_: None)
+
+        # pylint: disable=W0212
+        listener._tokenizer.feed(b"<item><type>73736e63</type><code>70666c73</code></item>")  # missing length
+        for _ in range(2):
+            listener._process_item(Item(SSNC, "pvol", VOLUME_ITEM[1], VOLUME_ITEM[0], encoding="base64"))
+        now[0] = 102.5
+
+        snapshot = listener.metrics.snapshot()
+        self.assertEqual(snapshot["items"], {"ssnc/pvol": 2})
+        self.assertEqual(snapshot["bytes"], {"ssnc/pvol": 42})
+        self.assertEqual((snapshot["parse_failures"], snapshot["chunk_failures"]), (1, 0))
+        self.assertEqual(snapshot["seconds_since_last_item"], 2.5)
+        # the volume only changed once
+        self.assertEqual(list(snapshot["callbacks"].values())[0]["count"], 1)
+
+    def test_prometheus_endpoint(self):
+        """
+        The metrics of all zones should be served in the Prometheus text format.
+        """
+        listener = AirplayListener(metrics=ListenerMetrics(time_callbacks=True))
+        listener.bind(volume=lambda *_: None)
+        item = Item(SSNC, "pvol", VOLUME_ITEM[1], VOLUME_ITEM[0], encoding="base64")
+        listener._process_item(item) # pylint: disable=W0212
+
+        text = prometheus_text({"kitchen": listener})
+        self.assertIn('shairport_items_total{code="pvol",type="ssnc",zone="kitchen"} 1', text)
+        self.assertIn("# TYPE shairport_callback_duration_seconds histogram", text)
+        self.assertIn('le="+Inf",zone="kitchen"} 1', text)
+
+        server = MetricsServer({"kitchen": listener}, port=0)
+        server.start()
+        try:
+            response = urlopen("http://{0}:{1}/metrics".format(*server.address), timeout=5)
+            self.assertEqual(response.status, 200)
+            self.assertIn('shairport_items_total{code="pvol",type="ssnc",zone="kitchen"} 1',
+                          response.read().decode("utf-8"))
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
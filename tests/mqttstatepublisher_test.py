@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Test publishing the listener state as retained snapshots. The tests are skipped if paho-mqtt is not installed.
+"""
+import json
+from time import sleep
+from unittest import TestCase, main, skipIf
+
+from shairportmetadatareader.listener.airplaylistener import AirplayListener
+from shairportmetadatareader.artwork import ArtworkStore
+from shairportmetadatareader.item import Item
+from shairportmetadatareader.codetable import SSNC
+
+try:
+    from shairportmetadatareader.listener.mqttstatepublisher import MQTTStatePublisher
+except ImportError:
+    MQTTStatePublisher = None
+
+
+class FakeClient(object): # pylint: disable=R0205, R0903
+    """
+    Stand-in for paho.mqtt.client.Client which records the published messages.
+    """
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """
+        Record a published message.
+        """
+        self.messages.append((topic, payload, qos, retain))
+
+
+def volume_item(volume):
+    """
+    :return: pvol item with the given airplay volume
+    """
+    data = "{0:.2f},-30.00,-96.30,0.00".format(volume).encode()
+    return Item(SSNC, "pvol", text=data, length=len(data), encoding="bytes")
+
+
+@skipIf(MQTTStatePublisher is None, "paho-mqtt is not installed")
+class TestMQTTStatePublisher(TestCase):
+    """
+    Class to test the MQTTStatePublisher without a broker.
+    """
+
+    def test_publish(self):
+        """
+        Changes should be published as retained json snapshot, unchanged snapshots are suppressed.
+        """
+        listener = AirplayListener(artwork_store=ArtworkStore(directory=None))
+        publisher = MQTTStatePublisher(listener, "shairport/kitchen", min_interval=0)
+        client = publisher._client = FakeClient() # pylint: disable=W0212
+
+        listener._process_item(volume_item(-15)) # pylint: disable=W0212
+        snapshots = [message for message in client.messages if message[0] == "shairport/kitchen"]
+        self.assertTrue(all(retain for _, _, _, retain in snapshots))
+        self.assertEqual(json.loads(snapshots[-1][1].decode())["airplay_volume"], 0.5)
+        self.assertIn(("shairport/kitchen/artwork", b"", 1, True), client.messages)
+
+        published = publisher.published
+        self.assertFalse(publisher.publish())
+        self.assertTrue(publisher.publish(force=True))
+        self.assertEqual((publisher.published, publisher.suppressed), (published + 1, 1))
+
+    def test_rate_limit(self):
+        """
+        Changes within the minimum interval should be published together once the interval elapsed.
+        """
+        listener = AirplayListener()
+        publisher = MQTTStatePublisher(listener, "shairport/kitchen", min_interval=0.1, publish_artwork=False)
+        client = publisher._client = FakeClient() # pylint: disable=W0212
+
+        for volume in (-20, -15, -10):
+            listener._process_item(volume_item(volume)) # pylint: disable=W0212
+        self.assertEqual(len(client.messages), 1)
+
+        sleep(0.3)
+        self.assertEqual(len(client.messages), 2)
+        self.assertAlmostEqual(json.loads(client.messages[-1][1].decode())["airplay_volume"], 2 / 3.0)
+
+    def test_stop(self):
+        """
+        A stopped publisher should publish the pending changes and ignore all later changes.
+        """
+        listener = AirplayListener()
+        publisher = MQTTStatePublisher(listener, "shairport/kitchen", min_interval=0.1, publish_artwork=False)
+        publisher._client = FakeClient() # pylint: disable=W0212
+
+        listener._process_item(volume_item(-20)) # pylint: disable=W0212
+        listener._process_item(volume_item(-15)) # pylint: disable=W0212
+        publisher._client = None # pylint: disable=W0212
+        publisher.stop()
+        self.assertEqual(publisher.published, 2)
+
+        listener._process_item(volume_item(-10)) # pylint: disable=W0212
+        sleep(0.2)
+        self.assertEqual(publisher.published, 2)
+        self.assertIsNone(publisher._timer) # pylint: disable=W0212
+
+    def test_serializer(self):
+        """
+        Unknown serializers should be rejected.
+        """
+        with self.assertRaises(ValueError):
+            MQTTStatePublisher(AirplayListener(), "shairport/kitchen", serializer="xml")
+
+
+if __name__ == "__main__":
+    main()
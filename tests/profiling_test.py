@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Test the sampled stage profiler.
+"""
+from time import sleep
+from threading import Thread
+from unittest import TestCase, main
+
+from shairportmetadatareader.listener.airplaypipelistener import AirplayPipeListener
+from shairportmetadatareader.listener.airplayudplistener import AirplayUDPListener
+from shairportmetadatareader.codetable import SSNC
+from shairportmetadatareader.item import Item
+from shairportmetadatareader.profiling import StageProfiler
+
+# pvol -- -20.0,-20.0,-30.0,0.0
+VOLUME_ITEM = b'<item><type>73736e63</type><code>70766f6c</code><length>21</length>\n<data encoding="base64">\n' \
+              b'LTIwLjAsLTIwLjAsLTMwLjAsMC4w</data></item>\n'
+
+
+class TestStageProfiler(TestCase):
+    """
+    Class to test the StageProfiler hooks.
+    """
+
+    def test_pipe_stages(self):
+        """
+        All stages of a sampled item should be measured, nothing should be measured while disabled.
+        """
+        profiler = StageProfiler(sample_rate=1.0)
+        listener = AirplayPipeListener(pipe_name="/tmp/unused", profiler=profiler)
+        listener.bind(volume=lambda *_: sleep(0.01))
+        tokenizer = listener._tokenizer # pylint: disable=W0212
+
+        for item in tokenizer.feed(VOLUME_ITEM):
+            listener._process_item(item) # pylint: disable=W0212
+        self.assertEqual(profiler.report(), {})
+
+        profiler.enable()
+        listener.volume = 0
+        for item in tokenizer.feed(VOLUME_ITEM):
+            listener._process_item(item) # pylint: disable=W0212
+
+        report = profiler.report()
+        self.assertEqual(sorted(report), ["decode", "dispatch", "framing", "item", "process"])
+        self.assertEqual(report["item"]["pvol"]["count"], 1)
+        # the time spent in the callback is only counted as dispatch
+        self.assertGreaterEqual(report["dispatch"]["volume"]["total_us"], 10000)
+        self.assertLess(report["process"]["pvol"]["total_us"], 10000)
+        self.assertIn("dispatch", profiler.format_report())
+
+    def test_udp_stages(self):
+        """
+        Chunked datagrams should be measured as framing, other datagrams as item creation.
+        """
+        profiler = StageProfiler(sample_rate=1.0, enabled=True)
+        listener = AirplayUDPListener(profiler=profiler)
+        listener._process_datagram(b"ssncchnk\x00\x00\x00\x00\x00\x00\x00\x01ssncPICTabc") # pylint: disable=W0212
+        listener._process_datagram(b"ssncpfls") # pylint: disable=W0212
+
+        report = profiler.report()
+        self.assertEqual(report["framing"]["PICT"]["count"], 1)
+        self.assertEqual(report["item"]["pfls"]["count"], 1)
+
+    def test_other_threads(self):
+        """
+        Callbacks running on other threads during a sampled item should not be measured as part of the item.
+        """
+        profiler = StageProfiler(sample_rate=1.0, enabled=True)
+        callback = profiler.wrap("volume", lambda: sleep(0.01))
+
+        def handle(_):
+            thread = Thread(target=callback)
+            thread.start()
+            thread.join()
+
+        profiler.process_item(Item(SSNC, "pvol", text=b"", length=0, encoding="bytes"), handle)
+        report = profiler.report()
+        self.assertNotIn("dispatch", report)
+        self.assertEqual(report["process"]["pvol"]["count"], 1)
+
+
+if __name__ == "__main__":
+    main()
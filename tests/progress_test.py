@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Test the interpolation of the playback position.
+"""
+from unittest import TestCase, main
+
+from shairportmetadatareader.progress import PlaybackProgress, rtp_difference
+
+
+class FakeClock(object): # pylint: disable=R0205, R0903
+    """
+    Clock which only advances when it is told to.
+    """
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPlaybackProgress(TestCase):
+    """
+    Class to test the PlaybackProgress.
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.progress = PlaybackProgress(sample_rate=100, clock=self.clock)
+
+    def test_rtp_difference(self):
+        """
+        Differences should handle the wrap around of the RTP timestamps.
+        """
+        self.assertEqual(rtp_difference(100, 250), 150)
+        self.assertEqual(rtp_difference(2 ** 32 - 50, 100), 150)
+        self.assertEqual(rtp_difference(250, 100), -150)
+
+    def test_interpolation(self):
+        """
+        The position should advance with the clock until the end of the track.
+        """
+        self.assertIsNone(self.progress.position_at())
+        self.assertEqual(self.progress.update(1000, 2000, 31000), (10.0, 300.0))
+        self.clock.now += 5
+        self.assertEqual(self.progress.position_at(), 15.0)
+        self.assertEqual(self.progress.position_at(self.clock.now + 1000), 300.0)
+
+        # the current frame might be before the start of the track
+        self.assertEqual(self.progress.update(1000, 900, 31000, playing=False), (0.0, 300.0))
+        self.clock.now += 5
+        self.assertEqual(self.progress.position_at(), 0.0)
+
+    def test_pause_resume(self):
+        """
+        The position should not advance while the playback is paused.
+        """
+        self.progress.update(0, 1000, 30000)
+        self.clock.now += 2
+        self.progress.pause()
+        self.clock.now += 10
+        self.assertEqual(self.progress.position_at(), 12.0)
+
+        self.progress.resume()
+        self.progress.resume()  # a second resume should not move the anchor
+        self.clock.now += 3
+        self.assertEqual(self.progress.position_at(), 15.0)
+        self.assertTrue(self.progress.playing)
+
+        self.progress.reset()
+        self.assertIsNone(self.progress.position_at())
+        self.assertFalse(self.progress.playing)
+
+
+if __name__ == "__main__":
+    main()
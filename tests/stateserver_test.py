@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Test serving the listener state over http, server sent events and websockets on the loopback interface.
+"""
+import json
+import asyncio
+from unittest import TestCase, main
+
+from shairportmetadatareader.listener.airplaylistener import AirplayListener
+from shairportmetadatareader.stateserver import StateServer, read_websocket_frame, websocket_accept, websocket_frame, \
+    WS_TEXT, WS_CLOSE, _Subscriber
+from shairportmetadatareader.artwork import ArtworkStore
+from shairportmetadatareader.item import Item
+from shairportmetadatareader.codetable import SSNC
+
+
+def ssnc_item(code, data=b""):
+    """
+    :return: ssnc item with the given raw data
+    """
+    return Item(SSNC, code, text=data, length=len(data), encoding="bytes")
+
+
+async def request(server, path, headers=()):
+    """
+    Send a GET request.
+    :return: tuple of (status code, headers, body)
+    """
+    reader, writer = await asyncio.open_connection(*server.address)
+    lines = ["GET {0} HTTP/1.1".format(path), "Connection: close"] + ["{0}: {1}".format(*header) for header in headers]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+    response = await asyncio.wait_for(reader.read(), 2)
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    head = head.decode().split("\r\n")
+    response_headers = dict(line.lower().split(": ", 1) for line in head[1:])
+    return int(head[0].split()[1]), response_headers, body
+
+
+class TestStateServer(TestCase):
+    """
+    Class to test the StateServer.
+    """
+
+    def setUp(self):
+        self.listener = AirplayListener(artwork_store=ArtworkStore(directory=None))
+
+    def test_state_and_artwork(self):
+        """
+        State and artwork should be served with an ETag and 304 if the client has the current version.
+        """
+        async def run():
+            server = StateServer(self.listener, port=0)
+            await server.start()
+            try:
+                status, headers, body = await request(server, "/state")
+                self.assertEqual((status, json.loads(body.decode())["playback_state"]), (200, "stop"))
+                status, _, _ = await request(server, "/state", [("If-None-Match", headers["etag"])])
+                self.assertEqual(status, 304)
+                self.assertEqual((await request(server, "/artwork"))[0], 404)
+                self.assertEqual((await request(server, "/unknown"))[0], 404)
+
+                # pylint: disable=W0212
+                self.listener._process_item(ssnc_item("PICT", b"\x89PNG\r\n\x1a\nimage"))
+                self.listener._process_item(ssnc_item("pcen"))
+                await asyncio.sleep(0.05)
+                status, headers, body = await request(server, "/artwork")
+                self.assertEqual((status, headers["content-type"], body), (200, "image/png", b"\x89PNG\r\n\x1a\nimage"))
+                self.assertEqual(headers["etag"], '"{0}"'.format(ArtworkStore.key_for(body)))
+            finally:
+                await server.stop()
+        asyncio.run(run())
+
+    def test_server_sent_events(self):
+        """
+        SSE clients should receive the full state followed by the changed properties.
+        """
+        async def run():
+            server = StateServer(self.listener, port=0)
+            await server.start()
+            try:
+                reader, writer = await asyncio.open_connection(*server.address)
+                writer.write(b"GET /events HTTP/1.1\r\n\r\n")
+                await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 2)
+                event = await asyncio.wait_for(reader.readuntil(b"\n\n"), 2)
+                self.assertTrue(event.startswith(b"event: state\ndata: "))
+
+                self.listener._process_item(ssnc_item("pfls")) # pylint: disable=W0212
+                event = await asyncio.wait_for(reader.readuntil(b"\n\n"), 2)
+                self.assertEqual(event, b'event: delta\ndata: {"playback_state":"pause"}\n\n')
+                self.assertEqual(server.client_count, 1)
+                writer.close()
+            finally:
+                await server.stop()
+        asyncio.run(run())
+
+    def test_websocket(self):
+        """
+        Websocket clients should receive the full state followed by the changed properties.
+        """
+        async def run():
+            server = StateServer(self.listener, port=0)
+            await server.start()
+            try:
+                reader, writer = await asyncio.open_connection(*server.address)
+                writer.write(b"GET /ws HTTP/1.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                             b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n\r\n")
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 2)
+                self.assertIn(b"101 Switching Protocols", head)
+                self.assertIn(websocket_accept("dGhlIHNhbXBsZSBub25jZQ==").encode(), head)
+
+                opcode, payload = await asyncio.wait_for(read_websocket_frame(reader), 2)
+                self.assertEqual((opcode, json.loads(payload.decode())["type"]), (WS_TEXT, "state"))
+
+                self.listener._process_item(ssnc_item("pfls")) # pylint: disable=W0212
+                opcode, payload = await asyncio.wait_for(read_websocket_frame(reader), 2)
+                self.assertEqual(json.loads(payload.decode()), {"type": "delta",
+                                                                "changes": {"playback_state": "pause"}})
+
+                # masked close frame send by the client
+                writer.write(b"\x88\x80\x00\x00\x00\x00")
+                opcode, _ = await asyncio.wait_for(read_websocket_frame(reader), 2)
+                self.assertEqual(opcode, WS_CLOSE)
+                writer.close()
+            finally:
+                await server.stop()
+        asyncio.run(run())
+
+    def test_slow_client(self):
+        """
+        A client whose queue is full should be disconnected instead of delaying the other clients.
+        """
+        async def run():
+            subscriber = _Subscriber("sse", 2)
+            self.assertTrue(subscriber.send({"sse": b"first", "ws": b""}))
+            self.assertTrue(subscriber.send({"sse": b"second", "ws": b""}))
+            self.assertFalse(subscriber.send({"sse": b"third", "ws": b""}))
+            self.assertIsNone(await subscriber.queue.get())
+        asyncio.run(run())
+
+    def test_websocket_frame(self):
+        """
+        Long payloads should use the extended length fields.
+        """
+        self.assertEqual(websocket_frame(b"abc"), b"\x81\x03abc")
+        self.assertEqual(websocket_frame(b"a" * 300)[:4], b"\x81\x7e\x01\x2c")
+        self.assertEqual(websocket_frame(b"a" * 70000)[:10], b"\x81\x7f" + (70000).to_bytes(8, "big"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the incremental pipe tokenizer.
+"""
+from base64 import b64encode
+from unittest import TestCase, main
+
+from shairportmetadatareader.tokenizer import ItemTokenizer
+from shairportmetadatareader.item import Item
+from shairportmetadatareader.codetable import SSNC, CORE
+
+
+class TestItemTokenizer(TestCase):
+    """
+    Test splitting the pipe stream into items.
+    """
+
+    def test_feed_chunks(self):
+        """
+        Items split across multiple reads should be reassembled.
+        """
+        stream = b'<item><type>73736e63</type><code>70637374</code><length>10</length>\n' \
+                 b'<data encoding="base64">\nMjkzNDE5NDIzMg==</data></item>\n' \
+                 b'<item><type>73736e63</type><code>6d647374</code><length>0</length></item>\n'
+        tokenizer = ItemTokenizer()
+        items = []
+        for i in range(0, len(stream), 7):
+            items += tokenizer.feed(stream[i:i+7])
+
+        self.assertEqual(items, [Item(SSNC, "pcst", 10, "MjkzNDE5NDIzMg==", encoding="base64"),
+                                 Item(SSNC, "mdst", 0)])
+
+    def test_missing_closing_tag(self):
+        """
+        An item without closing tag should be parsed when the next item starts.
+        """
+        stream = b'<item><type>636f7265</type><code>6d696e6d</code><length>4</length>' \
+                 b'<data encoding="base64">VGVzdA==</data>' \
+                 b'<item><type>73736e63</type><code>6d64656e</code><length>0</length></item>'
+        items = ItemTokenizer().feed(stream)
+        self.assertEqual(len(items), 2)
+        self.assertEqual((items[0].type, items[0].code, items[0].data()), (CORE, "minm", "Test"))
+
+    def test_large_payload(self):
+        """
+        A large artwork should be decoded from many small chunks.
+        """
+        picture = bytes(bytearray(range(256))) * 8192
+        encoded = b64encode(picture)
+        stream = b'<item><type>73736e63</type><code>50494354</code><length>' + str(len(picture)).encode() + \
+                 b'</length><data encoding="base64">' + encoded + b'</data></item>'
+        tokenizer = ItemTokenizer()
+        items = []
+        for i in range(0, len(stream), 65536):
+            items += tokenizer.feed(stream[i:i+65536])
+
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].data(), picture)
+
+
+if __name__ == "__main__":
+    main()